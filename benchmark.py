@@ -0,0 +1,191 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from limits import create_limits
+
+# Benchmark harness. Every workload in benchmarks/ is run under every engine;
+# a workload states its expected output in "# expect:" comment lines, so a
+# fast but wrong engine shows up as wrong_output rather than as a win. For
+# each pair we record startup (read + parse/assemble), simulated instructions
+# per second and, in a second run under tracemalloc, peak Python memory.
+# Results are saved as JSON and can be compared against a stored baseline.
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+ENGINES = ['main', 'recursive', 'iterative', 'control_signal', 'machine']
+BENCHMARK_LIMITS = {'max_instructions': 1_000_000, 'max_seconds': 60}  # Workloads need well under this
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'baseline.json')
+DEFAULT_THRESHOLD = 0.15  # Relative change that counts as a regression
+
+def workloads(names=None):
+    # {name: path} of the .asm files in benchmarks/
+    found = {}
+    for entry in sorted(os.listdir(BENCHMARK_DIR)):
+        name, extension = os.path.splitext(entry)
+        if extension == '.asm' and (not names or name in names):
+            found[name] = os.path.join(BENCHMARK_DIR, entry)
+    return found
+
+def expected_output(file_path):
+    with open(file_path, 'r') as file:
+        return [line.split('expect:', 1)[1].strip() for line in file if line.startswith('# expect:')]
+
+def run_engine(engine, file_path, limits):
+    # Returns (startup seconds, run seconds, termination, output lines)
+    if engine == 'machine':
+        from machine import Machine
+        start = time.perf_counter()
+        machine = Machine.from_file(file_path, echo=False)
+        startup = time.perf_counter() - start
+        start = time.perf_counter()
+        termination = machine.run(create_limits(**limits))
+        return startup, time.perf_counter() - start, termination, machine.output
+    module = importlib.import_module(engine)
+    start = time.perf_counter()
+    instructions = module.read_asm_file(file_path)
+    parsed_instructions, labels, memory = module.parse_labels_and_instructions(instructions)
+    startup = time.perf_counter() - start
+    run = getattr(module, 'Run_simulation', None) or module.run_simulation
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        termination = run(parsed_instructions, labels, memory, limits=create_limits(**limits), sim_mode='a')
+    return startup, time.perf_counter() - start, termination, output.getvalue().splitlines()
+
+def measure(engine, file_path, limits, repeat=1, memory=True):
+    expected = expected_output(file_path)
+    best = None
+    for _ in range(repeat):
+        try:
+            startup, seconds, termination, output = run_engine(engine, file_path, limits)
+        except Exception as e:
+            return {'status': 'crash', 'detail': str(e)}
+        if best is None or seconds < best[1]:
+            best = (startup, seconds, termination, output)
+    startup, seconds, termination, output = best
+    if termination['reason'] != 'exit':
+        status = termination['reason']
+    elif all(line in output for line in expected):
+        status = 'ok'
+    else:
+        status = 'wrong_output'
+    result = {
+        'status': status,
+        'instructions': termination['instructions'],
+        'seconds': seconds,
+        'ips': termination['instructions'] / seconds if seconds else 0.0,
+        'startup': startup,
+    }
+    if memory and status == 'ok':
+        tracemalloc.start()
+        try:
+            run_engine(engine, file_path, limits)
+            result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        except Exception:
+            result['peak_memory'] = None
+        finally:
+            tracemalloc.stop()
+    return result
+
+def run_benchmarks(engines=ENGINES, names=None, limits=BENCHMARK_LIMITS, repeat=1, memory=True):
+    results = {}
+    # The engines write binary_code.txt into the working directory
+    previous = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix='mips-bench-'))
+    try:
+        for name, file_path in workloads(names).items():
+            results[name] = {}
+            for engine in engines:
+                result = measure(engine, file_path, limits, repeat, memory)
+                results[name][engine] = result
+                print(format_result(name, engine, result), flush=True)
+    finally:
+        os.chdir(previous)
+    return {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'limits': limits},
+        'results': results,
+    }
+
+def format_result(name, engine, result):
+    line = f"{name:<16} {engine:<15} {result['status']:<18}"
+    if 'ips' in result:
+        line += f" {result['instructions']:>9} inst {result['ips']:>11.0f} inst/s startup {result['startup'] * 1000:7.2f} ms"
+        if result.get('peak_memory') is not None:
+            line += f" peak {result['peak_memory'] / 1024:8.1f} KB"
+    return line
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    # Returns a list of regression messages
+    regressions = []
+    for name, engines in current['results'].items():
+        for engine, result in engines.items():
+            old = baseline['results'].get(name, {}).get(engine)
+            if old is None:
+                continue
+            where = f"{name}/{engine}"
+            if old['status'] == 'ok' and result['status'] != 'ok':
+                regressions.append(f"{where}: status {old['status']} -> {result['status']}")
+                continue
+            if result['status'] != 'ok':
+                continue
+            if old.get('ips') and result['ips'] < old['ips'] * (1 - threshold):
+                regressions.append(f"{where}: {result['ips']:.0f} inst/s, was {old['ips']:.0f} "
+                                   f"({100.0 * (result['ips'] / old['ips'] - 1):+.1f}%)")
+            if old.get('startup') and result['startup'] > old['startup'] * (1 + threshold) and \
+                    result['startup'] - old['startup'] > 0.001:
+                regressions.append(f"{where}: startup {result['startup'] * 1000:.2f} ms, "
+                                   f"was {old['startup'] * 1000:.2f} ms")
+            if old.get('peak_memory') and result.get('peak_memory') and \
+                    result['peak_memory'] > old['peak_memory'] * (1 + threshold):
+                regressions.append(f"{where}: peak memory {result['peak_memory']} bytes, was {old['peak_memory']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the guest workloads in benchmarks/ under every engine")
+    parser.add_argument('workloads', nargs='*', help="Workload names (default: all)")
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per pair; the fastest is kept")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc run")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', nargs='?', const=BASELINE_PATH,
+                        help=f"Results JSON to compare against (default {BASELINE_PATH})")
+    parser.add_argument('--save-baseline', action='store_true', help=f"Also store the results as {BASELINE_PATH}")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    saved = args.save_baseline and os.path.abspath(args.baseline or '') == BASELINE_PATH
+    if args.baseline and not saved and not os.path.isfile(args.baseline):
+        # Timings depend on the host, so no baseline ships with the repository
+        print(f"Error: no baseline at {args.baseline}; run benchmark.py --save-baseline first")
+        sys.exit(2)
+    engines = [engine for engine in args.engines.split(',') if engine]
+    current = run_benchmarks(engines, args.workloads, repeat=args.repeat, memory=not args.no_memory)
+    with open(args.output, 'w') as file:
+        json.dump(current, file, indent=2)
+    print(f"Results written to {args.output}")
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w') as file:
+            json.dump(current, file, indent=2)
+        print(f"Baseline stored in {BASELINE_PATH}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print("Regressions:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
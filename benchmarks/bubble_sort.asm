@@ -0,0 +1,50 @@
+# Bubble sort of 100 words in descending order, then a weighted checksum
+# expect: Output (int): 1
+# expect: Output (int): 100
+# expect: Output (int): 333300
+.data
+array: .word 100, 99, 98, 97, 96, 95, 94, 93, 92, 91, 90, 89, 88, 87, 86, 85, 84, 83, 82, 81, 80, 79, 78, 77, 76, 75, 74, 73, 72, 71, 70, 69, 68, 67, 66, 65, 64, 63, 62, 61, 60, 59, 58, 57, 56, 55, 54, 53, 52, 51, 50, 49, 48, 47, 46, 45, 44, 43, 42, 41, 40, 39, 38, 37, 36, 35, 34, 33, 32, 31, 30, 29, 28, 27, 26, 25, 24, 23, 22, 21, 20, 19, 18, 17, 16, 15, 14, 13, 12, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1
+.text
+main:
+    la $s0, array
+    li $s1, 100             # n
+    addi $s2, $s1, -1       # passes left
+outer:
+    add $t0, $s0, $zero     # p = &array[0]
+    add $t1, $s2, $zero     # comparisons this pass
+inner:
+    lw $t2, 0($t0)
+    lw $t3, 4($t0)
+    slt $t4, $t3, $t2
+    beq $t4, $zero, noswap
+    sw $t3, 0($t0)
+    sw $t2, 4($t0)
+noswap:
+    addi $t0, $t0, 4
+    addi $t1, $t1, -1
+    bne $t1, $zero, inner
+    addi $s2, $s2, -1
+    bne $s2, $zero, outer
+
+    lw $a0, 0($s0)          # smallest
+    li $v0, 1
+    syscall
+    lw $a0, 396($s0)        # largest
+    li $v0, 1
+    syscall
+
+    add $t0, $zero, $zero   # sum of i * array[i]
+    add $t5, $zero, $zero
+    add $t1, $s0, $zero
+checksum:
+    lw $t2, 0($t1)
+    mul $t3, $t2, $t0
+    add $t5, $t5, $t3
+    addi $t1, $t1, 4
+    addi $t0, $t0, 1
+    bne $t0, $s1, checksum
+    add $a0, $t5, $zero
+    li $v0, 1
+    syscall
+    li $v0, 10
+    syscall
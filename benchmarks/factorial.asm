@@ -0,0 +1,19 @@
+# Iterative factorial: 12! computed 3000 times
+# expect: Output (int): 479001600
+.text
+main:
+    li $s0, 3000            # repetitions
+outer:
+    li $t0, 1               # result
+    li $t1, 12              # n
+loop:
+    mul $t0, $t0, $t1
+    addi $t1, $t1, -1
+    bne $t1, $zero, loop
+    addi $s0, $s0, -1
+    bne $s0, $zero, outer
+    add $a0, $t0, $zero
+    li $v0, 1
+    syscall
+    li $v0, 10
+    syscall
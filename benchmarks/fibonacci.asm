@@ -0,0 +1,33 @@
+# Recursive Fibonacci: fib(18)
+# expect: Output (int): 2584
+.text
+main:
+    li $a0, 18
+    jal fib
+    add $a0, $v0, $zero
+    li $v0, 1
+    syscall
+    li $v0, 10
+    syscall
+
+fib:                        # $v0 = fib($a0)
+    addi $t1, $zero, 2
+    slt $t0, $a0, $t1
+    beq $t0, $zero, recurse
+    add $v0, $a0, $zero     # fib(0) = 0, fib(1) = 1
+    jr $ra
+recurse:
+    addi $sp, $sp, -12
+    sw $ra, 0($sp)
+    sw $a0, 4($sp)
+    addi $a0, $a0, -1
+    jal fib
+    sw $v0, 8($sp)
+    lw $a0, 4($sp)
+    addi $a0, $a0, -2
+    jal fib
+    lw $t2, 8($sp)
+    add $v0, $v0, $t2
+    lw $ra, 0($sp)
+    addi $sp, $sp, 12
+    jr $ra
@@ -0,0 +1,41 @@
+# Build a 64-node linked list in shuffled order, then sum it 400 times
+# expect: Output (int): 806400
+.data
+pool: .word 0
+.text
+main:
+    la $s0, pool
+    li $s1, 64              # nodes, 8 bytes each: value, next
+    add $t0, $zero, $zero   # index
+build:
+    sll $t1, $t0, 3
+    add $t1, $t1, $s0       # this node
+    sw $t0, 0($t1)          # value = index
+    addi $t2, $t0, 27       # next index = (index + 27) mod 64
+    andi $t2, $t2, 63
+    sll $t3, $t2, 3
+    add $t3, $t3, $s0
+    sw $t3, 4($t1)
+    addi $t0, $t0, 1
+    bne $t0, $s1, build
+    li $t1, 37              # node 37 leads back to node 0: end the list there
+    sll $t1, $t1, 3
+    add $t1, $t1, $s0
+    sw $zero, 4($t1)
+
+    li $s2, 400             # traversals
+    add $s3, $zero, $zero   # total
+walk:
+    add $t0, $s0, $zero
+visit:
+    lw $t1, 0($t0)
+    add $s3, $s3, $t1
+    lw $t0, 4($t0)
+    bne $t0, $zero, visit
+    addi $s2, $s2, -1
+    bne $s2, $zero, walk
+    add $a0, $s3, $zero
+    li $v0, 1
+    syscall
+    li $v0, 10
+    syscall
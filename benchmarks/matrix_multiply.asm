@@ -0,0 +1,58 @@
+# 14x14 integer matrix multiply C = A * B, then the sum of C
+# expect: Output (int): 95256
+.data
+A: .word 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26
+B: .word 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 2, 3, 4, 5, 6, 0, 1, 2, 3, 4, 5, 6, 0, 2, 4, 6, 1, 3, 5, 0, 2, 4, 6, 1, 3, 5, 0, 3, 6, 2, 5, 1, 4, 0, 3, 6, 2, 5, 1, 4, 0, 4, 1, 5, 2, 6, 3, 0, 4, 1, 5, 2, 6, 3, 0, 5, 3, 1, 6, 4, 2, 0, 5, 3, 1, 6, 4, 2, 0, 6, 5, 4, 3, 2, 1, 0, 6, 5, 4, 3, 2, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 2, 3, 4, 5, 6, 0, 1, 2, 3, 4, 5, 6, 0, 2, 4, 6, 1, 3, 5, 0, 2, 4, 6, 1, 3, 5, 0, 3, 6, 2, 5, 1, 4, 0, 3, 6, 2, 5, 1, 4, 0, 4, 1, 5, 2, 6, 3, 0, 4, 1, 5, 2, 6, 3, 0, 5, 3, 1, 6, 4, 2, 0, 5, 3, 1, 6, 4, 2, 0, 6, 5, 4, 3, 2, 1, 0, 6, 5, 4, 3, 2, 1
+C: .word 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0
+.text
+main:
+    la $s0, A
+    la $s1, B
+    la $s2, C
+    li $s3, 14              # N
+    add $t0, $zero, $zero   # i
+iloop:
+    add $t1, $zero, $zero   # j
+jloop:
+    add $t2, $zero, $zero   # k
+    add $t3, $zero, $zero   # C[i][j] accumulator
+kloop:
+    mul $t4, $t0, $s3       # &A[i][k]
+    add $t4, $t4, $t2
+    sll $t4, $t4, 2
+    add $t4, $t4, $s0
+    lw $t5, 0($t4)
+    mul $t6, $t2, $s3       # &B[k][j]
+    add $t6, $t6, $t1
+    sll $t6, $t6, 2
+    add $t6, $t6, $s1
+    lw $t7, 0($t6)
+    mul $t8, $t5, $t7
+    add $t3, $t3, $t8
+    addi $t2, $t2, 1
+    bne $t2, $s3, kloop
+    mul $t4, $t0, $s3       # &C[i][j]
+    add $t4, $t4, $t1
+    sll $t4, $t4, 2
+    add $t4, $t4, $s2
+    sw $t3, 0($t4)
+    addi $t1, $t1, 1
+    bne $t1, $s3, jloop
+    addi $t0, $t0, 1
+    bne $t0, $s3, iloop
+
+    add $t0, $zero, $zero   # checksum
+    add $t3, $zero, $zero
+    mul $t9, $s3, $s3
+    add $t1, $s2, $zero
+sum:
+    lw $t5, 0($t1)
+    add $t3, $t3, $t5
+    addi $t1, $t1, 4
+    addi $t0, $t0, 1
+    bne $t0, $t9, sum
+    add $a0, $t3, $zero
+    li $v0, 1
+    syscall
+    li $v0, 10
+    syscall
@@ -0,0 +1,33 @@
+# Sieve of Eratosthenes: count the primes below 3000
+# expect: Output (int): 430
+.data
+flags: .word 0
+.text
+main:
+    la $s0, flags           # one cell per number, nonzero = composite
+    li $s1, 3000            # limit
+    addi $t0, $zero, 2      # i
+    add $s2, $zero, $zero   # primes found
+    addi $t5, $zero, 1
+outer:
+    add $t1, $s0, $t0
+    lw $t2, 0($t1)
+    bne $t2, $zero, next
+    addi $s2, $s2, 1
+    mul $t3, $t0, $t0       # first multiple to strike out
+    slt $t4, $t3, $s1
+    beq $t4, $zero, next
+mark:
+    add $t1, $s0, $t3
+    sw $t5, 0($t1)
+    add $t3, $t3, $t0
+    slt $t4, $t3, $s1
+    bne $t4, $zero, mark
+next:
+    addi $t0, $t0, 1
+    bne $t0, $s1, outer
+    add $a0, $s2, $zero
+    li $v0, 1
+    syscall
+    li $v0, 10
+    syscall
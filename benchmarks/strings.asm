@@ -0,0 +1,47 @@
+# strlen and strcpy over a one-character-per-cell string, 300 times
+# expect: Output (int): 86
+# expect: Output (string):The quick brown fox jumps over the lazy dog
+.data
+src: .asciiz "The quick brown fox jumps over the lazy dog"
+dst: .asciiz "..........................................."
+.text
+main:
+    li $s0, 300             # repetitions
+repeat:
+    la $a0, src
+    jal strlen
+    add $s1, $v0, $zero
+    la $a0, dst
+    la $a1, src
+    jal strcpy
+    addi $s0, $s0, -1
+    bne $s0, $zero, repeat
+    la $a0, dst
+    jal strlen
+    add $a0, $v0, $s1       # length of the source plus length of the copy
+    li $v0, 1
+    syscall
+    la $a0, dst
+    li $v0, 4
+    syscall
+    li $v0, 10
+    syscall
+
+strlen:                     # $v0 = length of the string at $a0
+    add $v0, $zero, $zero
+strlen_loop:
+    add $t0, $a0, $v0
+    lw $t1, 0($t0)
+    beq $t1, $zero, strlen_done
+    addi $v0, $v0, 1
+    j strlen_loop
+strlen_done:
+    jr $ra
+
+strcpy:                     # copy the string at $a1 to $a0, terminator included
+    lw $t0, 0($a1)
+    sw $t0, 0($a0)
+    addi $a0, $a0, 1
+    addi $a1, $a1, 1
+    bne $t0, $zero, strcpy
+    jr $ra
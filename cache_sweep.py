@@ -0,0 +1,175 @@
+import argparse
+import csv
+import itertools
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from mem_trace import FETCH, LOAD, STORE, trace_chunks
+
+# Cache design-space sweep over one recorded memory trace (mem_trace.py).
+# Configurations are spread over worker processes in batches; a worker makes
+# one streaming pass over the trace per batch, feeding each chunk to every
+# configuration in it, so no process holds more than one chunk of the trace.
+# Within a pass, NumPy turns a chunk into line numbers and drops back-to-back
+# repeats of the same line first: under LRU, FIFO and random replacement
+# alike those are hits that change nothing, so only the remaining accesses go
+# through the per-set Python model. Results are miss rates and
+# AMAT = hit time + miss rate * miss penalty.
+POLICIES = ['lru', 'fifo', 'random']
+DEFAULT_SIZES = [1 << k for k in range(10, 17)]   # 1 KB .. 64 KB
+DEFAULT_WAYS = [1, 2, 4, 8, 16]
+DEFAULT_LINES = [16, 32, 64, 128]
+DEFAULT_HIT_TIME = 1
+DEFAULT_MISS_PENALTY = 100
+BATCHES_PER_WORKER = 2  # More, smaller batches balance load at the cost of extra passes
+
+def configurations(sizes=DEFAULT_SIZES, ways=DEFAULT_WAYS, lines=DEFAULT_LINES, policies=POLICIES):
+    # Every valid (size, ways, line size, policy); direct-mapped caches only get one policy
+    configs = []
+    for size, associativity, line_size, policy in itertools.product(sizes, ways, lines, policies):
+        if size < associativity * line_size or (associativity == 1 and policy != policies[0]):
+            continue
+        configs.append({'size': size, 'ways': associativity, 'line': line_size, 'policy': policy})
+    return configs
+
+def create_cache(config, seed=0):
+    sets = config['size'] // (config['line'] * config['ways'])
+    return {
+        'config': config,
+        'line_shift': config['line'].bit_length() - 1,
+        'set_mask': sets - 1,
+        'ways': config['ways'],
+        'lru': config['policy'] == 'lru',
+        'rng': random.Random(seed) if config['policy'] == 'random' else None,
+        'state': [[] for _ in range(sets)],  # Resident lines per set, oldest (or least recent) first
+        'hits': 0,
+        'misses': 0,
+        'last': -1,
+    }
+
+def feed(cache, lines):
+    # Runs one chunk of line numbers through the cache
+    changed = np.empty(len(lines), dtype=bool)
+    changed[0] = lines[0] != cache['last']
+    changed[1:] = lines[1:] != lines[:-1]
+    hits = len(lines) - int(np.count_nonzero(changed))
+    misses = 0
+    cache['last'] = int(lines[-1])
+    state, set_mask, ways, lru, rng = cache['state'], cache['set_mask'], cache['ways'], cache['lru'], cache['rng']
+    for line in lines[changed].tolist():
+        resident = state[line & set_mask]
+        if line in resident:
+            hits += 1
+            if lru and resident[-1] != line:
+                resident.remove(line)
+                resident.append(line)
+        else:
+            misses += 1
+            if len(resident) >= ways:
+                resident.pop(rng.randrange(ways) if rng is not None else 0)
+            resident.append(line)
+    cache['hits'] += hits
+    cache['misses'] += misses
+
+def simulate_batch(prefix, configs, kinds=(LOAD, STORE), seed=0):
+    # One streaming pass shared by all the configurations; returns each config
+    # with accesses, hits and misses added
+    caches = [create_cache(config, seed) for config in configs]
+    for chunk in trace_chunks(prefix):
+        addresses = chunk['address'][np.isin(chunk['kind'], kinds)]
+        if not len(addresses):
+            continue
+        lines = {}  # Line numbers per line size, shared by the batch
+        for cache in caches:
+            shift = cache['line_shift']
+            if shift not in lines:
+                lines[shift] = (addresses >> shift).astype(np.int64)
+            feed(cache, lines[shift])
+    return [dict(cache['config'], accesses=cache['hits'] + cache['misses'], hits=cache['hits'],
+                 misses=cache['misses']) for cache in caches]
+
+def simulate(prefix, config, kinds=(LOAD, STORE), seed=0):
+    return simulate_batch(prefix, [config], kinds, seed)[0]
+
+def _simulate_task(task):
+    prefix, configs, kinds = task
+    return simulate_batch(prefix, configs, kinds)
+
+def sweep(prefix, configs, workers=None, kinds=(LOAD, STORE), hit_time=DEFAULT_HIT_TIME,
+          miss_penalty=DEFAULT_MISS_PENALTY):
+    # Returns one result per configuration, in the order given
+    batches = min(len(configs), BATCHES_PER_WORKER * (workers or os.cpu_count() or 1)) or 1
+    # Interleaved, so every batch gets a similar mix of small and large caches
+    tasks = [(prefix, configs[index::batches], kinds) for index in range(batches)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch_results = list(pool.map(_simulate_task, tasks))
+    results = [None] * len(configs)
+    for index, batch in enumerate(batch_results):
+        results[index::batches] = batch
+    for result in results:
+        result['miss_rate'] = result['misses'] / result['accesses'] if result['accesses'] else 0.0
+        result['amat'] = hit_time + result['miss_rate'] * miss_penalty
+    return results
+
+def format_size(size):
+    return f"{size // 1024}K" if size >= 1024 and size % 1024 == 0 else str(size)
+
+def display_results(results, top=None):
+    print(f"{'Size':>6} {'Ways':>5} {'Line':>5} {'Policy':<7} {'Accesses':>10} {'Misses':>10} {'Miss %':>7} {'AMAT':>8}")
+    ranked = sorted(results, key=lambda result: (result['amat'], result['size'], result['ways']))
+    for result in ranked[:top]:
+        print(f"{format_size(result['size']):>6} {result['ways']:>5} {result['line']:>5} {result['policy']:<7} "
+              f"{result['accesses']:>10} {result['misses']:>10} {100.0 * result['miss_rate']:>7.2f} {result['amat']:>8.2f}")
+
+def write_csv(results, file_path):
+    fields = ['size', 'ways', 'line', 'policy', 'accesses', 'hits', 'misses', 'miss_rate', 'amat']
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        for result in results:
+            writer.writerow({field: result[field] for field in fields})
+
+def parse_list(text):
+    return [int(value, 0) for value in text.split(',') if value]
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep cache configurations over a recorded memory trace")
+    parser.add_argument('prefix', help="Trace prefix written by mem_trace.py")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help="Cache sizes in bytes")
+    parser.add_argument('--ways', default=','.join(map(str, DEFAULT_WAYS)))
+    parser.add_argument('--lines', default=','.join(map(str, DEFAULT_LINES)), help="Line sizes in bytes")
+    parser.add_argument('--policies', default=','.join(POLICIES))
+    parser.add_argument('--fetch', action='store_true', help="Simulate an instruction cache (fetch records)")
+    parser.add_argument('--hit-time', type=float, default=DEFAULT_HIT_TIME)
+    parser.add_argument('--miss-penalty', type=float, default=DEFAULT_MISS_PENALTY)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--top', type=int, help="Only show the best configurations")
+    parser.add_argument('--csv', help="Also write every result to this CSV file")
+    args = parser.parse_args()
+
+    values = [parse_list(args.sizes), parse_list(args.ways), parse_list(args.lines)]
+    if any(value & (value - 1) or value <= 0 for value in itertools.chain(*values)):
+        print("Error: sizes, ways and line sizes must be powers of two")
+        sys.exit(2)
+    policies = [policy for policy in args.policies.split(',') if policy]
+    unknown = set(policies) - set(POLICIES)
+    if unknown:
+        print(f"Error: unknown policy {', '.join(sorted(unknown))}; choose from {', '.join(POLICIES)}")
+        sys.exit(2)
+    configs = configurations(*values, policies)
+    kinds = (FETCH,) if args.fetch else (LOAD, STORE)
+    start = time.perf_counter()
+    results = sweep(os.path.abspath(args.prefix), configs, args.workers, kinds, args.hit_time, args.miss_penalty)
+    print(f"{len(configs)} configurations in {time.perf_counter() - start:.2f}s on {args.workers} workers")
+    display_results(results, args.top)
+    if args.csv:
+        write_csv(results, args.csv)
+        print(f"Results written to {args.csv}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import base64
+import hashlib
+import json
+import struct
+import sys
+
+from decoder import decode
+from source_map import SourceMap
+from stream_asm import assemble_file
+
+# Instruction and branch-direction coverage. Maps are preallocated with one
+# slot per text word (index = (pc - text_base) / 4); the machine sets a slot
+# per executed instruction and packs the maps into bitmaps when saving.
+
+def create_coverage(count):
+    return {
+        'count': count,
+        'hit': bytearray(count),
+        'taken': bytearray(count),
+        'not_taken': bytearray(count),
+        'branch': bytearray(count),  # 1 where the word is a conditional branch
+    }
+
+def program_id(words):
+    return hashlib.sha1(b''.join(struct.pack('>I', word & 0xFFFFFFFF) for word in words)).hexdigest()
+
+def instrument_branches(handlers, words, text_base, coverage):
+    # Wrap beq/bne handlers so they record which direction was taken
+    taken, not_taken = coverage['taken'], coverage['not_taken']
+    instrumented = list(handlers)
+    for index, word in enumerate(words):
+        if decode(word)['op'] not in ('beq', 'bne'):
+            continue
+        coverage['branch'][index] = 1
+        instrumented[index] = _branch_recorder(handlers[index], index, text_base + 4 * index + 4, taken, not_taken)
+    return instrumented
+
+def _branch_recorder(handler, index, fall_through, taken, not_taken):
+    def recorder(reg, mem):
+        pc = handler(reg, mem)
+        if pc == fall_through:
+            not_taken[index] = 1
+        else:
+            taken[index] = 1
+        return pc
+    return recorder
+
+def pack_bits(flags):
+    packed = bytearray((len(flags) + 7) // 8)
+    for index, flag in enumerate(flags):
+        if flag:
+            packed[index >> 3] |= 1 << (index & 7)
+    return base64.b64encode(bytes(packed)).decode('ascii')
+
+def unpack_bits(text, count):
+    packed = base64.b64decode(text)
+    return bytearray((packed[index >> 3] >> (index & 7)) & 1 for index in range(count))
+
+def save_coverage(coverage, file_path, program):
+    record = {'program': program, 'count': coverage['count']}
+    for key in ('hit', 'taken', 'not_taken', 'branch'):
+        record[key] = pack_bits(coverage[key])
+    with open(file_path, 'w') as file:
+        json.dump(record, file)
+
+def load_coverage(file_path):
+    with open(file_path, 'r') as file:
+        record = json.load(file)
+    coverage = {'count': record['count'], 'program': record['program']}
+    for key in ('hit', 'taken', 'not_taken', 'branch'):
+        coverage[key] = unpack_bits(record[key], record['count'])
+    return coverage
+
+def merge_coverage(total, other):
+    # OR other into total; both must come from the same assembled program
+    if total.get('program') != other.get('program') or total['count'] != other['count']:
+        raise ValueError("Cannot merge coverage from different programs")
+    for key in ('hit', 'taken', 'not_taken', 'branch'):
+        merged = total[key]
+        for index, flag in enumerate(other[key]):
+            if flag:
+                merged[index] = 1
+    return total
+
+def pc_source_lines(file_path, count):
+    # (line number, text) of each of the first count text words, or None for a
+    # word with no source line; assembled by the same front end as
+    # Machine.from_file, so the words line up with the coverage maps
+    source_map = SourceMap(file_path)
+    words, labels, memory = assemble_file(file_path, source_map)
+    mapping = []
+    for index in range(count):
+        found = source_map.lookup(4 * index)
+        mapping.append(None if found is None else (found[1], found[3]))
+    return mapping, words
+
+def display_coverage_report(coverage, mapping):
+    print("Coverage:")
+    lines = {}
+    for index, source in enumerate(mapping[:coverage['count']]):
+        if source is None:
+            continue
+        line_number, text = source
+        entry = lines.setdefault(line_number, {'text': text, 'hit': 0, 'branch': 0, 'taken': 0, 'not_taken': 0})
+        entry['hit'] |= coverage['hit'][index]
+        entry['branch'] |= coverage['branch'][index]
+        entry['taken'] |= coverage['taken'][index]
+        entry['not_taken'] |= coverage['not_taken'][index]
+    for line_number in sorted(lines):
+        entry = lines[line_number]
+        mark = '+' if entry['hit'] else '-'
+        directions = ''
+        if entry['branch']:
+            directions = f"[{'T' if entry['taken'] else ' '}{'N' if entry['not_taken'] else ' '}]"
+        print(f"{mark} {line_number:>5} {directions:<4} {entry['text']}")
+    covered = sum(entry['hit'] for entry in lines.values())
+    branches = sum(entry['branch'] for entry in lines.values())
+    directions = sum(entry['taken'] + entry['not_taken'] for entry in lines.values() if entry['branch'])
+    print()
+    print(f"Lines: {covered}/{len(lines)} ({100.0 * covered / max(len(lines), 1):.1f}%)")
+    print(f"Branch directions: {directions}/{2 * branches} ({100.0 * directions / max(2 * branches, 1):.1f}%)")
+    print()
+
+def main():
+    # code_coverage.py run program.asm out.cov | merge out.cov in.cov... | report program.asm in.cov...
+    from machine import Machine
+    if len(sys.argv) < 4:
+        print("Usage: code_coverage.py run program.asm out.cov | merge out.cov in.cov... | report program.asm in.cov...")
+        sys.exit(2)
+    command = sys.argv[1]
+    if command == 'run':
+        file_path, out_path = sys.argv[2], sys.argv[3]
+        machine = Machine.from_file(file_path, coverage=True)
+        machine.run()
+        save_coverage(machine.coverage, out_path, program_id(machine.words))
+    elif command == 'merge':
+        out_path, in_paths = sys.argv[2], sys.argv[3:]
+        total = load_coverage(in_paths[0])
+        for path in in_paths[1:]:
+            merge_coverage(total, load_coverage(path))
+        save_coverage(total, out_path, total['program'])
+    elif command == 'report':
+        file_path, in_paths = sys.argv[2], sys.argv[3:]
+        total = load_coverage(in_paths[0])
+        for path in in_paths[1:]:
+            merge_coverage(total, load_coverage(path))
+        mapping, words = pc_source_lines(file_path, total['count'])
+        if program_id(words) != total['program']:
+            print(f"Warning: {file_path} has changed since the coverage was recorded; lines may not match")
+        display_coverage_report(total, mapping)
+    else:
+        print(f"Unknown command {command}")
+
+if __name__ == "__main__":
+    main()
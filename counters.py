@@ -0,0 +1,146 @@
+import json
+import sys
+
+from decoder import decode
+
+# Event counters. Engines only count when they are given a counters dict, and
+# choose that when a run starts: the interpreting engines fetch through
+# counted_fetch, which calls count_instruction once per instruction, instead
+# of their plain fetch, and the Machine switches to a dispatch
+# loop that bumps one slot per text word and derives every other counter from
+# the decoded words afterwards. Without counters neither pays anything extra.
+LOAD_OPS = ('lw', 'll')
+STORE_OPS = ('sw', 'sc')
+BRANCH_OPS = ('beq', 'bne')
+JUMP_OPS = ('j', 'jal', 'jr')
+
+def create_counters():
+    return {
+        'instructions': 0,
+        'loads': 0,
+        'stores': 0,
+        'branches_taken': 0,
+        'branches_not_taken': 0,
+        'jumps': 0,
+        'syscalls': 0,
+        'opcodes': {},      # Mnemonic -> executions
+        'pending': None,    # PC of a branch whose direction is not known yet
+    }
+
+def count_instruction(counters, pc, op):
+    # Called by an engine before executing op at pc; a branch's direction is
+    # settled by the PC of the instruction that runs after it
+    pending = counters['pending']
+    if pending is not None:
+        if pc == pending + 4:
+            counters['branches_not_taken'] += 1
+        else:
+            counters['branches_taken'] += 1
+        counters['pending'] = None
+    opcodes = counters['opcodes']
+    opcodes[op] = opcodes.get(op, 0) + 1
+    if op in BRANCH_OPS:
+        counters['pending'] = pc
+
+def counted_fetch(fetch, counters, op):
+    # An engine's instruction fetch that counts what it fetches; op(instruction)
+    # is the operation name as the engine knows it
+    def counted(key):
+        instruction = fetch(key)
+        count_instruction(counters, instruction.pc, op(instruction))
+        return instruction
+    return counted
+
+def finish_counters(counters, pc):
+    # Settle the last branch and total the per-opcode counts
+    pending = counters['pending']
+    if pending is not None:
+        counters['branches_not_taken' if pc == pending + 4 else 'branches_taken'] += 1
+        counters['pending'] = None
+    summarize_opcodes(counters)
+    return counters
+
+def summarize_opcodes(counters):
+    opcodes = counters['opcodes']
+    counters['instructions'] = sum(opcodes.values())
+    counters['loads'] = sum(opcodes.get(op, 0) for op in LOAD_OPS)
+    counters['stores'] = sum(opcodes.get(op, 0) for op in STORE_OPS)
+    counters['jumps'] = sum(opcodes.get(op, 0) for op in JUMP_OPS)
+    counters['syscalls'] = opcodes.get('syscall', 0)
+
+def counters_from_counts(words, counts, taken):
+    # Counters of a Machine run from per-word execution and taken-branch counts
+    counters = create_counters()
+    opcodes = counters['opcodes']
+    for word, executions, branch_taken in zip(words, counts, taken):
+        if not executions:
+            continue
+        op = decode(word)['op']
+        opcodes[op] = opcodes.get(op, 0) + executions
+        if op in BRANCH_OPS:
+            counters['branches_taken'] += branch_taken
+            counters['branches_not_taken'] += executions - branch_taken
+    summarize_opcodes(counters)
+    return counters
+
+def merge_counters(total, other):
+    for key, value in other.items():
+        if key == 'opcodes':
+            for op, count in value.items():
+                total['opcodes'][op] = total['opcodes'].get(op, 0) + count
+        elif key != 'pending':
+            total[key] += value
+    return total
+
+def counters_json(counters):
+    return json.dumps({key: value for key, value in counters.items() if key != 'pending'}, indent=2)
+
+def counters_openmetrics(counters, prefix='mips'):
+    # OpenMetrics text exposition; every family is a counter
+    lines = []
+    def family(name, help_text, samples):
+        lines.append(f"# TYPE {prefix}_{name} counter")
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        for labels, value in samples:
+            lines.append(f"{prefix}_{name}_total{labels} {value}")
+    family('instructions', "Instructions retired.", [('', counters['instructions'])])
+    family('loads', "Memory loads.", [('', counters['loads'])])
+    family('stores', "Memory stores.", [('', counters['stores'])])
+    family('branches', "Conditional branches by direction.",
+           [('{direction="taken"}', counters['branches_taken']),
+            ('{direction="not_taken"}', counters['branches_not_taken'])])
+    family('jumps', "Unconditional jumps.", [('', counters['jumps'])])
+    family('syscalls', "System calls.", [('', counters['syscalls'])])
+    family('opcode_executions', "Executions per opcode.",
+           [(f'{{op="{op}"}}', count) for op, count in sorted(counters['opcodes'].items())])
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+def export_counters(counters, output_format='json'):
+    if output_format == 'openmetrics':
+        return counters_openmetrics(counters)
+    return counters_json(counters)
+
+def main():
+    # counters.py program.asm [--engine main|recursive|iterative|control_signal|machine] [--openmetrics]
+    import importlib
+    from limits import create_limits
+    file_path = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith('--') else "program.asm"
+    engine = sys.argv[sys.argv.index('--engine') + 1] if '--engine' in sys.argv else 'machine'
+    output_format = 'openmetrics' if '--openmetrics' in sys.argv else 'json'
+    if engine == 'machine':
+        from machine import Machine
+        machine = Machine.from_file(file_path, counters=True)
+        machine.run()
+        counters = machine.event_counters()
+    else:
+        module = importlib.import_module(engine)
+        instructions = module.read_asm_file(file_path)
+        parsed_instructions, labels, memory = module.parse_labels_and_instructions(instructions)
+        run = getattr(module, 'Run_simulation', None) or module.run_simulation
+        counters = create_counters()
+        run(parsed_instructions, labels, memory, limits=create_limits(), sim_mode='a', counters=counters)
+    print(export_counters(counters, output_format))
+
+if __name__ == "__main__":
+    main()
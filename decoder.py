@@ -0,0 +1,128 @@
+# Instruction word decoding shared by the machine and its optimisation passes
+MASK = 0xFFFFFFFF
+
+opcode_names = {
+    0b001000: "addi",
+    0b001100: "andi",
+    0b001101: "ori",
+    0b000100: "beq",
+    0b000101: "bne",
+    0b000010: "j",
+    0b000011: "jal",
+    0b100011: "lw",
+    0b101011: "sw",
+    0b110000: "ll",
+    0b111000: "sc",
+    0b001111: "lui",
+    0b011100: "mul",  # SPECIAL opcode for mul
+}
+
+funct_names = {
+    0b100000: "add",
+    0b100010: "sub",
+    0b100100: "and",
+    0b100101: "or",
+    0b101010: "slt",
+    0b000000: "sll",
+    0b000010: "srl",
+    0b001000: "jr",
+    0b100110: "xor",
+    0b100111: "nor",
+    0b001100: "syscall",
+}
+
+# Table-driven naming: one 64-entry list per opcode and per R-type funct, so
+# naming a word is two shifts and at most two list indexes
+op_table = ["unknown"] * 64
+for code, name in opcode_names.items():
+    op_table[code] = name
+op_table[0] = None  # R-type, named by funct
+funct_table = ["unknown"] * 64
+for code, name in funct_names.items():
+    funct_table[code] = name
+
+def op_name(word):
+    name = op_table[(word >> 26) & 0b111111]
+    return funct_table[word & 0b111111] if name is None else name
+
+def decode(word):
+    return {
+        'op': op_name(word),
+        'rs': (word >> 21) & 0b11111,
+        'rt': (word >> 16) & 0b11111,
+        'rd': (word >> 11) & 0b11111,
+        'shamt': (word >> 6) & 0b11111,
+        'imm': word & 0xFFFF,
+        'simm': (word & 0xFFFF) - 0x10000 if word & 0x8000 else word & 0xFFFF,
+        'address': word & 0x3FFFFFF,
+    }
+
+register_names = [
+    'zero', 'at', 'v0', 'v1', 'a0', 'a1', 'a2', 'a3',
+    't0', 't1', 't2', 't3', 't4', 't5', 't6', 't7',
+    's0', 's1', 's2', 's3', 's4', 's5', 's6', 's7',
+    't8', 't9', 'k0', 'k1', 'gp', 'sp', 'fp', 'ra',
+]
+
+# Operand layout of each operation for the disassembler. Branch and jump
+# targets follow the Machine: beq/bne are relative to PC + 4, j/jal keep the
+# top four bits of PC + 4
+operand_formats = {
+    'add': '{rd}, {rs}, {rt}', 'sub': '{rd}, {rs}, {rt}', 'and': '{rd}, {rs}, {rt}',
+    'or': '{rd}, {rs}, {rt}', 'xor': '{rd}, {rs}, {rt}', 'nor': '{rd}, {rs}, {rt}',
+    'slt': '{rd}, {rs}, {rt}', 'mul': '{rd}, {rs}, {rt}',
+    'sll': '{rd}, {rt}, {shamt}', 'srl': '{rd}, {rt}, {shamt}',
+    'jr': '{rs}',
+    'syscall': '',
+    'addi': '{rt}, {rs}, {simm}',
+    'andi': '{rt}, {rs}, {imm:#x}', 'ori': '{rt}, {rs}, {imm:#x}',
+    'lui': '{rt}, {imm:#x}',
+    'lw': '{rt}, {simm}({rs})', 'sw': '{rt}, {simm}({rs})',
+    'll': '{rt}, {simm}({rs})', 'sc': '{rt}, {simm}({rs})',
+    'beq': '{rs}, {rt}, {target}', 'bne': '{rs}, {rt}, {target}',
+    'j': '{target}', 'jal': '{target}',
+}
+
+def branch_target(word, pc):
+    # Where a beq/bne/j/jal at pc goes when taken
+    if (word >> 26) & 0b111110 == 0b000010:  # j, jal
+        return ((pc + 4) & 0xF0000000) | ((word & 0x3FFFFFF) << 2)
+    offset = word & 0xFFFF
+    return (pc + 4 + ((offset - 0x10000 if offset & 0x8000 else offset) << 2)) & MASK
+
+def disassemble(word, pc=0, symbols=None):
+    # Assembly text of a word; symbols ({address: name}) names branch targets
+    op = op_name(word)
+    if op == 'unknown':
+        return f".word 0x{word:08x}"
+    if word == 0:
+        return "nop"
+    layout = operand_formats[op]
+    if not layout:
+        return op
+    target = None
+    if '{target}' in layout:
+        target = branch_target(word, pc)
+        target = symbols[target] if symbols and target in symbols else f"0x{target:x}"
+    imm = word & 0xFFFF
+    return op + ' ' + layout.format(
+        rs='$' + register_names[(word >> 21) & 0b11111],
+        rt='$' + register_names[(word >> 16) & 0b11111],
+        rd='$' + register_names[(word >> 11) & 0b11111],
+        shamt=(word >> 6) & 0b11111,
+        imm=imm,
+        simm=imm - 0x10000 if imm & 0x8000 else imm,
+        target=target)
+
+def disassembly_listing(words, text_base=0, symbols=None):
+    # "address: word  text" lines for a text segment, with symbol names as labels
+    lines = []
+    for index, word in enumerate(words):
+        pc = text_base + 4 * index
+        if symbols and pc in symbols:
+            lines.append(f"{symbols[pc]}:")
+        lines.append(f"  {pc:08x}: {word:08x}  {disassemble(word, pc, symbols)}")
+    return lines
+
+def signed(value):
+    return value - 0x100000000 if value & 0x80000000 else value
@@ -0,0 +1,238 @@
+import bisect
+import copy
+import sys
+import time
+from collections import deque
+
+# Memory-mapped devices for the Machine. PagedMemory.map_device puts a
+# DevicePage into the page table for every page a device range touches;
+# lw/sw/ll/sc reach it through the same page lookup as RAM, and the page
+# forwards the access to the device owning the address as
+# device.read(offset) / device.write(offset, value). Device pages do not show
+# up in memory listings, so dumping memory never reads (and pops) a FIFO.
+#
+# Default map, with the console registers laid out like SPIM's:
+#   0xFFFF0000 console  +0x0 receiver control (bit 0: input waiting)
+#                       +0x4 receiver data (next input byte, 0 when empty)
+#                       +0x8 transmitter control (bit 0: ready, always set)
+#                       +0xC transmitter data (write one byte)
+#                       +0x10 input bytes waiting, +0x14 output bytes buffered
+#   0xFFFF1000 timer    +0x0/+0x4 instructions retired (low/high word)
+#                       +0x8 host microseconds since reset (low word)
+#   0xFFFF2000 DMA      +0x0 source, +0x4 destination, +0x8 count, +0xC stride,
+#                       +0x10 control (write to start), +0x14 cells copied
+# A DMA transfer copies at most MAX_TRANSFER cells, however large count is:
+# it runs inside a single sw, where the instruction and time limits cannot
+# interrupt it.
+CONSOLE_BASE = 0xFFFF0000
+TIMER_BASE = 0xFFFF1000
+DMA_BASE = 0xFFFF2000
+FIFO_SIZE = 256
+MAX_TRANSFER = 1 << 16
+MASK = 0xFFFFFFFF
+
+class DevicePage:
+    # Page table entry for a page holding device registers
+    def __init__(self):
+        self.starts = []
+        self.ranges = []  # (start, end, device), sorted by start
+
+    def add(self, start, end, device):
+        index = bisect.bisect_left(self.starts, start)
+        self.starts.insert(index, start)
+        self.ranges.insert(index, (start, end, device))
+
+    def find(self, address):
+        index = bisect.bisect_right(self.starts, address) - 1
+        if index >= 0:
+            start, end, device = self.ranges[index]
+            if address < end:
+                return start, device
+        return None, None
+
+    def get(self, address, default=0):
+        start, device = self.find(address)
+        if device is None:
+            return default
+        return device.read(address - start) & MASK
+
+    def __getitem__(self, address):
+        start, device = self.find(address)
+        if device is None:
+            raise KeyError(address)
+        return device.read(address - start) & MASK
+
+    def __setitem__(self, address, value):
+        start, device = self.find(address)
+        if device is None:
+            raise ValueError(f"No device at address {address:08x}")
+        device.write(address - start, value & MASK)
+
+    def __contains__(self, address):
+        return self.find(address)[1] is not None
+
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+class Console:
+    # Byte console with an input and an output FIFO. Output is handed to the
+    # machine a line at a time (or when the FIFO fills), like syscall output
+    size = 0x18
+
+    def __init__(self, input_text=''):
+        self.initial_input = input_text
+        self.machine = None
+        self.reset()
+
+    def attach(self, machine):
+        self.machine = machine
+
+    def reset(self):
+        self.input = deque(input_text_bytes(self.initial_input))
+        self.output = []
+
+    def feed(self, text):
+        self.input.extend(input_text_bytes(text))
+
+    def read(self, offset):
+        if offset == 0x0:
+            return 1 if self.input else 0
+        if offset == 0x4:
+            return self.input.popleft() if self.input else 0
+        if offset == 0x8:
+            return 1
+        if offset == 0x10:
+            return len(self.input)
+        if offset == 0x14:
+            return len(self.output)
+        return 0
+
+    def write(self, offset, value):
+        if offset != 0xC:
+            return
+        char = chr(value & 0xFF)
+        if char == '\n':
+            self.flush()
+            return
+        self.output.append(char)
+        if len(self.output) >= FIFO_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.output:
+            return
+        text = ''.join(self.output)
+        self.output = []
+        if self.machine is not None:
+            self.machine._write(text)
+        else:
+            print(text)
+
+def input_text_bytes(text):
+    return [ord(char) & 0xFF for char in text]
+
+class CycleTimer:
+    # The instruction count is the one the machine has at the start of the
+    # current dispatch block, so it is exact under step(1) and otherwise
+    # behind by at most one limits check_interval
+    size = 0xC
+
+    def __init__(self):
+        self.machine = None
+        self.reset()
+
+    def attach(self, machine):
+        self.machine = machine
+
+    def reset(self):
+        self.started = time.perf_counter_ns()
+
+    def read(self, offset):
+        instructions = self.machine.instructions if self.machine is not None else 0
+        if offset == 0x0:
+            return instructions & MASK
+        if offset == 0x4:
+            return instructions >> 32
+        if offset == 0x8:
+            return (time.perf_counter_ns() - self.started) // 1000
+        return 0
+
+    def write(self, offset, value):
+        pass
+
+class DMA:
+    # Copies count cells from source to destination when control is written.
+    # Control bits: 1 fixed destination (e.g. the console transmitter data
+    # register), 2 fixed source. Cells are stride bytes apart: 4 for .word
+    # data, 1 for .asciiz strings, which take one cell per byte
+    size = 0x18
+
+    def __init__(self):
+        self.machine = None
+        self.reset()
+
+    def attach(self, machine):
+        self.machine = machine
+
+    def reset(self):
+        self.source = 0
+        self.destination = 0
+        self.count = 0
+        self.stride = 4
+        self.copied = 0
+
+    def read(self, offset):
+        return {0x0: self.source, 0x4: self.destination, 0x8: self.count,
+                0xC: self.stride, 0x10: 0, 0x14: self.copied}.get(offset, 0)
+
+    def write(self, offset, value):
+        if offset == 0x0:
+            self.source = value
+        elif offset == 0x4:
+            self.destination = value
+        elif offset == 0x8:
+            self.count = value
+        elif offset == 0xC:
+            self.stride = value
+        elif offset == 0x10:
+            self.start(value)
+
+    def start(self, control):
+        mem = self.machine.memory
+        source_step = 0 if control & 2 else self.stride
+        destination_step = 0 if control & 1 else self.stride
+        source, destination = self.source, self.destination
+        count = min(self.count, MAX_TRANSFER)
+        for _ in range(count):
+            mem[destination] = mem.get(source, 0)
+            source = (source + source_step) & MASK
+            destination = (destination + destination_step) & MASK
+        self.copied = count
+
+def clone_device(device):
+    # Copy of a device in its current state, not yet attached to any machine;
+    # a forked machine gets one of each so the two sides never share registers
+    machine, device.machine = device.machine, None
+    try:
+        return copy.deepcopy(device)
+    finally:
+        device.machine = machine
+
+def standard_devices(input_text=''):
+    # [(base address, device)] of the default map above
+    return [(CONSOLE_BASE, Console(input_text)), (TIMER_BASE, CycleTimer()), (DMA_BASE, DMA())]
+
+def main():
+    # devices.py program.asm [console input]: run with the standard devices mapped
+    from machine import Machine
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "program.asm"
+    input_text = sys.argv[2].encode().decode('unicode_escape') if len(sys.argv) > 2 else ''
+    machine = Machine.from_file(file_path, devices=standard_devices(input_text))
+    termination = machine.run()
+    print(f"{termination['reason']} after {termination['instructions']} instructions")
+
+if __name__ == "__main__":
+    main()
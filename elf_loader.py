@@ -0,0 +1,114 @@
+import mmap
+import struct
+import sys
+
+from memory import PagedMemory
+
+# Loader for statically linked ELF32 big-endian MIPS executables.
+# The file is memory-mapped; data segments are attached to guest memory as
+# backing pages that are only decoded the first time the guest touches them.
+# Segments decode to one big-endian word per aligned address, which is what
+# lw/sw see; strings therefore stay packed four bytes to a word, and
+# Machine.from_elf has print-string (syscall 4) read them that way.
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS32 = 1
+ELFDATA2MSB = 2
+EM_MIPS = 8
+PT_LOAD = 1
+PF_X = 1
+SHT_SYMTAB = 2
+STT_OBJECT = 1
+STT_FUNC = 2
+
+elf_header = struct.Struct('>16sHHIIIIIHHHHHH')
+program_header = struct.Struct('>IIIIIIII')
+section_header = struct.Struct('>IIIIIIIIII')
+symbol_entry = struct.Struct('>IIIBBH')
+
+def read_elf_header(data):
+    if len(data) < elf_header.size or data[:4] != ELF_MAGIC:
+        raise ValueError("Not an ELF file")
+    fields = elf_header.unpack_from(data, 0)
+    ident = fields[0]
+    if ident[4] != ELFCLASS32 or ident[5] != ELFDATA2MSB:
+        raise ValueError("Only ELF32 big-endian executables are supported")
+    if fields[2] != EM_MIPS:
+        raise ValueError(f"Not a MIPS executable (e_machine {fields[2]})")
+    names = ['type', 'machine', 'version', 'entry', 'phoff', 'shoff', 'flags',
+             'ehsize', 'phentsize', 'phnum', 'shentsize', 'shnum', 'shstrndx']
+    return dict(zip(names, fields[1:]))
+
+def read_segments(data, header):
+    segments = []
+    for index in range(header['phnum']):
+        offset = header['phoff'] + index * header['phentsize']
+        (p_type, p_offset, p_vaddr, p_paddr, p_filesz,
+         p_memsz, p_flags, p_align) = program_header.unpack_from(data, offset)
+        if p_type == PT_LOAD:
+            segments.append({'offset': p_offset, 'vaddr': p_vaddr, 'filesz': p_filesz,
+                             'memsz': p_memsz, 'flags': p_flags})
+    return segments
+
+def read_symbols(data, header):
+    # Returns {name: address} for functions, objects and plain labels
+    sections = []
+    for index in range(header['shnum']):
+        offset = header['shoff'] + index * header['shentsize']
+        sections.append(section_header.unpack_from(data, offset))
+    symbols = {}
+    for sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link, sh_info, sh_addralign, sh_entsize in sections:
+        if sh_type != SHT_SYMTAB:
+            continue
+        strtab_offset = sections[sh_link][4]
+        for entry in range(sh_offset, sh_offset + sh_size, symbol_entry.size):
+            st_name, st_value, st_size, st_info, st_other, st_shndx = symbol_entry.unpack_from(data, entry)
+            if st_name == 0 or st_shndx == 0 or (st_info & 0xF) not in (0, STT_OBJECT, STT_FUNC):
+                continue
+            start = strtab_offset + st_name
+            end = data.find(b'\0', start)
+            symbols[bytes(data[start:end]).decode('ascii', 'replace')] = st_value
+    return symbols
+
+def load_elf(file_path):
+    with open(file_path, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    header = read_elf_header(data)
+    segments = read_segments(data, header)
+    view = memoryview(data)
+
+    text = None
+    memory = PagedMemory()
+    for segment in segments:
+        contents = view[segment['offset']:segment['offset'] + segment['filesz']]
+        if segment['flags'] & PF_X and segment['vaddr'] <= header['entry'] < segment['vaddr'] + segment['memsz']:
+            # The simulator executes decoded words, so the code segment is read once
+            text = segment
+            words = list(struct.unpack_from(f">{segment['filesz'] // 4}I", contents))
+        # The text segment is mapped too: constants, .rodata and jump tables often live in it
+        memory.map_segment(segment['vaddr'], contents, segment['memsz'])
+    if text is None:
+        raise ValueError("No executable PT_LOAD segment contains the entry point")
+
+    return {
+        'entry': header['entry'],
+        'text_base': text['vaddr'],
+        'words': words,
+        'memory': memory,
+        'symbols': read_symbols(data, header) if header['shnum'] else {},
+        'segments': segments,
+    }
+
+def main():
+    file_path = sys.argv[1]
+    image = load_elf(file_path)
+    print(f"Entry point: {image['entry']:08x}")
+    print(f"Text: {image['text_base']:08x} ({len(image['words'])} words)")
+    for segment in image['segments']:
+        kind = 'text' if segment['flags'] & PF_X else 'data'
+        print(f"PT_LOAD {kind}: vaddr {segment['vaddr']:08x} filesz {segment['filesz']} memsz {segment['memsz']}")
+    print(f"Symbols: {len(image['symbols'])}")
+    for name, address in sorted(image['symbols'].items(), key=lambda item: item[1]):
+        print(f"{address:08x} {name}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import sys
+
+from decoder import MASK, decode
+
+# Superinstruction fusion. A fused handler at index i runs the instruction
+# pair (i, i+1) and returns the PC after both; handlers[i + 1] keeps its plain
+# handler so a branch that lands on the second instruction still works.
+FUSION_PATTERNS = ['lui+ori', 'slt+beq', 'slt+bne', 'addi+beq', 'addi+bne']
+
+def _fuse_lui_ori(first, second, pc, fired):
+    rt = first['rt']
+    if rt == 0 or second['rs'] != rt or second['rt'] != rt:
+        return None
+    value = (first['imm'] << 16) | second['imm']
+    after = pc + 8
+    def handler(reg, mem):
+        fired[0] += 1
+        reg[rt] = value
+        return after
+    return handler
+
+def _fuse_slt_branch(first, second, pc, fired):
+    rd, rs, rt = first['rd'], first['rs'], first['rt']
+    a, b = second['rs'], second['rt']
+    after = pc + 8
+    target = after + (second['simm'] << 2)
+    if rd != 0 and ((a == rd and b == 0) or (a == 0 and b == rd)):
+        # slt followed by a test of its own result against $zero
+        if second['op'] == 'bne':
+            def handler(reg, mem):
+                fired[0] += 1
+                if (reg[rs] ^ 0x80000000) < (reg[rt] ^ 0x80000000):
+                    reg[rd] = 1
+                    return target
+                reg[rd] = 0
+                return after
+        else:
+            def handler(reg, mem):
+                fired[0] += 1
+                if (reg[rs] ^ 0x80000000) < (reg[rt] ^ 0x80000000):
+                    reg[rd] = 1
+                    return after
+                reg[rd] = 0
+                return target
+        return handler
+    taken_if_equal = second['op'] == 'beq'
+    def handler(reg, mem):
+        fired[0] += 1
+        if rd:
+            reg[rd] = 1 if (reg[rs] ^ 0x80000000) < (reg[rt] ^ 0x80000000) else 0
+        return target if (reg[a] == reg[b]) == taken_if_equal else after
+    return handler
+
+def _fuse_addi_branch(first, second, pc, fired):
+    rt, rs, simm = first['rt'], first['rs'], first['simm']
+    a, b = second['rs'], second['rt']
+    after = pc + 8
+    target = after + (second['simm'] << 2)
+    taken_if_equal = second['op'] == 'beq'
+    if rt == 0:
+        return None
+    def handler(reg, mem):
+        fired[0] += 1
+        reg[rt] = (reg[rs] + simm) & MASK
+        return target if (reg[a] == reg[b]) == taken_if_equal else after
+    return handler
+
+_fusers = {
+    ('lui', 'ori'): ('lui+ori', _fuse_lui_ori),
+    ('slt', 'beq'): ('slt+beq', _fuse_slt_branch),
+    ('slt', 'bne'): ('slt+bne', _fuse_slt_branch),
+    ('addi', 'beq'): ('addi+beq', _fuse_addi_branch),
+    ('addi', 'bne'): ('addi+bne', _fuse_addi_branch),
+}
+
+def fuse_at(words, index, text_base, stats):
+    # Fused handler for the pair starting at index, or None if it does not fuse
+    if index < 0 or index + 1 >= len(words):
+        return None
+    first, second = decode(words[index]), decode(words[index + 1])
+    entry = _fusers.get((first['op'], second['op']))
+    if entry is None:
+        return None
+    name, fuser = entry
+    handler = fuser(first, second, text_base + 4 * index, stats[name]['fired'])
+    if handler is not None:
+        stats[name]['sites'] += 1
+    return handler
+
+def fuse_handlers(words, handlers, text_base=0):
+    # Returns the fused handler list and {pattern: {'sites': n, 'fired': [count]}}
+    stats = {name: {'sites': 0, 'fired': [0]} for name in FUSION_PATTERNS}
+    fused = list(handlers)
+    for index in range(len(words) - 1):
+        handler = fuse_at(words, index, text_base, stats)
+        if handler is not None:
+            fused[index] = handler
+    return fused, stats
+
+def fused_count(stats):
+    # Extra instructions retired inside fused handlers so far
+    return sum(pattern['fired'][0] for pattern in stats.values())
+
+def display_fusion_stats(stats, instructions=None):
+    print("Fused instruction pairs:")
+    for name in FUSION_PATTERNS:
+        fired = stats[name]['fired'][0]
+        line = f"{name:<9}: {stats[name]['sites']:>5} sites, fired {fired:>10} times"
+        if instructions:
+            line += f" ({100.0 * 2 * fired / instructions:5.1f}% of instructions)"
+        print(line)
+    print()
+
+def main():
+    from machine import Machine
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "program.asm"
+    machine = Machine.from_file(file_path)
+    termination = machine.run()
+    display_fusion_stats(machine.fusion, termination['instructions'])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import argparse
+import contextlib
+import hashlib
+import importlib
+import io
+import os
+import random
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from limits import create_limits
+from machine import Machine
+from stream_asm import strip_comments, tokenize, layout, emit
+from workers import warm_worker
+
+# Differential fuzzer. Random but valid programs are run on every engine and
+# the engines' states are compared. Comparing after every instruction would
+# need a stepping API the interpreting engines do not have and would cost more
+# than the run itself, so the program checks itself instead: after every N
+# random instructions it stores all the registers it uses and a copy of its
+# data window into its own checkpoint record. Once every engine has finished,
+# each record is reduced to a fingerprint (register hash, memory hash) and the
+# first checkpoint where the engines disagree is reported. Failing programs
+# are shrunk by deleting chunks of instructions while the same engines still
+# split the same way.
+#
+# Programs only branch forward, so they always terminate. Registers are seeded
+# with addi/sll/addi, and la/li are never generated so that every engine lays
+# out the same addresses.
+ENGINES = ['main', 'recursive', 'iterative', 'control_signal', 'machine']
+REGISTERS = ['t0', 't1', 't2', 't3', 't4', 't5', 't6', 't7', 's0', 's1', 's2', 's3', 's4', 's5', 's6', 's7']
+SCRATCH = 'k0'             # Used only by the checkpoint code
+DATA_BASE = 0x1000         # Random loads and stores stay inside this window
+DATA_WORDS = 8
+CHECKPOINT_BASE = 0x2000   # Checkpoint k is stored at CHECKPOINT_BASE + k * CHECKPOINT_STRIDE
+CHECKPOINT_STRIDE = 4 * (len(REGISTERS) + DATA_WORDS)
+MAX_CHECKPOINTS = (0x8000 - CHECKPOINT_BASE) // CHECKPOINT_STRIDE  # Offsets are 16-bit signed
+R_OPS = ['add', 'sub', 'and', 'or', 'xor', 'nor', 'slt', 'mul']
+I_OPS = ['addi', 'andi', 'ori']
+SHIFT_OPS = ['sll', 'srl']
+OPS = R_OPS + I_OPS + SHIFT_OPS + ['lui', 'lw', 'sw', 'beq', 'bne', 'j', 'jal']
+FUZZ_LIMITS = {'max_instructions': 1_000_000, 'max_seconds': 10}
+MASK = 0xFFFFFFFF
+
+def generate_program(seed, length, ops=OPS):
+    # Returns the program as a list of items; branches are ('branch', op, rs, rt, skip)
+    # and jumps ('jump', op, skip), so deleting items never leaves a dangling label
+    rng = random.Random(seed)
+    items = []
+    for name in REGISTERS:
+        # value = high << 16 + low with both halves signed, using only addi and sll
+        low = rng.randint(-32768, 32767)
+        high = rng.randint(-32768, 32767)
+        items.append(f"addi ${name}, $zero, {high}")
+        items.append(f"sll ${name}, ${name}, 16")
+        items.append(f"addi ${name}, ${name}, {low}")
+    for _ in range(length):
+        op = rng.choice(ops)
+        rd, rs, rt = (rng.choice(REGISTERS) for _ in range(3))
+        if op in R_OPS:
+            items.append(f"{op} ${rd}, ${rs}, ${rt}")
+        elif op == 'addi':
+            items.append(f"addi ${rd}, ${rs}, {rng.randint(-32768, 32767)}")
+        elif op in I_OPS:
+            items.append(f"{op} ${rd}, ${rs}, {rng.randint(0, 0xFFFF)}")
+        elif op in SHIFT_OPS:
+            items.append(f"{op} ${rd}, ${rs}, {rng.randint(0, 31)}")
+        elif op == 'lui':
+            items.append(f"lui ${rd}, {rng.randint(0, 0xFFFF)}")
+        elif op in ('lw', 'sw'):
+            items.append(f"{op} ${rd}, {DATA_BASE + 4 * rng.randrange(DATA_WORDS)}($zero)")
+        elif op in ('beq', 'bne'):
+            # Equal operands now and then, so both directions get exercised
+            items.append(('branch', op, rs, rs if rng.random() < 0.3 else rt, rng.randint(1, 4)))
+        else:
+            items.append(('jump', op, rng.randint(1, 4)))
+    return items
+
+def checkpoint_lines(index):
+    base = CHECKPOINT_BASE + index * CHECKPOINT_STRIDE
+    lines = [f"sw ${name}, {base + 4 * i}($zero)" for i, name in enumerate(REGISTERS)]
+    window = base + 4 * len(REGISTERS)
+    for i in range(DATA_WORDS):
+        lines.append(f"lw ${SCRATCH}, {DATA_BASE + 4 * i}($zero)")
+        lines.append(f"sw ${SCRATCH}, {window + 4 * i}($zero)")
+    return lines
+
+def render(items, every):
+    # Returns (source lines, checkpoint count); a checkpoint follows every
+    # `every` items and one more ends the program
+    lines = ['.text', 'main:']
+    pending = []  # [label, items left until it is placed]
+    checkpoints = 0
+    for position, item in enumerate(items):
+        if isinstance(item, tuple):
+            label = f"L{position}"
+            if item[0] == 'branch':
+                lines.append(f"{item[1]} ${item[2]}, ${item[3]}, {label}")
+            else:
+                lines.append(f"{item[1]} {label}")
+            pending.append([label, item[-1] + 1])
+        else:
+            lines.append(item)
+        for entry in pending:
+            entry[1] -= 1
+            if entry[1] == 0:
+                lines.append(f"{entry[0]}:")
+        pending = [entry for entry in pending if entry[1] > 0]
+        if (position + 1) % every == 0:
+            lines.extend(checkpoint_lines(checkpoints))
+            checkpoints += 1
+    for label, left in pending:
+        lines.append(f"{label}:")
+    lines.extend(checkpoint_lines(checkpoints))
+    lines.extend(["addi $v0, $zero, 10", "syscall"])
+    return lines, checkpoints + 1
+
+def run_program(engine, lines, limits):
+    # Returns (termination, memory) of one engine; memory only needs .get
+    if engine == 'machine':
+        token_list = list(tokenize(strip_comments(enumerate(lines, 1))))
+        labels, memory = layout(token_list)
+        words = array('I', (word & MASK for pc, word, line_number, text in emit(token_list, labels)))
+        machine = Machine(words, memory, labels, echo=False)
+        return machine.run(create_limits(**limits)), machine.memory
+    module = importlib.import_module(engine)
+    parsed_instructions, labels, memory = module.parse_labels_and_instructions(lines)
+    run = getattr(module, 'Run_simulation', None) or module.run_simulation
+    with contextlib.redirect_stdout(io.StringIO()):
+        termination = run(parsed_instructions, labels, memory, limits=create_limits(**limits), sim_mode='a')
+    return termination, memory
+
+def normalize(value):
+    # Signed and unsigned spellings of the same 32-bit value compare equal;
+    # anything outside 32 bits is kept as is, since that is itself a bug
+    if isinstance(value, int) and -0x80000000 <= value <= MASK:
+        return value & MASK
+    return value
+
+def checkpoint_values(memory, index):
+    base = CHECKPOINT_BASE + index * CHECKPOINT_STRIDE
+    registers = tuple(normalize(memory.get(base + 4 * i, 0)) for i in range(len(REGISTERS)))
+    window = base + 4 * len(REGISTERS)
+    data = tuple(normalize(memory.get(window + 4 * i, 0)) for i in range(DATA_WORDS))
+    return registers, data
+
+def digest(values):
+    return hashlib.blake2b(repr(values).encode(), digest_size=8).hexdigest()
+
+def fingerprints(memory, checkpoints):
+    # [(register hash, memory hash)] per checkpoint
+    result = []
+    for index in range(checkpoints):
+        registers, data = checkpoint_values(memory, index)
+        result.append((digest(registers), digest(data)))
+    return result
+
+def split(values):
+    # Engine groups that agree on a value, largest group first
+    groups = {}
+    for engine, value in values.items():
+        groups.setdefault(value, []).append(engine)
+    return sorted(groups.values(), key=lambda group: (-len(group), group))
+
+def compare_runs(runs, checkpoints):
+    # runs: {engine: (termination, memory)}; returns the first divergence or None
+    prints = {engine: fingerprints(memory, checkpoints) for engine, (termination, memory) in runs.items()}
+    for index in range(checkpoints):
+        groups = split({engine: prints[engine][index] for engine in runs})
+        if len(groups) > 1:
+            return {'checkpoint': index, 'groups': groups, 'detail': divergence_detail(runs, index)}
+    groups = split({engine: termination['reason'] for engine, (termination, memory) in runs.items()})
+    if len(groups) > 1:
+        detail = {engine: f"{termination['reason']} {termination.get('detail') or ''}".strip()
+                  for engine, (termination, memory) in runs.items()}
+        return {'checkpoint': None, 'groups': groups, 'detail': {'termination': detail}}
+    return None
+
+def divergence_detail(runs, index):
+    # {location: {engine: value}} for the registers and data words that differ
+    detail = {}
+    values = {engine: checkpoint_values(memory, index) for engine, (termination, memory) in runs.items()}
+    names = [f"${name}" for name in REGISTERS] + [f"0x{DATA_BASE + 4 * i:x}" for i in range(DATA_WORDS)]
+    for position, name in enumerate(names):
+        seen = {engine: (registers + data)[position] for engine, (registers, data) in values.items()}
+        if len(set(seen.values())) > 1:
+            detail[name] = seen
+    for engine, (termination, memory) in runs.items():
+        if termination['reason'] != 'exit':
+            detail.setdefault('termination', {})[engine] = f"{termination['reason']} {termination.get('detail') or ''}".strip()
+    return detail
+
+def check_program(items, engines, every, limits):
+    # Returns (divergence or None, instructions executed across all engines)
+    lines, checkpoints = render(items, every)
+    runs = {}
+    instructions = 0
+    for engine in engines:
+        try:
+            runs[engine] = run_program(engine, lines, limits)
+        except Exception as e:
+            runs[engine] = ({'reason': 'crash', 'detail': f"{type(e).__name__}: {e}", 'instructions': 0}, {})
+        instructions += runs[engine][0]['instructions']
+    return compare_runs(runs, checkpoints), instructions
+
+def signature(divergence):
+    # What has to stay the same while a case is shrunk: which engines side together
+    if divergence is None:
+        return None
+    return frozenset(frozenset(group) for group in divergence['groups'])
+
+def minimize(items, engines, every, limits, target):
+    # Delete chunks of items, halving the chunk size whenever no deletion keeps
+    # the divergence, down to single items
+    chunk = max(len(items) // 2, 1)
+    while True:
+        changed = False
+        start = 0
+        while start < len(items):
+            candidate = items[:start] + items[start + chunk:]
+            if candidate and signature(check_program(candidate, engines, every, limits)[0]) == target:
+                items = candidate
+                changed = True
+            else:
+                start += chunk
+        if chunk == 1 and not changed:
+            return items
+        if not changed:
+            chunk = max(chunk // 2, 1)
+
+def fuzz_batch(seeds, options):
+    # Worker entry point: returns (programs, instructions, failures)
+    engines, every, limits = options['engines'], options['every'], options['limits']
+    instructions = 0
+    failures = []
+    for seed in seeds:
+        items = generate_program(seed, options['length'], options['ops'])
+        divergence, count = check_program(items, engines, every, limits)
+        instructions += count
+        if divergence is None:
+            continue
+        failure = {'seed': seed, 'items': items, 'every': every, 'divergence': divergence}
+        if options['minimize']:
+            target = signature(divergence)
+            items = minimize(items, engines, every, limits, target)
+            # With a checkpoint after every item the report names the exact instruction
+            exact = check_program(items, engines, 1, limits)[0]
+            if signature(exact) == target:
+                failure.update(items=items, every=1, divergence=exact)
+            else:
+                failure.update(items=items, divergence=check_program(items, engines, every, limits)[0])
+        failures.append(failure)
+    return len(seeds), instructions, failures
+
+def describe_divergence(divergence):
+    lines = []
+    where = 'termination' if divergence['checkpoint'] is None else f"checkpoint {divergence['checkpoint']}"
+    lines.append(f"Divergence at {where}: " + " | ".join(",".join(group) for group in divergence['groups']))
+    for location, values in divergence['detail'].items():
+        shown = ", ".join(f"{engine}={value:#x}" if isinstance(value, int) else f"{engine}={value}"
+                          for engine, value in values.items())
+        lines.append(f"  {location}: {shown}")
+    return lines
+
+def write_failure(failure, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    file_path = os.path.join(output_dir, f"seed-{failure['seed']}.asm")
+    lines, checkpoints = render(failure['items'], failure['every'])
+    with open(file_path, 'w') as file:
+        file.write(f"# fuzz.py seed {failure['seed']}, checkpoint every {failure['every']} instruction(s)\n")
+        for line in describe_divergence(failure['divergence']):
+            file.write(f"# {line}\n")
+        for line in lines:
+            file.write(line + "\n")
+    return file_path
+
+def fuzz(seed, programs, workers, every, length, engines=ENGINES, ops=OPS, minimize_failures=True,
+         output_dir='fuzz_failures', batch_size=20, limits=FUZZ_LIMITS):
+    options = {'engines': engines, 'every': every, 'length': length, 'ops': ops,
+               'minimize': minimize_failures, 'limits': limits}
+    seeds = list(range(seed, seed + programs))
+    batches = [seeds[i:i + batch_size] for i in range(0, len(seeds), batch_size)]
+    done = instructions = 0
+    failures = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_worker, initargs=(engines,)) as pool:
+        futures = [pool.submit(fuzz_batch, batch, options) for batch in batches]
+        for future in as_completed(futures):
+            count, executed, found = future.result()
+            done += count
+            instructions += executed
+            for failure in found:
+                failures.append(failure)
+                file_path = write_failure(failure, output_dir)
+                print(f"Seed {failure['seed']}: {len(failure['items'])} instruction(s) -> {file_path}")
+                for line in describe_divergence(failure['divergence']):
+                    print(f"  {line}")
+            elapsed = time.perf_counter() - start
+            print(f"{done}/{programs} programs, {instructions} instructions checked "
+                  f"({instructions / elapsed * 60:.0f}/min), {len(failures)} failing", flush=True)
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Differential fuzzing of the simulator engines")
+    parser.add_argument('--seed', type=int, default=0, help="First program seed")
+    parser.add_argument('--programs', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--every', type=int, default=25, help="Random instructions between checkpoints")
+    parser.add_argument('--length', type=int, default=400, help="Random instructions per program")
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--exclude-ops', default='', help="Comma separated opcodes not to generate")
+    parser.add_argument('--no-minimize', action='store_true')
+    parser.add_argument('--output-dir', default='fuzz_failures')
+    args = parser.parse_args()
+
+    if args.every < 1 or args.length // args.every + 1 > MAX_CHECKPOINTS:
+        print(f"Error: at most {MAX_CHECKPOINTS} checkpoints fit; raise --every or lower --length")
+        sys.exit(2)
+    engines = [engine for engine in args.engines.split(',') if engine]
+    unknown = set(engines) - set(ENGINES)
+    if unknown:
+        print(f"Error: unknown engine {', '.join(sorted(unknown))}; choose from {', '.join(ENGINES)}")
+        sys.exit(2)
+    excluded = set(args.exclude_ops.split(','))
+    ops = [op for op in OPS if op not in excluded]
+    failures = fuzz(args.seed, args.programs, args.workers, args.every, args.length, engines, ops,
+                    not args.no_minimize, args.output_dir)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
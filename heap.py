@@ -0,0 +1,53 @@
+# Heap segment for the sbrk syscall (syscall 9)
+HEAP_BASE = 0x10040000  # Heap starts above the .data section, like MARS
+PAGE_SIZE = 4096
+DEFAULT_HEAP_LIMIT = 0x100000  # 1 MB of guest heap unless configured otherwise
+
+def create_heap(limit=DEFAULT_HEAP_LIMIT, base=HEAP_BASE, page_size=PAGE_SIZE):
+    return {
+        'base': base,
+        'brk': base,          # Current program break
+        'top': base,          # End of the committed (page-aligned) region
+        'limit': limit,
+        'page_size': page_size,
+        'pages': 0,           # Pages committed so far
+        'high_water': 0,      # Largest brk - base seen
+        'allocations': 0,     # Successful sbrk calls with a positive increment
+        'bytes_allocated': 0,
+        'failures': 0,
+    }
+
+def sbrk(heap, increment):
+    # Returns the old break, or None if the request would exceed the heap limit
+    if increment >= 0x80000000:
+        increment -= 0x100000000  # $a0 holds a 32-bit two's complement value
+    increment = (increment + 3) & ~3  # Keep the break word aligned
+    old_brk = heap['brk']
+    new_brk = old_brk + increment
+    if new_brk < heap['base']:
+        heap['failures'] += 1
+        return None
+    if new_brk - heap['base'] > heap['limit']:
+        heap['failures'] += 1
+        return None
+
+    # Grow the committed region in whole pages. Memory is sparse, so untouched
+    # heap words already read as zero and nothing has to be filled in.
+    while heap['top'] < new_brk:
+        heap['top'] += heap['page_size']
+        heap['pages'] += 1
+
+    heap['brk'] = new_brk
+    if increment > 0:
+        heap['allocations'] += 1
+        heap['bytes_allocated'] += increment
+    heap['high_water'] = max(heap['high_water'], new_brk - heap['base'])
+    return old_brk
+
+def display_heap_stats(heap):
+    print("Heap:")
+    print(f"Base: {heap['base']:08x}  Break: {heap['brk']:08x}  Limit: {heap['limit']} bytes")
+    print(f"High-water mark: {heap['high_water']} bytes")
+    print(f"Pages committed: {heap['pages']} ({heap['pages'] * heap['page_size']} bytes)")
+    print(f"Allocations: {heap['allocations']} ({heap['bytes_allocated']} bytes), failed: {heap['failures']}")
+    print()
@@ -0,0 +1,222 @@
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import sys
+import tempfile
+import time
+from array import array
+
+from decoder import decode
+from limits import create_limits, start_limits, check_limits
+from machine import Machine, compile_program
+from source_map import describe_pc
+from stream_asm import read_lines, strip_comments, tokenize, layout, emit
+
+# Host-side profile of the simulator itself. host_profile.py runs the Machine
+# pipeline phase by phase with a timer around each phase:
+#   read    source lines, comments stripped, tokenized
+#   parse   label and data layout (the parse_labels_and_instructions step)
+#   encode  convert_to_binary for every instruction
+#   decode  words -> handler functions
+#   execute the program; every SAMPLE_INTERVAL-th instruction is timed on its
+#           own and charged to its opcode
+#   output  printing what the program wrote
+# A second, separate run under cProfile gives the function-level picture; its
+# dump goes to the temp directory unless a path is given.
+# main.py --profile-host profiles main.py's own engine instead (profile_main):
+# read_asm_file, parse_labels_and_instructions, assemble and Run_simulation
+# are timed as read, parse, encode and execute. Run_simulation has no
+# per-instruction handlers to sample, so there is no opcode breakdown.
+SAMPLE_INTERVAL = 97  # Not a power of two, so loops do not alias with it
+PHASES = ['read', 'parse', 'encode', 'decode', 'execute', 'output']
+
+def timer_overhead(rounds=10000):
+    # Cost of an empty perf_counter_ns pair, subtracted from every sample
+    best = None
+    for _ in range(5):
+        start = time.perf_counter_ns()
+        for _ in range(rounds):
+            a = time.perf_counter_ns()
+            b = time.perf_counter_ns()
+        elapsed = (time.perf_counter_ns() - start) / rounds
+        best = elapsed if best is None else min(best, elapsed)
+    return best / 2
+
+def run_sampled(machine, limits, overhead=0, interval=SAMPLE_INTERVAL):
+    # Run to completion; returns {opcode: [samples, total ns]}
+    ops = [decode(word)['op'] for word in machine.words]
+    handlers = machine.plain_handlers
+    base, count = machine.text_base, len(handlers)
+    samples = {}
+    clock = time.perf_counter_ns
+    start_limits(limits)
+    max_instructions = limits['max_instructions']
+    while machine.reason is None:
+        # Every limit, the time limit included, is checked once per interval
+        limit_hit = check_limits(limits, machine.instructions, machine.memory)
+        if limit_hit:
+            machine.reason = limit_hit
+            break
+        block = interval - 1
+        if max_instructions is not None:
+            block = min(block, max_instructions - machine.instructions)
+        machine.step(block)
+        index = (machine.pc - base) >> 2
+        if machine.reason is not None or not 0 <= index < count or machine.instructions == max_instructions:
+            continue
+        reg, mem = machine.reg, machine.memory
+        handler = handlers[index]
+        before = clock()
+        try:
+            next_pc = handler(reg, mem)
+        except Exception as e:
+            # A guest error ends the run as it would in Machine.step
+            machine.reason, machine.detail = 'error', str(e)
+            machine._write(f"Error executing instruction at {describe_pc(machine.source_map, machine.pc)}: {e}")
+            break
+        elapsed = clock() - before - overhead
+        entry = samples.setdefault(ops[index], [0, 0])
+        entry[0] += 1
+        entry[1] += max(elapsed, 0)
+        machine.instructions += 1
+        if next_pc < 0:
+            machine.pc = ~next_pc
+            machine._syscall()
+        else:
+            machine.pc = next_pc
+    return samples
+
+def profile_phases(file_path, limits):
+    # Returns ({phase: seconds}, opcode samples, machine)
+    times = {}
+    clock = time.perf_counter
+
+    start = clock()
+    token_list = list(tokenize(strip_comments(read_lines(file_path))))
+    times['read'] = clock() - start
+
+    start = clock()
+    labels, memory = layout(token_list)
+    times['parse'] = clock() - start
+
+    start = clock()
+    words = array('I')
+    for pc, word, line_number, text in emit(token_list, labels):
+        words.append(word & 0xFFFFFFFF)
+    times['encode'] = clock() - start
+
+    start = clock()
+    compile_program(words)
+    times['decode'] = clock() - start
+
+    machine = Machine(words, memory, labels, echo=False, fuse=False)
+    overhead = timer_overhead()
+    start = clock()
+    samples = run_sampled(machine, limits, overhead)
+    times['execute'] = clock() - start
+
+    start = clock()
+    for line in machine.output:
+        print(line)
+    times['output'] = clock() - start
+    return times, samples, machine
+
+def display_phases(times, instructions):
+    total = sum(times.values()) or 1.0
+    print(f"{'Phase':<10} {'ms':>10} {'%':>6}")
+    for phase in [phase for phase in PHASES if phase in times]:
+        print(f"{phase:<10} {times[phase] * 1000:>10.2f} {100.0 * times[phase] / total:>6.1f}")
+    if times['execute']:
+        print(f"Execute: {instructions} instructions, {instructions / times['execute']:.0f} instructions/s")
+    print()
+
+def display_opcode_costs(samples, interval=SAMPLE_INTERVAL):
+    print(f"Host cost per guest opcode (1 in {interval} instructions sampled):")
+    print(f"{'Opcode':<10} {'Samples':>8} {'ns/inst':>8} {'Est. share':>10}")
+    estimated = {op: ns for op, (count, ns) in samples.items()}
+    total = sum(estimated.values()) or 1
+    for op in sorted(samples, key=lambda op: -estimated[op]):
+        count, ns = samples[op]
+        print(f"{op:<10} {count:>8} {ns / count:>8.0f} {100.0 * ns / total:>9.1f}%")
+    print()
+
+def default_dump_path(file_path):
+    # Kept out of the source tree
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(tempfile.gettempdir(), name + '.pstats')
+
+def cprofile_run(file_path, limits, dump_path, top=15):
+    # Whole pipeline under cProfile; the dump opens with pstats or snakeviz
+    profile = cProfile.Profile()
+    profile.enable()
+    machine = Machine.from_file(file_path, echo=False)
+    machine.run(limits)
+    profile.disable()
+    print_profile(profile, dump_path, top)
+
+def print_profile(profile, dump_path, top=15):
+    profile.dump_stats(dump_path)
+    report = io.StringIO()
+    pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(top)
+    print(report.getvalue())
+
+def profile_host(file_path, dump_path=None, max_instructions=None):
+    limits = create_limits(max_instructions=max_instructions)
+    times, samples, machine = profile_phases(file_path, limits)
+    print("=" * 80)
+    display_phases(times, machine.instructions)
+    display_opcode_costs(samples)
+    if dump_path is None:
+        dump_path = default_dump_path(file_path)
+    cprofile_run(file_path, create_limits(max_instructions=max_instructions), dump_path)
+    print(f"cProfile dump written to {dump_path}")
+
+def run_main_pipeline(file_path, limits, times=None):
+    # main.py's engine end to end with its output captured; fills in times per
+    # phase when given a dict. Returns (termination, captured output)
+    import main as engine
+    clock = time.perf_counter
+    output = io.StringIO()
+    times = {} if times is None else times
+    with contextlib.redirect_stdout(output):
+        start = clock()
+        instructions = engine.read_asm_file(file_path)
+        times['read'] = clock() - start
+        start = clock()
+        parsed_instructions, labels, memory = engine.parse_labels_and_instructions(instructions)
+        times['parse'] = clock() - start
+        start = clock()
+        program = engine.assemble(parsed_instructions, labels, memory)
+        times['encode'] = clock() - start
+        start = clock()
+        termination = engine.Run_simulation(program, labels, memory, limits=limits, sim_mode='a')
+        times['execute'] = clock() - start
+    return termination, output.getvalue()
+
+def profile_main(file_path, dump_path=None, max_instructions=None):
+    # main.py --profile-host: the same report for main.py's Run_simulation
+    times = {}
+    termination, output = run_main_pipeline(file_path, create_limits(max_instructions=max_instructions), times)
+    start = time.perf_counter()
+    print(output, end='')
+    times['output'] = time.perf_counter() - start
+    print("=" * 80)
+    display_phases(times, termination['instructions'])
+    if dump_path is None:
+        dump_path = default_dump_path(file_path)
+    profile = cProfile.Profile()
+    profile.enable()
+    run_main_pipeline(file_path, create_limits(max_instructions=max_instructions))
+    profile.disable()
+    print_profile(profile, dump_path)
+    print(f"cProfile dump written to {dump_path}")
+
+def main():
+    # host_profile.py program.asm [out.pstats]
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "program.asm"
+    profile_host(file_path, sys.argv[2] if len(sys.argv) > 2 else None)
+
+if __name__ == "__main__":
+    main()
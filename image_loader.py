@@ -0,0 +1,225 @@
+import os
+import re
+import sys
+import time
+from array import array
+
+from decoder import MASK, disassembly_listing
+
+# Loader for pre-assembled machine code, so a program can be run without its
+# source. Three formats are read straight into the text segment:
+#   binary  ASCII binary, one 32-digit word per line: what main.py writes to
+#           binary_code.txt and compiler.py to b.txt
+#   hex     a hex dump, one or more words per line, each line optionally
+#           starting with its address ("00000010: 8c080000 8c090004"); lines
+#           after ".data" are "address: value" data cells, and
+#           ".label name address" lines name addresses
+#   raw     a big-endian image of 32-bit words
+# Only hex has room for data and labels; binary and raw images are text only.
+# Content that is neither is raw when it is not text; other text (assembly
+# source, say) is no image format at all and load_image refuses it.
+# Note the engines write binary_code.txt as they execute, so it equals the
+# program image only for straight-line code; `image_loader.py write` saves a
+# proper image.
+FORMATS = ['binary', 'hex', 'raw']
+RAW_EXTENSIONS = ('.bin', '.img', '.raw')
+HEX_EXTENSIONS = ('.hex',)
+# Anything a hex dump line can hold: words, addresses, directives, label names
+HEX_TOKEN = re.compile(r'-?(0x)?[0-9a-f]+:?|\.[a-z]+|[a-z_][\w.$]*', re.IGNORECASE)
+
+def format_from_extension(file_path):
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in RAW_EXTENSIONS:
+        return 'raw'
+    if extension in HEX_EXTENSIONS:
+        return 'hex'
+    return None
+
+def is_text(data):
+    # Printable ASCII and whitespace only; machine words nearly always hold a
+    # zero or control byte somewhere
+    try:
+        text = data.decode('ascii')
+    except UnicodeDecodeError:
+        return False
+    return all(char.isprintable() or char in '\t\n\r\f\v' for char in text)
+
+def detect_format(file_path, data):
+    # By extension first, then by content; None for text that is not an image
+    fmt = format_from_extension(file_path)
+    if fmt is not None:
+        return fmt
+    if not data or not is_text(data):
+        return 'raw'
+    tokens = ' '.join(line.split('#', 1)[0] for line in data.decode('ascii').splitlines()).split()
+    if not tokens:
+        return None
+    if all(len(token) == 32 and not token.strip('01') for token in tokens):
+        return 'binary'
+    if all(HEX_TOKEN.fullmatch(token) for token in tokens):
+        return 'hex'
+    return None
+
+def read_binary(text):
+    words = array('I')
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.split('#', 1)[0].replace('_', '').strip()
+        if not line:
+            continue
+        if len(line) != 32 or line.strip('01'):
+            raise ValueError(f"Line {line_number}: expected 32 binary digits, got {line!r}")
+        words.append(int(line, 2))
+    return words, 0, {}, {}
+
+def read_hex(text):
+    # Returns (words, text base, data memory, labels)
+    words = array('I')
+    memory = {}
+    labels = {}
+    text_base = None
+    data_mode = False
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        try:
+            if line.startswith('.'):
+                parts = line.split()
+                if parts[0] == '.data':
+                    data_mode = True
+                elif parts[0] == '.text':
+                    data_mode = False
+                elif parts[0] == '.label' and len(parts) == 3:
+                    labels[parts[1]] = int(parts[2], 16)
+                else:
+                    raise ValueError(f"unknown directive {parts[0]}")
+                continue
+            address = None
+            if ':' in line:
+                address, line = line.split(':', 1)
+                address = int(address, 16)
+            values = [int(value, 16) for value in line.split()]
+            if data_mode:
+                if address is None:
+                    raise ValueError("data cells need an address")
+                for value in values:
+                    memory[address] = value
+                    address += 4
+                continue
+            if address is not None:
+                if text_base is None:
+                    text_base = address
+                index = address - text_base
+                if index < 4 * len(words) or index & 3:
+                    raise ValueError(f"address {address:08x} overlaps or is unaligned")
+                # A gap in the addresses is filled with zero words
+                words.extend([0] * (index // 4 - len(words)))
+            for value in values:
+                if not 0 <= value <= MASK:
+                    raise ValueError(f"{value:#x} is not a 32-bit word")
+                words.append(value)
+        except ValueError as e:
+            raise ValueError(f"Line {line_number}: {e}")
+    return words, text_base or 0, memory, labels
+
+def read_raw(data):
+    if len(data) % 4:
+        raise ValueError(f"Raw image size {len(data)} is not a multiple of 4 bytes")
+    words = array('I')
+    words.frombytes(data)
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return words, 0, {}, {}
+
+def load_image(file_path, fmt=None):
+    # Same shape as elf_loader.load_elf, with the data memory as a plain dict
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    fmt = fmt or detect_format(file_path, data)
+    if fmt is None:
+        raise ValueError(f"Unrecognised program format in {file_path}: text that is neither a binary nor "
+                         f"a hex image; give the format ({', '.join(FORMATS)}) or load it as assembly source")
+    if fmt == 'binary':
+        words, text_base, memory, labels = read_binary(data.decode('ascii'))
+    elif fmt == 'hex':
+        words, text_base, memory, labels = read_hex(data.decode('ascii'))
+    elif fmt == 'raw':
+        words, text_base, memory, labels = read_raw(data)
+    else:
+        raise ValueError(f"Unknown image format {fmt}; choose from {', '.join(FORMATS)}")
+    return {
+        'entry': text_base,
+        'text_base': text_base,
+        'words': words,
+        'memory': memory,
+        'symbols': labels,
+        'format': fmt,
+    }
+
+def write_image(file_path, words, fmt, memory=None, labels=None, text_base=0):
+    # Returns False when the format had to leave out data or labels
+    if fmt == 'raw':
+        image = array('I', words)
+        if sys.byteorder == 'little':
+            image.byteswap()
+        with open(file_path, 'wb') as file:
+            file.write(image.tobytes())
+    elif fmt == 'binary':
+        with open(file_path, 'w') as file:
+            file.writelines(f"{word:032b}\n" for word in words)
+    elif fmt == 'hex':
+        with open(file_path, 'w') as file:
+            for name, address in sorted((labels or {}).items(), key=lambda item: item[1]):
+                file.write(f".label {name} {address:08x}\n")
+            for index, word in enumerate(words):
+                file.write(f"{text_base + 4 * index:08x}: {word:08x}\n")
+            if memory:
+                file.write(".data\n")
+                for address, value in sorted(memory.items()):
+                    file.write(f"{address:08x}: {value:#x}\n")
+        return True
+    else:
+        raise ValueError(f"Unknown image format {fmt}; choose from {', '.join(FORMATS)}")
+    return not memory and not labels
+
+def main():
+    # image_loader.py dump image [format]
+    # image_loader.py write program.asm out [format]
+    # image_loader.py run image...
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'dump' and len(sys.argv) > 2:
+        try:
+            image = load_image(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        symbols = {address: name for name, address in image['symbols'].items()}
+        print(f"{image['format']} image: {len(image['words'])} words at {image['text_base']:08x}, "
+              f"{len(image['memory'])} data cells")
+        for line in disassembly_listing(image['words'], image['text_base'], symbols):
+            print(line)
+    elif command == 'write' and len(sys.argv) > 3:
+        from stream_asm import assemble_file
+        words, labels, memory = assemble_file(sys.argv[2])
+        fmt = sys.argv[4] if len(sys.argv) > 4 else format_from_extension(sys.argv[3]) or 'hex'
+        if not write_image(sys.argv[3], words, fmt, memory, labels):
+            print(f"Warning: {fmt} images hold text only; data and labels were left out")
+        print(f"Wrote {len(words)} words to {sys.argv[3]} ({fmt})")
+    elif command == 'run' and len(sys.argv) > 2:
+        # Batch run of pre-assembled programs: no source is read or parsed
+        from machine import Machine
+        for file_path in sys.argv[2:]:
+            start = time.perf_counter()
+            machine = Machine.from_image(file_path, echo=False)
+            loaded = time.perf_counter() - start
+            termination = machine.run()
+            print(f"{file_path}: {termination['reason']}, {termination['instructions']} instructions, "
+                  f"loaded in {1000 * loaded:.2f} ms")
+            for line in machine.output:
+                print(f"  {line}")
+    else:
+        print("Usage: image_loader.py dump image [format] | write program.asm out [format] | run image...")
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
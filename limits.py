@@ -0,0 +1,58 @@
+import time
+
+# Per-run resource limits. Engines only compare an instruction counter against
+# the next checkpoint each step; the clock and memory size are looked at once
+# every check_interval instructions so the limits cost nothing measurable.
+DEFAULT_CHECK_INTERVAL = 4096
+
+def create_limits(max_instructions=None, max_seconds=None, max_memory=None,
+                  check_interval=DEFAULT_CHECK_INTERVAL):
+    return {
+        'max_instructions': max_instructions,  # Instructions executed
+        'max_seconds': max_seconds,            # Wall-clock time
+        'max_memory': max_memory,              # Resident guest memory cells
+        'check_interval': check_interval,
+        'start_time': None,
+    }
+
+def start_limits(limits):
+    limits['start_time'] = time.perf_counter()
+    return next_limit_check(limits, 0)
+
+def next_limit_check(limits, executed):
+    # Land exactly on the instruction budget so it is never overshot
+    next_check = executed + limits['check_interval']
+    if limits['max_instructions'] is not None:
+        next_check = min(next_check, limits['max_instructions'])
+    return next_check
+
+def check_limits(limits, executed, memory):
+    # Returns the name of the exceeded limit, or None
+    if limits['max_instructions'] is not None and executed >= limits['max_instructions']:
+        return 'instruction_limit'
+    if limits['max_seconds'] is not None and time.perf_counter() - limits['start_time'] >= limits['max_seconds']:
+        return 'time_limit'
+    if limits['max_memory'] is not None and len(memory) > limits['max_memory']:
+        return 'memory_limit'
+    return None
+
+def make_termination(reason, limits, executed, pc, memory, detail=None):
+    # Structured description of why a run stopped
+    elapsed = 0.0
+    if limits['start_time'] is not None:
+        elapsed = time.perf_counter() - limits['start_time']
+    return {
+        'reason': reason,  # exit, end_of_program, error or one of the *_limit names
+        'instructions': executed,
+        'pc': pc,
+        'elapsed': elapsed,
+        'memory': len(memory),
+        'detail': detail,
+    }
+
+def display_termination(termination):
+    if termination['reason'].endswith('_limit'):
+        where = termination.get('source') or f"PC {termination['pc']:08x}"
+        print(f"Terminated: {termination['reason'].replace('_', ' ')} reached at {where} "
+              f"after {termination['instructions']} instructions ({termination['elapsed']:.3f}s, "
+              f"{termination['memory']} memory cells)")
@@ -0,0 +1,521 @@
+import main as assembler
+from heap import create_heap, sbrk, DEFAULT_HEAP_LIMIT
+from limits import create_limits, start_limits, check_limits, make_termination
+from memory import PagedMemory
+from devices import clone_device
+from elf_loader import ELF_MAGIC, load_elf
+from image_loader import load_image, detect_format
+from stream_asm import assemble_file
+from source_map import SourceMap, DisassemblyMap, describe_pc
+from decoder import MASK, decode, signed
+from fusion import fuse_handlers, fuse_at, fused_count
+from code_coverage import create_coverage, instrument_branches
+from counters import counters_from_counts
+from plugins import registered_hooks, combine_callbacks, instrument_plugins, SyscallAfter
+
+# Reusable machine built once from an assembled program. Instructions are
+# decoded a single time into small handler functions `handler(reg, mem)` that
+# return the next PC; forks and resets share those handlers and the pristine
+# data image, so a new run only costs fresh registers and copy-on-write pages.
+STACK_POINTER = 0x7FFFFFFC
+
+def make_handler(word, pc):
+    f = decode(word)
+    op, rs, rt, rd, shamt, imm, simm = f['op'], f['rs'], f['rt'], f['rd'], f['shamt'], f['imm'], f['simm']
+    nxt = pc + 4
+
+    def nop(reg, mem):
+        return nxt
+
+    if op == 'syscall':
+        # A negative PC leaves the fast loop; ~nxt encodes where to resume
+        def handler(reg, mem):
+            return ~nxt
+    elif op == 'beq':
+        target = nxt + (simm << 2)
+        def handler(reg, mem):
+            return target if reg[rs] == reg[rt] else nxt
+    elif op == 'bne':
+        target = nxt + (simm << 2)
+        def handler(reg, mem):
+            return target if reg[rs] != reg[rt] else nxt
+    elif op == 'j':
+        target = (nxt & 0xF0000000) | (f['address'] << 2)
+        def handler(reg, mem):
+            return target
+    elif op == 'jal':
+        target = (nxt & 0xF0000000) | (f['address'] << 2)
+        def handler(reg, mem):
+            reg[31] = nxt
+            return target
+    elif op == 'jr':
+        def handler(reg, mem):
+            return reg[rs]
+    elif op == 'sw':
+        def handler(reg, mem):
+            mem[(reg[rs] + simm) & MASK] = reg[rt]
+            return nxt
+    elif op == 'sc':
+        def handler(reg, mem):
+            stored = mem.store_conditional((reg[rs] + simm) & MASK, reg[rt])
+            if rt:
+                reg[rt] = 1 if stored else 0
+            return nxt
+    elif op == 'unknown':
+        def handler(reg, mem):
+            raise ValueError(f"Unknown operation {word:032b}")
+    elif op in ('addi', 'andi', 'ori', 'lui', 'lw', 'll'):
+        if rt == 0:
+            return nop  # Writes to $zero are discarded
+        if op == 'addi':
+            def handler(reg, mem):
+                reg[rt] = (reg[rs] + simm) & MASK
+                return nxt
+        elif op == 'andi':
+            def handler(reg, mem):
+                reg[rt] = reg[rs] & imm
+                return nxt
+        elif op == 'ori':
+            def handler(reg, mem):
+                reg[rt] = reg[rs] | imm
+                return nxt
+        elif op == 'lui':
+            value = imm << 16
+            def handler(reg, mem):
+                reg[rt] = value
+                return nxt
+        elif op == 'll':
+            def handler(reg, mem):
+                reg[rt] = mem.load_linked((reg[rs] + simm) & MASK) & MASK
+                return nxt
+        else:
+            def handler(reg, mem):
+                reg[rt] = mem.get((reg[rs] + simm) & MASK, 0) & MASK
+                return nxt
+    else:
+        # R-type ALU operations (and mul)
+        if rd == 0:
+            return nop
+        if op == 'add':
+            def handler(reg, mem):
+                reg[rd] = (reg[rs] + reg[rt]) & MASK
+                return nxt
+        elif op == 'sub':
+            def handler(reg, mem):
+                reg[rd] = (reg[rs] - reg[rt]) & MASK
+                return nxt
+        elif op == 'and':
+            def handler(reg, mem):
+                reg[rd] = reg[rs] & reg[rt]
+                return nxt
+        elif op == 'or':
+            def handler(reg, mem):
+                reg[rd] = reg[rs] | reg[rt]
+                return nxt
+        elif op == 'xor':
+            def handler(reg, mem):
+                reg[rd] = reg[rs] ^ reg[rt]
+                return nxt
+        elif op == 'nor':
+            def handler(reg, mem):
+                reg[rd] = ~(reg[rs] | reg[rt]) & MASK
+                return nxt
+        elif op == 'slt':
+            # Flipping the sign bit turns a signed compare into an unsigned one
+            def handler(reg, mem):
+                reg[rd] = 1 if (reg[rs] ^ 0x80000000) < (reg[rt] ^ 0x80000000) else 0
+                return nxt
+        elif op == 'mul':
+            def handler(reg, mem):
+                reg[rd] = (reg[rs] * reg[rt]) & MASK
+                return nxt
+        elif op == 'sll':
+            def handler(reg, mem):
+                reg[rd] = (reg[rt] << shamt) & MASK
+                return nxt
+        else:  # srl
+            def handler(reg, mem):
+                reg[rd] = reg[rt] >> shamt
+                return nxt
+    return handler
+
+def count_branches(handlers, words, text_base, taken_counts):
+    # Wrap beq/bne handlers to count taken branches; the rest is derived later
+    counted = list(handlers)
+    for index, word in enumerate(words):
+        if decode(word)['op'] in ('beq', 'bne'):
+            counted[index] = _taken_counter(handlers[index], index, text_base + 4 * index + 4, taken_counts)
+    return counted
+
+def _taken_counter(handler, index, fall_through, taken_counts):
+    def counter(reg, mem):
+        pc = handler(reg, mem)
+        if pc != fall_through:
+            taken_counts[index] += 1
+        return pc
+    return counter
+
+def compile_program(words, text_base=0):
+    return [make_handler(word, text_base + 4 * index) for index, word in enumerate(words)]
+
+def assemble(parsed_instructions, labels):
+    # Same expansion as main.Run_simulation, invalid lines become a 0 word
+    program = assembler.assemble(parsed_instructions, labels, {})
+    for instruction in program.instructions:
+        if instruction.word is None:
+            print(f"Invalid instruction at PC {instruction.pc}: {instruction.text}")
+    return program.words()
+
+class Machine:
+    def __init__(self, words, memory=None, labels=None, text_base=0, entry=None,
+                 heap_limit=DEFAULT_HEAP_LIMIT, echo=True, fuse=True, coverage=False, trace=None,
+                 source_map=None, counters=False, plugins=None, devices=None):
+        self.words = list(words)
+        self.labels = dict(labels or {})
+        self.text_base = text_base
+        self.entry = text_base if entry is None else entry
+        self.heap_limit = heap_limit
+        self.echo = echo  # Print syscall output as well as collecting it
+        self.symbols = dict(self.labels)  # Name -> address, used by the profiler
+        self.initial_gp = 0
+        self.hart_id = 0  # Returned by syscall 60; see multihart.py
+        # Strings packed four bytes to a big-endian word (ELF data), rather
+        # than one byte per cell as the assemblers lay out .asciiz
+        self.packed_strings = False
+        self.source_map = source_map  # PC -> source line, when built from a source file
+        self.plain_handlers = compile_program(self.words, text_base)
+        self.handlers = self.plain_handlers
+        self.fusion = None  # Fused pattern statistics, shared by forks
+        self.coverage = None  # Coverage maps, accumulated across resets and forks
+        self.counts = None  # Executions per text word when counters are on
+        self.instrumented = trace is not None or coverage or counters
+        if trace is not None:
+            # e.g. a mem_trace.TraceWriter or profiler.CallProfiler; it wraps the handlers it needs
+            self.plain_handlers = trace.instrument(self.plain_handlers, self.words, text_base)
+            self.handlers = self.plain_handlers
+            fuse = False
+        self.syscall_hook = None
+        self.syscall_after = None
+        if plugins:
+            # See plugins.py; only the hooks some plugin defines are wired in
+            hooks = registered_hooks(plugins)
+            if 'syscall' in hooks:
+                self.syscall_hook = combine_callbacks(hooks.pop('syscall'))
+            if 'after_instruction' in hooks:
+                self.syscall_after = SyscallAfter(combine_callbacks(hooks['after_instruction']))
+            if hooks:
+                self.plain_handlers = instrument_plugins(self.plain_handlers, self.words, text_base, hooks,
+                                                         self.syscall_after)
+                self.handlers = self.plain_handlers
+                self.instrumented = True
+                fuse = False
+        if counters:
+            if coverage:
+                raise ValueError("Counters and coverage cannot be enabled together")
+            self.counts = [0] * len(self.words)
+            self.taken_counts = [0] * len(self.words)
+            self.plain_handlers = count_branches(self.plain_handlers, self.words, text_base, self.taken_counts)
+            self.handlers = self.plain_handlers
+        elif coverage:
+            # Fused pairs would hide their second instruction from the map
+            self.coverage = create_coverage(len(self.words))
+            self.plain_handlers = instrument_branches(self.plain_handlers, self.words, text_base, self.coverage)
+            self.handlers = self.plain_handlers
+        elif fuse:
+            self.handlers, self.fusion = fuse_handlers(self.words, self.plain_handlers, text_base)
+        self.pristine = memory if isinstance(memory, PagedMemory) else PagedMemory(memory)
+        self.devices = []  # Memory-mapped devices, see devices.py; shared by forks
+        for base, device in devices or ():
+            self.pristine.map_device(base, device.size, device)
+            device.attach(self)
+            self.devices.append(device)
+        self.reset()
+
+    @classmethod
+    def from_file(cls, file_path, **kwargs):
+        source_map = SourceMap(file_path)
+        words, labels, memory = assemble_file(file_path, source_map)
+        return cls(words, memory, labels, source_map=source_map, **kwargs)
+
+    @classmethod
+    def from_elf(cls, file_path, **kwargs):
+        image = load_elf(file_path)
+        kwargs.setdefault('source_map', DisassemblyMap(image['words'], image['text_base'], image['symbols']))
+        machine = cls(image['words'], image['memory'], image['symbols'],
+                      text_base=image['text_base'], entry=image['entry'], **kwargs)
+        machine.symbols = image['symbols']
+        if '_gp' in image['symbols']:
+            machine.initial_gp = image['symbols']['_gp']
+            machine.reg[28] = machine.initial_gp
+        machine.packed_strings = True
+        return machine
+
+    @classmethod
+    def from_image(cls, file_path, fmt=None, **kwargs):
+        # Pre-assembled machine code (image_loader.py); nothing is parsed
+        image = load_image(file_path, fmt)
+        kwargs.setdefault('source_map', DisassemblyMap(image['words'], image['text_base'], image['symbols']))
+        return cls(image['words'], image['memory'], image['symbols'],
+                   text_base=image['text_base'], entry=image['entry'], **kwargs)
+
+    @classmethod
+    def load(cls, file_path, **kwargs):
+        # Any program file: ELF executable, assembly source or machine code image.
+        # Text that is no image format is taken to be source, whatever its name
+        with open(file_path, 'rb') as file:
+            data = file.read()
+        if data.startswith(ELF_MAGIC):
+            return cls.from_elf(file_path, **kwargs)
+        if file_path.endswith(('.asm', '.s')):
+            return cls.from_file(file_path, **kwargs)
+        fmt = detect_format(file_path, data)
+        if fmt is None:
+            return cls.from_file(file_path, **kwargs)
+        return cls.from_image(file_path, fmt, **kwargs)
+
+    def reset(self):
+        # Back to the state right after loading, without reassembling
+        self.memory = self.pristine.fork()
+        self.reg = [0] * 32
+        self.reg[29] = STACK_POINTER
+        self.reg[28] = self.initial_gp
+        self.pc = self.entry
+        self.heap = create_heap(self.heap_limit)
+        self.instructions = 0
+        self.output = []
+        self.reason = None   # Why the machine stopped; None while it can run
+        self.detail = None
+        for device in self.devices:
+            device.reset()
+
+    def fork(self):
+        # Child shares handlers and every page until one side writes to it
+        child = Machine.__new__(Machine)
+        child.__dict__.update(self.__dict__)
+        child.memory = self.memory.fork()
+        child.reg = list(self.reg)
+        child.heap = dict(self.heap)
+        child.output = list(self.output)
+        if self.devices:
+            # The child gets its own devices, in the state they had at the fork
+            twins = {device: clone_device(device) for device in self.devices}
+            child.devices = list(twins.values())
+            child.pristine = self.pristine.fork()
+            child.pristine.replace_devices(twins)
+            child.memory.replace_devices(twins)
+            for twin in child.devices:
+                twin.attach(child)
+        return child
+
+    def read_register(self, register):
+        if isinstance(register, str):
+            register = assembler.get_register_number(register)
+        return self.reg[register]
+
+    def write_register(self, register, value):
+        if isinstance(register, str):
+            register = assembler.get_register_number(register)
+        if register != 0:
+            self.reg[register] = value & MASK
+
+    def registers(self):
+        return {assembler.get_register_name(num): self.reg[num] for num in range(32)}
+
+    def load_word(self, address):
+        return self.memory.get(address, 0)
+
+    def store_word(self, address, value):
+        self.memory[address] = value
+
+    def patch_words(self, changes):
+        # Replace text words in place ({index: word}) without rebuilding the
+        # machine; only the touched handlers and fused pairs are recompiled
+        if self.instrumented:
+            raise ValueError("Cannot patch an instrumented machine")
+        refuse = {i for changed in changes for i in (changed - 1, changed) if 0 <= i < len(self.words)}
+        if self.fusion is not None:
+            for index in refuse:
+                old = decode(self.words[index]) if self.handlers[index] is not self.plain_handlers[index] else None
+                if old is not None and index + 1 < len(self.words):
+                    pattern = f"{old['op']}+{decode(self.words[index + 1])['op']}"
+                    self.fusion[pattern]['sites'] -= 1
+        for index, word in changes.items():
+            self.words[index] = word
+            self.plain_handlers[index] = make_handler(word, self.text_base + 4 * index)
+        if self.fusion is not None:
+            for index in refuse:
+                fused = fuse_at(self.words, index, self.text_base, self.fusion)
+                self.handlers[index] = fused if fused is not None else self.plain_handlers[index]
+
+    def step(self, n=1):
+        # Execute up to n instructions; returns how many actually ran
+        if self.fusion is None:
+            return self._execute(self.handlers, n)
+        # A fused handler retires two instructions per dispatch, so give the
+        # fused loop at most half of what is left and finish with plain handlers
+        done = 0
+        while done < n and self.reason is None:
+            budget = (n - done) // 2
+            if budget:
+                before = fused_count(self.fusion)
+                done += self._execute(self.handlers, budget)
+                extra = fused_count(self.fusion) - before
+                self.instructions += extra
+                done += extra
+            else:
+                done += self._execute(self.plain_handlers, n - done)
+        return done
+
+    def _execute(self, handlers, n):
+        if self.reason is not None:
+            return 0
+        count = len(handlers)
+        base = self.text_base
+        reg = self.reg
+        mem = self.memory
+        pc = self.pc
+        executed = 0
+        try:
+            if self.counts is not None:
+                # Same loop with one execution counter bumped per instruction
+                counts = self.counts
+                while executed < n:
+                    index = (pc - base) >> 2
+                    if 0 <= index < count:
+                        counts[index] += 1
+                        pc = handlers[index](reg, mem)
+                        executed += 1
+                    elif pc < 0:
+                        pc = ~pc
+                        if not self._syscall():
+                            break
+                    else:
+                        self.reason = 'end_of_program'
+                        break
+            elif self.coverage is None:
+                while executed < n:
+                    index = (pc - base) >> 2
+                    if 0 <= index < count:
+                        pc = handlers[index](reg, mem)
+                        executed += 1
+                    elif pc < 0:
+                        pc = ~pc
+                        if not self._syscall():
+                            break
+                    else:
+                        self.reason = 'end_of_program'
+                        break
+            else:
+                # Same loop with one coverage slot set per instruction
+                hit = self.coverage['hit']
+                while executed < n:
+                    index = (pc - base) >> 2
+                    if 0 <= index < count:
+                        hit[index] = 1
+                        pc = handlers[index](reg, mem)
+                        executed += 1
+                    elif pc < 0:
+                        pc = ~pc
+                        if not self._syscall():
+                            break
+                    else:
+                        self.reason = 'end_of_program'
+                        break
+            if pc < 0:
+                # The last instruction of this step was a syscall
+                pc = ~pc
+                self._syscall()
+        except Exception as e:
+            self.reason, self.detail = 'error', str(e)
+            self._write(f"Error executing instruction at {describe_pc(self.source_map, pc)}: {e}")
+        self.pc = pc
+        self.instructions += executed
+        return executed
+
+    def run(self, limits=None):
+        if limits is None:
+            limits = create_limits()
+        start_limits(limits)
+        while self.reason is None:
+            limit_hit = check_limits(limits, self.instructions, self.memory)
+            if limit_hit:
+                self.reason = limit_hit
+                break
+            block = limits['check_interval']
+            if limits['max_instructions'] is not None:
+                block = min(block, limits['max_instructions'] - self.instructions)
+            self.step(block)
+        self._flush_devices()
+        termination = make_termination(self.reason, limits, self.instructions, self.pc, self.memory, self.detail)
+        if self.source_map is not None:
+            termination['source'] = self.source_map.describe(self.pc)
+        return termination
+
+    def event_counters(self):
+        # counters.create_counters() style totals of everything run so far
+        if self.counts is None:
+            raise ValueError("Machine was built without counters")
+        return counters_from_counts(self.words, self.counts, self.taken_counts)
+
+    def _write(self, text):
+        self.output.append(text)
+        if self.echo:
+            print(text)
+
+    def _flush_devices(self):
+        # Console output still buffered in a FIFO goes out before the program's end
+        for device in self.devices:
+            if hasattr(device, 'flush'):
+                device.flush()
+
+    def _syscall(self):
+        running = self._service_syscall()
+        if self.syscall_after is not None:
+            # after_instruction of the syscall word, now that its effects are in
+            self.syscall_after.fire(self.reg, self.memory)
+        return running
+
+    def _read_string(self, address):
+        chars = []
+        if self.packed_strings:
+            memory = self.memory
+            while True:
+                byte = (memory.get(address & ~3, 0) >> (24 - 8 * (address & 3))) & 0xFF
+                if not byte:
+                    break
+                chars.append(chr(byte))
+                address += 1
+        else:
+            while self.memory.get(address, 0) != 0:
+                chars.append(chr(self.memory.get(address)))
+                address += 1
+        return "".join(chars)
+
+    def _service_syscall(self):
+        # Same services as main.syscall_handler
+        reg = self.reg
+        syscall_num = reg[2]
+        if self.syscall_hook is not None:
+            self.syscall_hook(syscall_num, reg, self.memory)
+        if syscall_num == 1:
+            self._write(f"Output (int): {signed(reg[4])}")
+        elif syscall_num == 4:
+            self._write("Output (string):" + self._read_string(reg[4]))
+        elif syscall_num == 9:
+            address = sbrk(self.heap, reg[4])
+            if address is None:
+                self.reason = 'error'
+                self.detail = f"sbrk of {reg[4]} bytes exceeds heap limit of {self.heap['limit']} bytes"
+                self._write(f"Error: {self.detail}")
+                return False
+            reg[2] = address & MASK
+        elif syscall_num == 60:
+            reg[2] = self.hart_id
+        elif syscall_num == 10:
+            self._flush_devices()
+            self._write("Exiting program.")
+            self.reason = 'exit'
+            return False
+        else:
+            self._write(f"Unknown syscall: {syscall_num}")
+        return True
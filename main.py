@@ -1,4 +1,11 @@
 import re
+import sys
+from heap import create_heap, sbrk, display_heap_stats, DEFAULT_HEAP_LIMIT
+from limits import create_limits, start_limits, next_limit_check, check_limits, make_termination, display_termination
+from counters import counted_fetch, finish_counters
+from source_map import build_source_map, describe_pc
+from program import Program, assemble_program, program_from_words
+from decoder import disassemble
 
 # Register mapping
 reg_map = {
@@ -103,6 +110,8 @@ def convert_to_binary(instruction, labels, current_pc):
         "jal":  0b000011,
         "lw":   0b100011,
         "sw":   0b101011,
+        "ll":   0b110000,  # Load linked
+        "sc":   0b111000,  # Store conditional
         "lui":  0b001111,
         "and":  0b000000,
         "or":   0b000000,
@@ -175,7 +184,7 @@ def convert_to_binary(instruction, labels, current_pc):
             imm = int(parts[3], 0) & 0xFFFF
             binary_inst = (opcodes[op] << 26) | (rs_num << 21) | (rt_num << 16) | imm
             return binary_inst
-        elif op in ["lw", "sw"]:
+        elif op in ["lw", "sw", "ll", "sc"]:
             rt_num = get_register_number(parts[1])
             if len(parts) == 4:
                 # Format: lw $rt, offset($rs)
@@ -290,7 +299,8 @@ def generate_control_signals(op_code, funct_code=0):
             signals['Jump'] = 1
         elif op_name == 'syscall':
             signals['Syscall'] = 1
-    elif op_code in [0b001000, 0b001100, 0b001101, 0b000100, 0b000101, 0b100011, 0b101011, 0b001111]:
+    elif op_code in [0b001000, 0b001100, 0b001101, 0b000100, 0b000101, 0b100011, 0b101011, 0b001111,
+                     0b110000, 0b111000]:
         # I-type instructions
         if op_code in [0b001000, 0b001100, 0b001101]:  # addi, andi, ori
             signals['ALUSrc'] = 1
@@ -298,7 +308,7 @@ def generate_control_signals(op_code, funct_code=0):
             signals['ALUOp'] = '00'
             if op_code == 0b001111:  # lui
                 signals['ALUOp'] = '11'
-        elif op_code == 0b100011:  # lw
+        elif op_code in [0b100011, 0b110000]:  # lw, ll
             signals['ALUSrc'] = 1
             signals['MemtoReg'] = 1
             signals['RegWrite'] = 1
@@ -308,6 +318,11 @@ def generate_control_signals(op_code, funct_code=0):
             signals['ALUSrc'] = 1
             signals['MemWrite'] = 1
             signals['ALUOp'] = '00'
+        elif op_code == 0b111000:  # sc writes its success flag back to rt
+            signals['ALUSrc'] = 1
+            signals['MemWrite'] = 1
+            signals['RegWrite'] = 1
+            signals['ALUOp'] = '00'
         elif op_code in [0b000100, 0b000101]:  # beq, bne
             signals['Branch'] = 1
             signals['ALUOp'] = '01'
@@ -343,7 +358,7 @@ def display_memory(memory):
         print(f"Address {addr:08x}: {display_value}")
     print()
 
-def syscall_handler(reg, memory):
+def syscall_handler(reg, memory, heap):
     syscall_num = reg['v0']
     if syscall_num == 1:
         # Print integer in $a0
@@ -356,6 +371,13 @@ def syscall_handler(reg, memory):
             print(chr(memory[string_address]), end="")
             string_address += 1
         print()
+    elif syscall_num == 9:
+        # sbrk: allocate $a0 bytes on the heap, address returned in $v0
+        address = sbrk(heap, reg['a0'])
+        if address is None:
+            print(f"Error: sbrk of {reg['a0']} bytes exceeds heap limit of {heap['limit']} bytes")
+            return False
+        reg['v0'] = address
     elif syscall_num == 10:
         # Exit program
         print("Exiting program.")
@@ -364,85 +386,101 @@ def syscall_handler(reg, memory):
         print(f"Unknown syscall: {syscall_num}")
     return True
 
-def Run_simulation(parsed_instructions, labels, memory):
+# Operation names as Run_simulation decodes them; unlike decoder.py funct
+# 0b011100 is also mul
+opcode_map = {
+    0b001000: "addi",
+    0b001100: "andi",
+    0b001101: "ori",
+    0b000100: "beq",
+    0b000101: "bne",
+    0b000010: "j",
+    0b000011: "jal",
+    0b100011: "lw",
+    0b101011: "sw",
+    0b001111: "lui",
+    0b110000: "ll",
+    0b111000: "sc",
+    0b011100: "mul",  # SPECIAL opcode for mul
+}
+
+funct_map = {
+    0b100000: "add",
+    0b100010: "sub",
+    0b100100: "and",
+    0b100101: "or",
+    0b101010: "slt",
+    0b011100: "mul",
+    0b000000: "sll",
+    0b000010: "srl",
+    0b001000: "jr",
+    0b100110: "xor",
+    0b100111: "nor",
+    0b001100: "syscall"
+}
+
+def operation_name(word):
+    op_code = (word >> 26) & 0b111111
+    if op_code == 0:
+        return funct_map.get(word & 0b111111, "unknown")
+    return opcode_map.get(op_code, "unknown")
+
+def assemble(parsed_instructions, labels, memory):
+    return assemble_program(parsed_instructions, labels, memory, convert_to_binary)
+
+def Run_simulation(parsed_instructions, labels, memory, heap_limit=DEFAULT_HEAP_LIMIT, limits=None, sim_mode=None,
+                   source_map=None, counters=None):
     # Initialize registers
     reg = {name: 0 for name in reg_map}
     reg['zero'] = 0  # Ensure $zero is always 0
     reg['sp'] = 0x7FFFFFFC  # Initialize $sp (Stack Pointer)
     
+    heap = create_heap(heap_limit)
+    if limits is None:
+        limits = create_limits()
     pc = 0
-    sim_mode = input("Enter 'n' for single instruction mode, 'a' for automatic mode: ").strip().lower()
+    if sim_mode is None:
+        sim_mode = input("Enter 'n' for single instruction mode, 'a' for automatic mode: ").strip().lower()
     single_step = (sim_mode == 'n')
 
-    # Prepare the instructions in order including expanded instructions for 'li' and 'la'
-    instructions_list = []
-    pc_counter = 0
-    binary_instructions = []
-    for inst in parsed_instructions:
-        bin_inst = convert_to_binary(inst, labels, pc_counter)
-        if bin_inst:
-            if isinstance(bin_inst, list):
-                # For 'li' and 'la' that expand into multiple instructions
-                for bi in bin_inst:
-                    instructions_list.append((inst, bi, pc_counter))
-                    binary_instructions.append(bi)
-                    pc_counter += 4
-            else:
-                instructions_list.append((inst, bin_inst, pc_counter))
-                binary_instructions.append(bin_inst)
-                pc_counter += 4
-        else:
-            print(f"Invalid instruction at PC {pc_counter}: {inst}")
-            binary_instructions.append(0)  # Placeholder for invalid instruction
-            pc_counter += 4
-
-    total_instructions = len(binary_instructions)
+    # Assemble once, li/la expanded; a caller may pass an already assembled Program
+    if isinstance(parsed_instructions, Program):
+        program = parsed_instructions
+    else:
+        program = assemble(parsed_instructions, labels, memory)
+    for instruction in program.instructions:
+        if instruction.word is None:
+            print(f"Invalid instruction at PC {instruction.pc}: {instruction.text}")
+    instructions = program.instructions
+    words = program.words()  # Invalid instructions run as a 0 word
+    op_names = [operation_name(word) for word in words]
+    symbols = {address: name for name, address in program.labels.items()}  # Branch targets in disassembly
+
+    total_instructions = len(instructions)
+    executed = 0
+    reason = 'end_of_program'
+    detail = None
+    reservation = None  # (address, value) of the last ll, as in memory.PagedMemory
+    next_check = start_limits(limits)
+    # Counting or not is settled here, not tested per instruction
+    fetch = instructions.__getitem__
+    if counters is not None:
+        fetch = counted_fetch(fetch, counters, lambda instruction: op_names[instruction.pc >> 2])
 
     with open("binary_code.txt", "w") as bin_file:
         while pc < total_instructions * 4:
+            if executed >= next_check:
+                limit_hit = check_limits(limits, executed, memory)
+                if limit_hit:
+                    reason = limit_hit
+                    break
+                next_check = next_limit_check(limits, executed)
+            executed += 1
             current_index = pc // 4
-            current_instruction = binary_instructions[current_index]
-
-            # Extract opcode
+            instruction = fetch(current_index)
+            current_instruction = words[current_index]
             op_code = (current_instruction >> 26) & 0b111111
-
-            # Determine the operation name based on opcode
-            opcode_map = {
-                0b001000: "addi",
-                0b001100: "andi",
-                0b001101: "ori",
-                0b000100: "beq",
-                0b000101: "bne",
-                0b000010: "j",
-                0b000011: "jal",
-                0b100011: "lw",
-                0b101011: "sw",
-                0b001111: "lui",
-                0b011100: "mul",  # SPECIAL opcode for mul
-                0b000000: "R-type",  # To be determined by funct
-            }
-
-            if op_code in opcode_map:
-                op_name = opcode_map[op_code]
-                if op_name == "R-type":
-                    funct = current_instruction & 0b111111
-                    funct_map = {
-                        0b100000: "add",
-                        0b100010: "sub",
-                        0b100100: "and",
-                        0b100101: "or",
-                        0b101010: "slt",
-                        0b011100: "mul",
-                        0b000000: "sll",
-                        0b000010: "srl",  # Differentiated by opcode
-                        0b001000: "jr",
-                        0b100110: "xor",
-                        0b100111: "nor",
-                        0b001100: "syscall"
-                    }
-                    op_name = funct_map.get(funct, "unknown")
-            else:
-                op_name = "unknown"
+            op_name = op_names[current_index]
 
             # Generate control signals
             try:
@@ -450,23 +488,23 @@ def Run_simulation(parsed_instructions, labels, memory):
                     raise ValueError(f"Unknown operation with opcode {op_code:06b}")
                 control_signals = generate_control_signals(op_code, funct_code=(current_instruction & 0b111111))
             except ValueError as e:
-                print(f"Error: {e}")
+                print(f"Error at {describe_pc(source_map, pc)}: {e}")
+                reason, detail = 'error', str(e)
                 break
 
-            # Decode fields based on instruction type
-            rs = (current_instruction >> 21) & 0b11111
-            rt = (current_instruction >> 16) & 0b11111
-            rd = (current_instruction >> 11) & 0b11111
-            shamt = (current_instruction >> 6) & 0b11111
-            funct = current_instruction & 0b111111
-            immediate = current_instruction & 0xFFFF
-            address = current_instruction & 0x3FFFFFF
+            # Fields were decoded once, at assembly
+            rs, rt, rd, shamt = instruction.rs, instruction.rt, instruction.rd, instruction.shamt
+            immediate = instruction.imm
+            address = instruction.address
 
             if single_step:
                 print("\n" + "=" * 80)
                 print("Executing Instruction:")
                 print(f"PC: {pc:08x}")
+                if source_map is not None:
+                    print(f"Source: {source_map.describe(pc)}")
                 print(f"Instruction: {current_instruction:032b} ({op_name})")
+                print(f"Disassembly: {disassemble(current_instruction, pc, symbols)}")
                 print("Control Signals:", control_signals)
 
             # Write machine code to file
@@ -476,7 +514,8 @@ def Run_simulation(parsed_instructions, labels, memory):
             try:
                 # Handle syscall separately
                 if op_name == 'syscall':
-                    if not syscall_handler(reg, memory):
+                    if not syscall_handler(reg, memory, heap):
+                        reason = 'exit'
                         break
                 elif control_signals['Jump']:
                     if op_name == 'j' or op_name == 'jal':
@@ -492,8 +531,7 @@ def Run_simulation(parsed_instructions, labels, memory):
                 elif control_signals['Branch']:
                     rs_name = get_register_name(rs)
                     rt_name = get_register_name(rt)
-                    # Sign-extend immediate
-                    imm = immediate if (immediate & 0x8000) == 0 else immediate - 0x10000
+                    imm = instruction.simm  # Sign-extended
                     if op_name == 'beq' and reg[rs_name] == reg[rt_name]:
                         pc += (imm << 2)
                         continue
@@ -505,7 +543,7 @@ def Run_simulation(parsed_instructions, labels, memory):
                     if control_signals['ALUSrc']:
                         if op_name in ['addi', 'andi', 'ori']:
                             rs_val = reg[get_register_name(rs)]
-                            imm = immediate if (immediate & 0x8000) == 0 else immediate - 0x10000
+                            imm = instruction.simm
                             if op_name == 'addi':
                                 result = rs_val + imm
                             elif op_name == 'andi':
@@ -522,7 +560,7 @@ def Run_simulation(parsed_instructions, labels, memory):
                                 reg[reg_name] = (imm << 16) & 0xFFFFFFFF
                         elif op_name == 'lw':
                             base = reg[get_register_name(rs)]
-                            imm = immediate if (immediate & 0x8000) == 0 else immediate - 0x10000
+                            imm = instruction.simm
                             address_calc = base + imm
                             data = memory.get(address_calc, 0)
                             reg_name = get_register_name(rt)
@@ -530,9 +568,26 @@ def Run_simulation(parsed_instructions, labels, memory):
                                 reg[reg_name] = data
                         elif op_name == 'sw':
                             base = reg[get_register_name(rs)]
-                            imm = immediate if (immediate & 0x8000) == 0 else immediate - 0x10000
+                            imm = instruction.simm
                             address_calc = base + imm
                             memory[address_calc] = reg[get_register_name(rt)]
+                        elif op_name == 'll':
+                            address_calc = reg[get_register_name(rs)] + instruction.simm
+                            data = memory.get(address_calc, 0)
+                            reservation = (address_calc, data)
+                            reg_name = get_register_name(rt)
+                            if control_signals['RegWrite']:
+                                reg[reg_name] = data
+                        elif op_name == 'sc':
+                            # Succeeds if the reserved word still holds the value ll saw
+                            address_calc = reg[get_register_name(rs)] + instruction.simm
+                            stored = reservation is not None and reservation == (address_calc, memory.get(address_calc, 0))
+                            reservation = None
+                            if stored:
+                                memory[address_calc] = reg[get_register_name(rt)]
+                            reg_name = get_register_name(rt)
+                            if control_signals['RegWrite']:
+                                reg[reg_name] = 1 if stored else 0
                     else:
                         # R-type operations
                         rs_val = reg[get_register_name(rs)]
@@ -563,7 +618,8 @@ def Run_simulation(parsed_instructions, labels, memory):
                         if control_signals['RegWrite']:
                             reg[rd_name] = result
             except Exception as e:
-                print(f"Error executing instruction at PC {pc}: {e}")
+                print(f"Error executing instruction at {describe_pc(source_map, pc)}: {e}")
+                reason, detail = 'error', str(e)
                 break
 
             if single_step:
@@ -575,33 +631,54 @@ def Run_simulation(parsed_instructions, labels, memory):
 
             pc += 4
 
+    if heap['allocations'] or heap['failures']:
+        display_heap_stats(heap)
+
+    if counters is not None:
+        finish_counters(counters, pc)
+    termination = make_termination(reason, limits, executed, pc, memory, detail)
+    if source_map is not None:
+        termination['source'] = source_map.describe(pc)
+    display_termination(termination)
+    return termination
+
+def run_image(file_path, fmt=None):
+    # Run pre-assembled machine code (see image_loader.py) without any source
+    from image_loader import load_image
+    image = load_image(file_path, fmt)
+    if image['text_base'] != 0:
+        print(f"Error: Run_simulation runs text from address 0, this image starts at {image['text_base']:08x}")
+        return None
+    program = program_from_words(image['words'], image['memory'], image['symbols'])
+    print(f"Disassembly of {file_path} ({image['format']}):")
+    for instruction in program.instructions:
+        print(f"{instruction.pc:08x}: {instruction.word:08x}  {instruction.text}")
+    return Run_simulation(program, program.labels, dict(program.memory))
+
 def main():
     file_path = "program.asm"  # Ensure this file exists with your assembly code
+    if '--image' in sys.argv:
+        # main.py --image binary_code.txt: run machine code instead of program.asm
+        run_image(sys.argv[sys.argv.index('--image') + 1])
+        return
+    if '--profile-host' in sys.argv:
+        # Time this engine's own phases instead of running interactively
+        from host_profile import profile_main
+        profile_main(file_path)
+        return
     instructions = read_asm_file(file_path)
 
     parsed_instructions, labels, memory = parse_labels_and_instructions(instructions)
 
     print("Assembly to Machine Code Conversion:")
-    pc_counter = 0
-    binary_instructions = []
-    for inst in parsed_instructions:
-        bin_inst = convert_to_binary(inst, labels, pc_counter)
-        if bin_inst:
-            if isinstance(bin_inst, list):
-                for bi in bin_inst:
-                    print(f"{inst} -> {bi:032b}")
-                    binary_instructions.append(bi)
-                    pc_counter += 4
-            else:
-                print(f"{inst} -> {bin_inst:032b}")
-                binary_instructions.append(bin_inst)
-                pc_counter += 4
+    program = assemble(parsed_instructions, labels, memory)
+    for instruction in program.instructions:
+        if instruction.word is None:
+            print(f"{instruction.text} -> Invalid instruction")
         else:
-            print(f"{inst} -> Invalid instruction")
-            binary_instructions.append(0)  # Placeholder for invalid instruction
-            pc_counter += 4
+            print(f"{instruction.text} -> {instruction.word:032b}")
 
-    Run_simulation(parsed_instructions, labels, memory)
+    Run_simulation(program, labels, memory, source_map=build_source_map(file_path))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,200 @@
+import json
+import os
+import sys
+from array import array
+
+import numpy as np
+
+from decoder import MASK, decode
+
+# Columnar memory-access trace. Records are staged in flat typed arrays and
+# written out as one .npz chunk (pc, address, value, kind columns) every
+# chunk_size records, so a long run never holds more than one chunk in RAM.
+# A <prefix>.json manifest lists the chunks for offline analysis.
+FETCH = 0
+LOAD = 1
+STORE = 2
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+class TraceWriter:
+    def __init__(self, prefix, chunk_size=DEFAULT_CHUNK_SIZE, record_fetch=False):
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.record_fetch = record_fetch
+        self.chunks = []
+        self.records = 0
+        self._clear()
+
+    def _clear(self):
+        self.pc = array('I')
+        self.address = array('I')
+        self.value = array('I')
+        self.kind = array('B')
+
+    def record(self, pc, address, value, kind):
+        self.pc.append(pc)
+        self.address.append(address)
+        self.value.append(value & MASK)
+        self.kind.append(kind)
+        if len(self.kind) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.kind:
+            return
+        path = f"{self.prefix}.{len(self.chunks):05d}.npz"
+        # frombuffer shares the staging memory, so no extra copy is made
+        np.savez(path,
+                 pc=np.frombuffer(self.pc, dtype=np.uint32),
+                 address=np.frombuffer(self.address, dtype=np.uint32),
+                 value=np.frombuffer(self.value, dtype=np.uint32),
+                 kind=np.frombuffer(self.kind, dtype=np.uint8))
+        self.chunks.append(os.path.basename(path))
+        self.records += len(self.kind)
+        self._clear()
+
+    def close(self):
+        self.flush()
+        with open(f"{self.prefix}.json", 'w') as file:
+            json.dump({'chunks': self.chunks, 'records': self.records,
+                       'record_fetch': self.record_fetch}, file)
+
+    def instrument(self, handlers, words, text_base):
+        # Wrap lw/ll, sw/sc (and every instruction when fetches are recorded)
+        instrumented = []
+        for index, (handler, word) in enumerate(zip(handlers, words)):
+            pc = text_base + 4 * index
+            f = decode(word)
+            if f['op'] in ('lw', 'll'):
+                handler = self._load_recorder(handler, pc, f['rs'], f['rt'], f['simm'])
+            elif f['op'] == 'sw':
+                handler = self._store_recorder(handler, pc, f['rs'], f['rt'], f['simm'])
+            elif f['op'] == 'sc':
+                handler = self._store_conditional_recorder(handler, pc, f['rs'], f['rt'], f['simm'])
+            if self.record_fetch:
+                handler = self._fetch_recorder(handler, pc, word)
+            instrumented.append(handler)
+        return instrumented
+
+    def _load_recorder(self, handler, pc, rs, rt, simm):
+        # Records what the load put in rt; memory is not read a second time,
+        # which on a device page would be a second device access
+        record = self.record
+        def recorder(reg, mem):
+            address = (reg[rs] + simm) & MASK
+            next_pc = handler(reg, mem)
+            record(pc, address, reg[rt], LOAD)
+            return next_pc
+        return recorder
+
+    def _store_recorder(self, handler, pc, rs, rt, simm):
+        record = self.record
+        def recorder(reg, mem):
+            record(pc, (reg[rs] + simm) & MASK, reg[rt], STORE)
+            return handler(reg, mem)
+        return recorder
+
+    def _store_conditional_recorder(self, handler, pc, rs, rt, simm):
+        # Only a successful sc stores; it leaves 1 in rt (a $zero rt cannot
+        # tell, so that store is recorded either way)
+        record = self.record
+        def recorder(reg, mem):
+            address, value = (reg[rs] + simm) & MASK, reg[rt]
+            next_pc = handler(reg, mem)
+            if not rt or reg[rt]:
+                record(pc, address, value, STORE)
+            return next_pc
+        return recorder
+
+    def _fetch_recorder(self, handler, pc, word):
+        record = self.record
+        def recorder(reg, mem):
+            record(pc, pc, word, FETCH)
+            return handler(reg, mem)
+        return recorder
+
+def trace_chunks(prefix):
+    # Yields one {'pc', 'address', 'value', 'kind'} dict of arrays per chunk
+    with open(f"{prefix}.json", 'r') as file:
+        manifest = json.load(file)
+    directory = os.path.dirname(prefix)
+    for name in manifest['chunks']:
+        with np.load(os.path.join(directory, name)) as chunk:
+            yield {key: chunk[key] for key in ('pc', 'address', 'value', 'kind')}
+
+def load_trace(prefix):
+    # Whole trace in memory; only for traces that comfortably fit
+    chunks = list(trace_chunks(prefix))
+    if not chunks:
+        return {key: np.zeros(0, dtype=np.uint32) for key in ('pc', 'address', 'value', 'kind')}
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+def page_heat_map(prefix, page_shift=12):
+    # {page number: accesses} over loads and stores
+    counts = {}
+    for chunk in trace_chunks(prefix):
+        data = chunk['kind'] != FETCH
+        pages, hits = np.unique(chunk['address'][data] >> page_shift, return_counts=True)
+        for page, hit in zip(pages.tolist(), hits.tolist()):
+            counts[page] = counts.get(page, 0) + hit
+    return counts
+
+def strides_by_pc(prefix, kinds=(LOAD, STORE)):
+    # Most common address stride of each load/store PC, as {pc: (stride, share)}
+    stride_counts = {}
+    last_address = {}
+    for chunk in trace_chunks(prefix):
+        data = np.isin(chunk['kind'], kinds)
+        order = np.argsort(chunk['pc'][data], kind='stable')
+        pcs = chunk['pc'][data][order]
+        addresses = chunk['address'][data][order].astype(np.int64)
+        unique, starts = np.unique(pcs, return_index=True)
+        ends = np.append(starts[1:], len(pcs))
+        for pc, start, end in zip(unique.tolist(), starts.tolist(), ends.tolist()):
+            segment = addresses[start:end]
+            if pc in last_address:
+                segment = np.concatenate(([last_address[pc]], segment))
+            last_address[pc] = int(addresses[end - 1])
+            strides, counts = np.unique(np.diff(segment), return_counts=True)
+            table = stride_counts.setdefault(pc, {})
+            for stride, count in zip(strides.tolist(), counts.tolist()):
+                table[stride] = table.get(stride, 0) + count
+    result = {}
+    for pc, table in stride_counts.items():
+        if table:
+            stride = max(table, key=table.get)
+            result[pc] = (stride, table[stride] / sum(table.values()))
+    return result
+
+def working_set_curve(prefix, window=10000, line_shift=2):
+    # Distinct data addresses (at 2**line_shift granularity) in each window of accesses
+    sizes = []
+    pending = np.zeros(0, dtype=np.uint32)
+    for chunk in trace_chunks(prefix):
+        lines = np.concatenate((pending, chunk['address'][chunk['kind'] != FETCH] >> line_shift))
+        full = len(lines) - len(lines) % window
+        for start in range(0, full, window):
+            sizes.append(len(np.unique(lines[start:start + window])))
+        pending = lines[full:]
+    if len(pending):
+        sizes.append(len(np.unique(pending)))
+    return np.array(sizes)
+
+def main():
+    # mem_trace.py program <prefix> [--fetch]; the program is .asm source, ELF or a machine code image
+    from machine import Machine
+    file_path, prefix = sys.argv[1], sys.argv[2]
+    writer = TraceWriter(prefix, record_fetch='--fetch' in sys.argv)
+    machine = Machine.load(file_path, trace=writer)
+    machine.run()
+    writer.close()
+    print(f"Trace: {writer.records} records in {len(writer.chunks)} chunks")
+    print("Page heat map:")
+    for page, hits in sorted(page_heat_map(prefix).items()):
+        print(f"Page {page << 12:08x}: {hits}")
+    print("Strides:")
+    for pc, (stride, share) in sorted(strides_by_pc(prefix).items()):
+        print(f"{machine.source_map.describe(pc)}: stride {stride} ({100.0 * share:.1f}%)")
+
+if __name__ == "__main__":
+    main()
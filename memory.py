@@ -0,0 +1,179 @@
+from devices import DevicePage
+
+# Paged guest memory with copy-on-write sharing between forks.
+# It behaves like the plain {address: value} dicts the engines use, so
+# syscall handlers, display_memory and the limits code work unchanged.
+PAGE_SHIFT = 12
+PAGE_SIZE = 1 << PAGE_SHIFT
+
+def decode_segment(page, page_number, start, contents):
+    # Add the aligned words of contents (placed at start) that fall in the
+    # page; bytes of a word outside the segment count as zero, so segments
+    # sharing a word are combined
+    page_start = page_number << PAGE_SHIFT
+    low = max(page_start, start)
+    high = min(page_start + PAGE_SIZE, start + len(contents))
+    for address in range(low & ~3, high, 4):
+        offset = address - start
+        chunk = bytes(contents[max(offset, 0):offset + 4])
+        if offset < 0:
+            chunk = bytes(-offset) + chunk
+        value = int.from_bytes(chunk.ljust(4, b'\0'), 'big')
+        if value:
+            page[address] = page.get(address, 0) | value
+
+class PagedMemory:
+    def __init__(self, cells=None):
+        self.pages = {}     # Page number -> {address: value}
+        self.owned = set()  # Pages this memory may modify in place
+        self.backing = {}   # Page number -> [(segment start, bytes), ...] not decoded yet
+        self.reservation = None  # (address, value) of the last ll
+        self.devices = {}   # Page number -> DevicePage, see map_device
+        if cells:
+            for address, value in cells.items():
+                self[address] = value
+
+    def get(self, address, default=0):
+        page = self.pages.get(address >> PAGE_SHIFT)
+        if page is None:
+            if not self.backing:
+                return default
+            page = self._fault(address >> PAGE_SHIFT)
+            if page is None:
+                return default
+        return page.get(address, default)
+
+    def __getitem__(self, address):
+        page = self.pages.get(address >> PAGE_SHIFT)
+        if page is None:
+            page = self._fault(address >> PAGE_SHIFT)
+            if page is None:
+                raise KeyError(address)
+        return page[address]
+
+    def __setitem__(self, address, value):
+        page_number = address >> PAGE_SHIFT
+        if page_number in self.owned:
+            self.pages[page_number][address] = value
+            return
+        # First write to a shared (or missing) page: take a private copy
+        page = self.pages.get(page_number)
+        if page is None and self._fault(page_number) is not None:
+            self.pages[page_number][address] = value  # Freshly decoded pages are private
+            return
+        page = dict(page) if page is not None else {}
+        page[address] = value
+        self.pages[page_number] = page
+        self.owned.add(page_number)
+
+    def __contains__(self, address):
+        page = self.pages.get(address >> PAGE_SHIFT)
+        if page is None:
+            page = self._fault(address >> PAGE_SHIFT)
+        return page is not None and address in page
+
+    def map_segment(self, start, contents, size):
+        # Attach file-backed bytes (e.g. a memoryview of an mmap) at start;
+        # bytes past len(contents) up to size read as zero. Segments that
+        # share a page are all kept, and merged when the page is decoded
+        first = start >> PAGE_SHIFT
+        last = (start + max(size, 1) - 1) >> PAGE_SHIFT
+        for page_number in range(first, last + 1):
+            page = self.pages.get(page_number)
+            if page is not None and page_number not in self.devices:
+                # Already decoded (or written): add the new bytes to a private copy
+                page = dict(page)
+                decode_segment(page, page_number, start, contents)
+                self.pages[page_number] = page
+                self.owned.add(page_number)
+            else:
+                self.backing.setdefault(page_number, []).append((start, contents))
+
+    def map_device(self, start, size, device):
+        # Route [start, start + size) to device through the page table: the
+        # page entry is a DevicePage instead of a dict, so RAM pages keep the
+        # plain dict lookups and only accesses to device pages take the slow path
+        first = start >> PAGE_SHIFT
+        last = (start + max(size, 1) - 1) >> PAGE_SHIFT
+        for page_number in range(first, last + 1):
+            page = self.devices.get(page_number)
+            if page is None:
+                page = DevicePage()
+                self.devices[page_number] = page
+                self.pages[page_number] = page
+                self.owned.add(page_number)
+                self.backing.pop(page_number, None)
+            page.add(start, start + size, device)
+
+    def replace_devices(self, replacements):
+        # Point the device pages at other devices ({old device: new device});
+        # used by Machine.fork, which clones the devices for the child
+        devices = {}
+        for page_number, page in self.devices.items():
+            twin = DevicePage()
+            for start, end, device in page.ranges:
+                twin.add(start, end, replacements.get(device, device))
+            devices[page_number] = twin
+            self.pages[page_number] = twin
+        self.devices = devices
+
+    def _fault(self, page_number):
+        # Decode one backed page into word cells the first time it is touched
+        backing = self.backing.pop(page_number, None)
+        if backing is None:
+            return None
+        page = {}
+        for start, contents in backing:
+            decode_segment(page, page_number, start, contents)
+        self.pages[page_number] = page
+        self.owned.add(page_number)
+        return page
+
+    def load_linked(self, address):
+        value = self.get(address, 0)
+        self.reservation = (address, value)
+        return value
+
+    def store_conditional(self, address, value):
+        # Succeeds if the reserved word still holds the value ll saw
+        reservation, self.reservation = self.reservation, None
+        if reservation is None or reservation != (address, self.get(address, 0)):
+            return False
+        self[address] = value
+        return True
+
+    def __len__(self):
+        return sum(len(page) for page in self.pages.values())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        for page_number in sorted(self.pages):
+            yield from sorted(self.pages[page_number])
+
+    def items(self):
+        for address in self.keys():
+            yield address, self.get(address)
+
+    def pop(self, address, default=None):
+        if address not in self:
+            return default
+        value = self[address]
+        self[address] = value  # Make the page private before changing it
+        del self.pages[address >> PAGE_SHIFT][address]
+        return value
+
+    def fork(self):
+        # Both sides keep the current pages and copy one on their next write to it
+        child = PagedMemory()
+        child.pages = dict(self.pages)
+        child.backing = dict(self.backing)
+        # Device pages are never copied; both sides keep writing through them
+        child.devices = self.devices
+        child.owned = set(self.devices)
+        self.owned = set(self.devices)
+        return child
+
+    def shared_pages(self, other):
+        return sum(1 for number, page in self.pages.items() if other.pages.get(number) is page)
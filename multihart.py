@@ -0,0 +1,258 @@
+import contextlib
+import multiprocessing
+import queue
+import sys
+import time
+from multiprocessing import shared_memory
+
+from decoder import MASK
+from heap import create_heap, HEAP_BASE
+from limits import create_limits
+from machine import Machine
+from memory import PagedMemory
+from stream_asm import DATA_BASE, assemble_file
+
+# Several harts (hardware threads) running one program over a shared guest
+# memory. The data segment and every hart's heap arena live in one block of
+# 32-bit cells, one cell per guest address like the engines' memory dicts;
+# the stack and anything else outside the block stay private to each hart.
+# Harts tell themselves apart with syscall 60 (hart id in $v0) and
+# synchronise with ll/sc.
+#
+# In parallel mode each hart is a separate OS process and the block is a
+# multiprocessing.shared_memory segment. Round-robin mode runs all harts in
+# this process, a fixed quantum each in hart order, so a run is reproducible.
+HART_HEAP_LIMIT = 0x10000  # Heap arena per hart
+DEFAULT_QUANTUM = 100      # Instructions per hart per round-robin turn
+HART_LIMITS = {'max_instructions': 100_000_000, 'max_seconds': 60}
+POLL_SECONDS = 0.5         # How often run_parallel checks on harts that have not reported
+GRACE_SECONDS = 5          # Past max_seconds before a silent hart process is killed
+
+class SharedGuestMemory:
+    # Dict-like view of the shared block (plus private cells) for one hart.
+    # ll/sc compare the reserved value under a lock shared by all harts, the
+    # usual way to emulate them over plain memory; ordinary stores take no lock.
+    def __init__(self, buffer, base, size, lock, private=None):
+        self.cells = memoryview(buffer).cast('I')[:size]
+        self.base = base
+        self.size = size
+        self.lock = lock
+        self.private = private if private is not None else PagedMemory()
+        self.reservation = None
+
+    def get(self, address, default=0):
+        index = address - self.base
+        if 0 <= index < self.size:
+            return self.cells[index]
+        return self.private.get(address, default)
+
+    def __getitem__(self, address):
+        index = address - self.base
+        if 0 <= index < self.size:
+            return self.cells[index]
+        return self.private[address]
+
+    def __setitem__(self, address, value):
+        index = address - self.base
+        if 0 <= index < self.size:
+            self.cells[index] = value & MASK
+        else:
+            self.private[address] = value
+
+    def __contains__(self, address):
+        index = address - self.base
+        if 0 <= index < self.size:
+            return self.cells[index] != 0
+        return address in self.private
+
+    def keys(self):
+        for index, value in enumerate(self.cells):
+            if value:
+                yield self.base + index
+        yield from self.private.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        for address in self.keys():
+            yield address, self.get(address)
+
+    def __len__(self):
+        return sum(1 for value in self.cells if value) + len(self.private)
+
+    def load_linked(self, address):
+        with self.lock:
+            value = self.get(address, 0)
+        self.reservation = (address, value)
+        return value
+
+    def store_conditional(self, address, value):
+        reservation, self.reservation = self.reservation, None
+        if reservation is None or reservation[0] != address:
+            return False
+        with self.lock:
+            if self.get(address, 0) != reservation[1]:
+                return False
+            self[address] = value
+        return True
+
+    def release(self):
+        # Must happen before the shared segment is closed
+        self.cells.release()
+
+def shared_layout(harts, heap_limit=HART_HEAP_LIMIT):
+    # (base address, cells) covering the data segment and all heap arenas
+    return DATA_BASE, HEAP_BASE + harts * heap_limit - DATA_BASE
+
+def fill_shared(buffer, base, size, memory):
+    # Copy the initial data image into the block
+    cells = memoryview(buffer).cast('I')
+    for address, value in memory.items():
+        if 0 <= address - base < size:
+            cells[address - base] = value & MASK
+    cells.release()
+
+def make_hart(file_path, hart_id, memory, heap_limit):
+    machine = Machine.from_file(file_path, echo=False)
+    machine.hart_id = hart_id
+    for address, value in machine.pristine.items():
+        if not 0 <= address - memory.base < memory.size:
+            memory.private[address] = value
+    machine.memory = memory
+    machine.heap = create_heap(heap_limit, HEAP_BASE + hart_id * heap_limit)
+    return machine
+
+def _hart_process(file_path, hart_id, shm_name, base, size, lock, heap_limit, limits, results):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    memory = SharedGuestMemory(shm.buf, base, size, lock)
+    try:
+        machine = make_hart(file_path, hart_id, memory, heap_limit)
+        termination = machine.run(create_limits(**limits))
+        results.put((hart_id, termination, machine.output))
+    except Exception as e:
+        results.put((hart_id, {'reason': 'error', 'instructions': 0, 'detail': str(e)}, []))
+    finally:
+        memory.release()
+        shm.close()
+
+def collect_results(processes, results, max_seconds, start):
+    # {hart: (termination, output)} for every hart. A hart process that died
+    # without reporting (killed, or crashed outside Python) is an error, and
+    # one still silent GRACE_SECONDS past its time limit is killed, so a lost
+    # result never leaves the caller waiting forever
+    finished = {}
+    deadline = None if max_seconds is None else start + max_seconds + GRACE_SECONDS
+    suspects = set()  # Harts found dead once; a result may still be in the pipe
+    while len(finished) < len(processes):
+        try:
+            hart_id, termination, output = results.get(timeout=POLL_SECONDS)
+            finished[hart_id] = (termination, output)
+            continue
+        except queue.Empty:
+            pass
+        for hart_id, process in enumerate(processes):
+            if hart_id in finished or process.is_alive():
+                continue
+            if hart_id in suspects:
+                detail = f"Hart process exited with code {process.exitcode} without a result"
+                finished[hart_id] = ({'reason': 'error', 'instructions': 0, 'detail': detail}, [])
+            else:
+                suspects.add(hart_id)
+        if deadline is not None and time.perf_counter() > deadline:
+            for hart_id, process in enumerate(processes):
+                if hart_id not in finished:
+                    process.terminate()
+                    detail = f"Hart process did not report within {max_seconds}s and was stopped"
+                    finished[hart_id] = ({'reason': 'time_limit', 'instructions': 0, 'detail': detail}, [])
+    return finished
+
+def run_parallel(file_path, harts, heap_limit=HART_HEAP_LIMIT, limits=HART_LIMITS):
+    # Returns ({hart: (termination, output)}, elapsed seconds)
+    words, labels, data = assemble_file(file_path)
+    base, size = shared_layout(harts, heap_limit)
+    shm = shared_memory.SharedMemory(create=True, size=4 * size)
+    try:
+        fill_shared(shm.buf, base, size, data)
+        lock = multiprocessing.Lock()
+        results = multiprocessing.Queue()
+        start = time.perf_counter()
+        processes = [multiprocessing.Process(target=_hart_process,
+                                             args=(file_path, hart_id, shm.name, base, size, lock,
+                                                   heap_limit, limits, results))
+                     for hart_id in range(harts)]
+        for process in processes:
+            process.start()
+        finished = collect_results(processes, results, limits.get('max_seconds'), start)
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        shm.close()
+        shm.unlink()
+    return finished, elapsed
+
+def run_round_robin(file_path, harts, quantum=DEFAULT_QUANTUM, heap_limit=HART_HEAP_LIMIT,
+                    limits=HART_LIMITS, echo=True):
+    # Deterministic interleaving: each live hart runs quantum instructions in turn
+    words, labels, data = assemble_file(file_path)
+    base, size = shared_layout(harts, heap_limit)
+    buffer = bytearray(4 * size)
+    fill_shared(buffer, base, size, data)
+    lock = contextlib.nullcontext()
+    machines = [make_hart(file_path, hart_id, SharedGuestMemory(buffer, base, size, lock), heap_limit)
+                for hart_id in range(harts)]
+    max_instructions = limits.get('max_instructions')
+    max_seconds = limits.get('max_seconds')
+    start = time.perf_counter()
+    live = list(machines)
+    while live:
+        if max_seconds is not None and time.perf_counter() - start > max_seconds:
+            # One wall clock for all harts, checked once per round
+            for machine in live:
+                machine.reason = 'time_limit'
+            break
+        for machine in live:
+            shown = len(machine.output)
+            machine.step(quantum)
+            if echo:
+                for line in machine.output[shown:]:
+                    print(f"[hart {machine.hart_id}] {line}")
+            if max_instructions is not None and machine.instructions >= max_instructions:
+                machine.reason = 'instruction_limit'
+        live = [machine for machine in live if machine.reason is None]
+    elapsed = time.perf_counter() - start
+    finished = {}
+    for machine in machines:
+        termination = {'reason': machine.reason, 'instructions': machine.instructions,
+                       'pc': machine.pc, 'detail': machine.detail}
+        finished[machine.hart_id] = (termination, machine.output)
+        machine.memory.release()
+    return finished, elapsed
+
+def display_harts(finished, elapsed, show_output=True):
+    total = 0
+    for hart_id in sorted(finished):
+        termination, output = finished[hart_id]
+        if show_output:
+            for line in output:
+                print(f"[hart {hart_id}] {line}")
+        print(f"Hart {hart_id}: {termination['reason']} after {termination['instructions']} instructions")
+        total += termination['instructions']
+    print(f"Total: {total} instructions in {elapsed:.3f}s ({total / max(elapsed, 1e-9):.0f} instructions/s)")
+
+def main():
+    # multihart.py program.asm [harts] [--round-robin [quantum]]
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "program.asm"
+    harts = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 2
+    if '--round-robin' in sys.argv:
+        position = sys.argv.index('--round-robin')
+        quantum = int(sys.argv[position + 1]) if len(sys.argv) > position + 1 else DEFAULT_QUANTUM
+        finished, elapsed = run_round_robin(file_path, harts, quantum)
+        display_harts(finished, elapsed, show_output=False)
+    else:
+        finished, elapsed = run_parallel(file_path, harts)
+        display_harts(finished, elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import sys
+
+from decoder import MASK, decode
+
+# Instrumentation plugins for the Machine. A plugin is any object defining
+# some of these methods; only the ones it defines are hooked in:
+#
+#   before_instruction(pc, reg, mem)
+#   after_instruction(pc, next_pc, reg, mem)
+#   memory_access(pc, kind, address, value)   kind is 'load' or 'store'
+#   branch(pc, taken, target)                  beq/bne only
+#   syscall(number, reg, mem)
+#
+# Hooks are wired in once, when the machine is built, by wrapping the handlers
+# that need them: memory hooks only wrap loads and stores, branch hooks only
+# wrap branches, and a hook nobody registered wraps nothing, so it costs no
+# call at run time. One registered callback is called directly; several are
+# called in registration order.
+#
+# A syscall word's handler only hands ~next_pc back to the machine; the
+# service itself runs afterwards in Machine._syscall. after_instruction for a
+# syscall therefore fires from there, once the service is done (SyscallAfter),
+# so it sees the real next PC and the registers the syscall left behind.
+HOOKS = ['before_instruction', 'after_instruction', 'memory_access', 'branch', 'syscall']
+LOAD_OPS = ('lw', 'll')
+STORE_OPS = ('sw', 'sc')
+
+def registered_hooks(plugins):
+    # {hook name: [bound callbacks]} for the hooks at least one plugin defines
+    hooks = {}
+    for plugin in plugins:
+        for name in HOOKS:
+            callback = getattr(plugin, name, None)
+            if callback is not None:
+                hooks.setdefault(name, []).append(callback)
+    return hooks
+
+def combine_callbacks(callbacks):
+    if len(callbacks) == 1:
+        return callbacks[0]
+    callbacks = tuple(callbacks)
+    def combined(*args):
+        for callback in callbacks:
+            callback(*args)
+    return combined
+
+def instrument_plugins(handlers, words, text_base, hooks, syscall_after=None):
+    # Returns handlers with the registered instruction-level hooks wrapped in;
+    # syscall_after (a SyscallAfter) takes the after hook of syscall words
+    before = combine_callbacks(hooks['before_instruction']) if 'before_instruction' in hooks else None
+    after = combine_callbacks(hooks['after_instruction']) if 'after_instruction' in hooks else None
+    access = combine_callbacks(hooks['memory_access']) if 'memory_access' in hooks else None
+    branch = combine_callbacks(hooks['branch']) if 'branch' in hooks else None
+    instrumented = []
+    for index, (handler, word) in enumerate(zip(handlers, words)):
+        pc = text_base + 4 * index
+        f = decode(word)
+        if access is not None and f['op'] in LOAD_OPS:
+            handler = _load_hook(handler, pc, f['rs'], f['rt'], f['simm'], access)
+        elif access is not None and f['op'] in STORE_OPS:
+            handler = _store_hook(handler, pc, f['rs'], f['rt'], f['simm'], access)
+        elif branch is not None and f['op'] in ('beq', 'bne'):
+            handler = _branch_hook(handler, pc, branch)
+        if f['op'] == 'syscall' and syscall_after is not None:
+            handler = syscall_after.wrap(handler, pc)
+            if before is not None:
+                handler = _before_hook(handler, pc, before)
+        elif before is not None and after is not None:
+            handler = _around_hook(handler, pc, before, after)
+        elif before is not None:
+            handler = _before_hook(handler, pc, before)
+        elif after is not None:
+            handler = _after_hook(handler, pc, after)
+        instrumented.append(handler)
+    return instrumented
+
+def _load_hook(handler, pc, rs, rt, simm, access):
+    # The value is the one the load left in rt: reading memory again would be
+    # a second access, and on a device page that pops a FIFO or similar
+    def hooked(reg, mem):
+        address = (reg[rs] + simm) & MASK
+        next_pc = handler(reg, mem)
+        access(pc, 'load', address, reg[rt])
+        return next_pc
+    return hooked
+
+def _store_hook(handler, pc, rs, rt, simm, access):
+    def hooked(reg, mem):
+        access(pc, 'store', (reg[rs] + simm) & MASK, reg[rt])
+        return handler(reg, mem)
+    return hooked
+
+def _branch_hook(handler, pc, branch):
+    fall_through = pc + 4
+    def hooked(reg, mem):
+        next_pc = handler(reg, mem)
+        branch(pc, next_pc != fall_through, next_pc)
+        return next_pc
+    return hooked
+
+def _before_hook(handler, pc, before):
+    def hooked(reg, mem):
+        before(pc, reg, mem)
+        return handler(reg, mem)
+    return hooked
+
+def _after_hook(handler, pc, after):
+    def hooked(reg, mem):
+        next_pc = handler(reg, mem)
+        after(pc, next_pc, reg, mem)
+        return next_pc
+    return hooked
+
+def _around_hook(handler, pc, before, after):
+    def hooked(reg, mem):
+        before(pc, reg, mem)
+        next_pc = handler(reg, mem)
+        after(pc, next_pc, reg, mem)
+        return next_pc
+    return hooked
+
+class SyscallAfter:
+    # after_instruction for syscall words: the wrapped handler notes its PC and
+    # Machine._syscall calls fire() when the service has run
+    def __init__(self, after):
+        self.after = after
+        self.pc = None
+
+    def wrap(self, handler, pc):
+        def hooked(reg, mem):
+            self.pc = pc
+            return handler(reg, mem)
+        return hooked
+
+    def fire(self, reg, mem):
+        if self.pc is not None:
+            pc, self.pc = self.pc, None
+            self.after(pc, pc + 4, reg, mem)
+
+class EveryHook:
+    # Defines every hook and does nothing in them; see check_transparent
+    def before_instruction(self, pc, reg, mem):
+        pass
+
+    def after_instruction(self, pc, next_pc, reg, mem):
+        pass
+
+    def memory_access(self, pc, kind, address, value):
+        pass
+
+    def branch(self, pc, taken, target):
+        pass
+
+    def syscall(self, number, reg, mem):
+        pass
+
+class StoreWatch:
+    # Example: report every store to the watched addresses
+    def __init__(self, addresses):
+        self.addresses = set(addresses)
+        self.hits = []
+
+    def memory_access(self, pc, kind, address, value):
+        if kind == 'store' and address in self.addresses:
+            self.hits.append((pc, address, value))
+            print(f"Store to {address:08x} = {value} at PC {pc:08x}")
+
+class StackCheck:
+    # Example invariant: $sp stays word aligned and inside the stack region
+    def __init__(self, low=0x7FF00000, high=0x80000000):
+        self.low = low
+        self.high = high
+
+    def after_instruction(self, pc, next_pc, reg, mem):
+        sp = reg[29]
+        if sp & 3 or not self.low <= sp < self.high:
+            raise ValueError(f"Stack pointer {sp:08x} invalid after PC {pc:08x}")
+
+class SyscallLog:
+    def __init__(self):
+        self.calls = {}
+
+    def syscall(self, number, reg, mem):
+        self.calls[number] = self.calls.get(number, 0) + 1
+
+# Reads the console receiver twice: each read pops a byte, so any hook that
+# touched memory again would change what the guest prints
+CHECK_SOURCE = """li $t0, 0xFFFF0000
+lw $a0, 4($t0)
+li $v0, 1
+syscall
+lw $a0, 4($t0)
+li $v0, 1
+syscall
+li $v0, 10
+syscall
+"""
+
+def check_transparent(file_path=None, input_text='AB'):
+    # Runs a program over the standard devices bare, with every hook attached
+    # and under a mem_trace.TraceWriter; returns the three outputs. Neither
+    # plugins nor tracing may change what the guest does, so all should be equal
+    import os
+    import tempfile
+    from devices import standard_devices
+    from machine import Machine
+    from mem_trace import TraceWriter
+    if file_path is None:
+        handle, file_path = tempfile.mkstemp(suffix='.asm')
+        with os.fdopen(handle, 'w') as file:
+            file.write(CHECK_SOURCE)
+        try:
+            return check_transparent(file_path, input_text)
+        finally:
+            os.remove(file_path)
+    outputs = []
+    for plugins in (None, [EveryHook()]):
+        machine = Machine.from_file(file_path, echo=False, plugins=plugins,
+                                    devices=standard_devices(input_text))
+        machine.run()
+        outputs.append(machine.output)
+    with tempfile.TemporaryDirectory() as directory:
+        writer = TraceWriter(os.path.join(directory, 'check'))
+        machine = Machine.from_file(file_path, echo=False, trace=writer, devices=standard_devices(input_text))
+        machine.run()
+        writer.close()
+        outputs.append(machine.output)
+    return tuple(outputs)
+
+def main():
+    # plugins.py program.asm [address...]: run with the example plugins
+    # plugins.py --check [program.asm [console input]]: check hooks and tracing leave a device run unchanged
+    from machine import Machine
+    if len(sys.argv) > 1 and sys.argv[1] == '--check':
+        file_path = sys.argv[2] if len(sys.argv) > 2 else None
+        bare, hooked, traced = check_transparent(file_path, sys.argv[3] if len(sys.argv) > 3 else 'AB')
+        if bare != hooked or bare != traced:
+            print(f"Instrumentation changed the run:\n  bare:   {bare}\n  hooked: {hooked}\n  traced: {traced}")
+            sys.exit(1)
+        print(f"Same output bare, with plugins and traced ({len(bare)} lines)")
+        return
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "program.asm"
+    log = SyscallLog()
+    plugins = [StackCheck(), log]
+    if len(sys.argv) > 2:
+        plugins.append(StoreWatch(int(address, 0) for address in sys.argv[2:]))
+    machine = Machine.from_file(file_path, plugins=plugins)
+    termination = machine.run()
+    print(f"{termination['reason']} after {termination['instructions']} instructions; syscalls: {log.calls}")
+
+if __name__ == "__main__":
+    main()
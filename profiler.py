@@ -0,0 +1,171 @@
+import bisect
+import sys
+
+from decoder import decode
+
+# Guest call-graph profiler. Only control transfers are instrumented: every
+# beq/bne/j/jal/jr handler adds the straight-line run of instructions that
+# ended at it to the function on top of a shadow call stack, so no handler is
+# wrapped per instruction. jal pushes a frame, jr $ra pops back to the frame
+# it returns to. Instructions that write $sp are wrapped as well to record the
+# stack high-water mark. Pass a CallProfiler as Machine(trace=...).
+CONTROL_OPS = ('beq', 'bne', 'j', 'jal', 'jr')
+SP = 29
+RA = 31
+
+class CallProfiler:
+    def __init__(self, entry=0):
+        self.start(entry)
+
+    def start(self, entry):
+        self.segment_start = entry      # PC where the current straight-line run began
+        self.stack = [(entry, None, 0)]  # (function entry, return address, instructions at call)
+        self.total = 0                   # Instructions attributed so far
+        self.exclusive = {}              # Function entry -> instructions
+        self.inclusive = {}
+        self.calls = {}
+        self.active = {entry: 1}         # Frames per function on the stack (for recursion)
+        self.folded = {}                 # Tuple of function entries -> exclusive instructions
+        self.path = (entry,)
+        self.max_depth = 1
+        self.min_sp = None
+
+    def instrument(self, handlers, words, text_base):
+        instrumented = []
+        for index, (handler, word) in enumerate(zip(handlers, words)):
+            pc = text_base + 4 * index
+            f = decode(word)
+            if f['op'] in CONTROL_OPS:
+                handler = self._control(handler, pc, f['op'], f['rs'])
+            elif (f['op'] in ('addi', 'andi', 'ori', 'lui', 'lw') and f['rt'] == SP) or \
+                    (f['op'] in ('add', 'sub', 'and', 'or', 'xor', 'nor', 'mul', 'sll', 'srl') and f['rd'] == SP):
+                handler = self._sp_writer(handler)
+            instrumented.append(handler)
+        return instrumented
+
+    def _attribute(self, end_pc):
+        # Charge the run [segment_start, end_pc) to the function on top
+        count = (end_pc - self.segment_start) >> 2
+        if count <= 0:
+            return
+        self.total += count
+        function = self.stack[-1][0]
+        self.exclusive[function] = self.exclusive.get(function, 0) + count
+        self.folded[self.path] = self.folded.get(self.path, 0) + count
+
+    def _control(self, handler, pc, op, rs):
+        if op == 'jal':
+            def recorder(reg, mem):
+                next_pc = handler(reg, mem)
+                self._attribute(pc + 4)
+                self._call(next_pc, pc + 4)
+                self.segment_start = next_pc
+                return next_pc
+        elif op == 'jr' and rs == RA:
+            def recorder(reg, mem):
+                next_pc = handler(reg, mem)
+                self._attribute(pc + 4)
+                self._return(next_pc)
+                self.segment_start = next_pc
+                return next_pc
+        else:
+            def recorder(reg, mem):
+                next_pc = handler(reg, mem)
+                self._attribute(pc + 4)
+                self.segment_start = next_pc
+                return next_pc
+        return recorder
+
+    def _sp_writer(self, handler):
+        def recorder(reg, mem):
+            next_pc = handler(reg, mem)
+            if self.min_sp is None or reg[SP] < self.min_sp:
+                self.min_sp = reg[SP]
+            return next_pc
+        return recorder
+
+    def _call(self, target, return_address):
+        self.stack.append((target, return_address, self.total))
+        self.calls[target] = self.calls.get(target, 0) + 1
+        self.active[target] = self.active.get(target, 0) + 1
+        self.path = self.path + (target,)
+        if len(self.stack) > self.max_depth:
+            self.max_depth = len(self.stack)
+
+    def _return(self, target):
+        # Pop to the frame whose return address matches; ignore unmatched returns
+        for depth in range(len(self.stack) - 1, 0, -1):
+            if self.stack[depth][1] == target:
+                while len(self.stack) > depth:
+                    self._pop()
+                return
+
+    def _pop(self):
+        function, return_address, start = self.stack.pop()
+        self.active[function] -= 1
+        if not self.active[function]:
+            # Outermost frame of a recursive function: count its time once
+            self.inclusive[function] = self.inclusive.get(function, 0) + self.total - start
+        self.path = self.path[:-1]
+
+    def finish(self, pc):
+        # Charge the last run and close the frames still open
+        self._attribute(pc)
+        self.segment_start = pc
+        while len(self.stack) > 1:
+            self._pop()
+        root = self.stack[0][0]
+        self.inclusive[root] = self.total
+
+def function_names(symbols, text_base, text_end):
+    # (sorted entry addresses, names) of the labels inside the text segment
+    entries = sorted((address, name) for name, address in symbols.items() if text_base <= address < text_end)
+    return [address for address, name in entries], [name for address, name in entries]
+
+def resolve(address, addresses, names):
+    index = bisect.bisect_right(addresses, address) - 1
+    if index < 0:
+        return f"0x{address:08x}"
+    if addresses[index] == address:
+        return names[index]
+    return f"{names[index]}+0x{address - addresses[index]:x}"
+
+def display_profile(profiler, symbols, text_base, text_end, stack_top):
+    addresses, names = function_names(symbols, text_base, text_end)
+    total = max(profiler.total, 1)
+    print(f"{'Function':<24} {'Calls':>8} {'Inclusive':>12} {'%':>6} {'Exclusive':>12} {'%':>6}")
+    functions = set(profiler.exclusive) | set(profiler.inclusive)
+    for function in sorted(functions, key=lambda f: -profiler.inclusive.get(f, 0)):
+        inclusive = profiler.inclusive.get(function, 0)
+        exclusive = profiler.exclusive.get(function, 0)
+        print(f"{resolve(function, addresses, names):<24} {profiler.calls.get(function, 0):>8} "
+              f"{inclusive:>12} {100.0 * inclusive / total:>6.1f} {exclusive:>12} {100.0 * exclusive / total:>6.1f}")
+    print(f"Maximum call depth: {profiler.max_depth}")
+    if profiler.min_sp is not None:
+        print(f"$sp high-water mark: {profiler.min_sp:08x} ({stack_top - profiler.min_sp} bytes of stack)")
+
+def write_folded(profiler, symbols, text_base, text_end, file_path):
+    # One "outer;inner count" line per stack, the input format of flamegraph.pl
+    addresses, names = function_names(symbols, text_base, text_end)
+    with open(file_path, 'w') as file:
+        for path, count in sorted(profiler.folded.items()):
+            file.write(";".join(resolve(function, addresses, names) for function in path) + f" {count}\n")
+
+def main():
+    # profiler.py program.asm [out.folded]
+    from machine import Machine, STACK_POINTER
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "program.asm"
+    profiler = CallProfiler()
+    machine = Machine.from_file(file_path, trace=profiler)
+    profiler.start(machine.entry)
+    termination = machine.run()
+    profiler.finish(machine.pc)
+    text_end = machine.text_base + 4 * len(machine.words)
+    print(f"Profiled {termination['instructions']} instructions ({termination['reason']})")
+    display_profile(profiler, machine.symbols, machine.text_base, text_end, STACK_POINTER)
+    if len(sys.argv) > 2:
+        write_folded(profiler, machine.symbols, machine.text_base, text_end, sys.argv[2])
+        print(f"Folded stacks written to {sys.argv[2]}")
+
+if __name__ == "__main__":
+    main()
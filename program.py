@@ -0,0 +1,97 @@
+from array import array
+import re
+
+from decoder import MASK, decode, disassemble
+
+# Assembled program records. Every text word becomes one Instruction, built
+# once at assembly time: the machine word (always an int, or None when the
+# line did not assemble), its decoded fields (those of the 0 word engines run
+# in its place when it did not), the source text already split into operands,
+# and where it came from. An li/la that expands into several words gives one
+# Instruction per word, sharing the statement; expansion says which word of
+# how many it is. Engines look instructions up by PC through Program.at
+# instead of building their own (inst, mc, pc) tuples and dicts.
+FIELDS = ('op', 'rs', 'rt', 'rd', 'shamt', 'imm', 'simm', 'address')
+
+class Instruction:
+    __slots__ = ('pc', 'text', 'parts', 'word', 'statement', 'expansion', 'expanded') + FIELDS
+
+    def __init__(self, pc, text, parts, word, statement, expansion=0, expanded=1):
+        self.pc = pc
+        self.text = text            # Source statement, e.g. "addi $t0, $t0, 1"
+        self.parts = parts          # Its mnemonic and operands, split once
+        self.word = word            # 32-bit machine word, None if it did not assemble
+        self.statement = statement  # Index of the statement in parsed_instructions
+        self.expansion = expansion  # Which word of the statement's expansion this is
+        self.expanded = expanded    # Words the statement expands into
+        fields = decode(0 if word is None else word)
+        for name in FIELDS:
+            setattr(self, name, fields[name])
+
+    def __repr__(self):
+        word = 'None' if self.word is None else f"{self.word:08x}"
+        return f"Instruction(pc={self.pc:#x}, word={word}, text={self.text!r})"
+
+class Program:
+    __slots__ = ('instructions', 'labels', 'memory')
+
+    def __init__(self, instructions, labels, memory):
+        self.instructions = instructions  # Indexed by PC // 4
+        self.labels = labels
+        self.memory = memory              # Initial data image
+
+    def at(self, pc):
+        # The instruction at pc, or None outside the text segment
+        return self.instructions[pc >> 2] if pc in self else None
+
+    def __contains__(self, pc):
+        return not pc & 3 and 0 <= pc < 4 * len(self.instructions)
+
+    def words(self):
+        # The text segment as array('I'); lines that did not assemble are 0
+        return array('I', (0 if instruction.word is None else instruction.word for instruction in self.instructions))
+
+    def __len__(self):
+        return len(self.instructions)
+
+def split_operands(text):
+    return tuple(p for p in re.split(r'[,\s()]+', text) if p)
+
+def machine_word(encoded):
+    # Encoders return ints or '0101...' strings; both become an int
+    if isinstance(encoded, str):
+        try:
+            return int(encoded, 2) & MASK
+        except ValueError:
+            return None
+    return encoded & MASK
+
+def assemble_program(parsed_instructions, labels, memory, convert):
+    # convert is the engine's convert_to_binary(text, labels, pc); None or an
+    # empty result marks the line invalid, a list is an li/la expansion
+    instructions = []
+    pc = 0
+    for statement, text in enumerate(parsed_instructions):
+        encoded = convert(text, labels, pc)
+        parts = split_operands(text)
+        if encoded is None or encoded == '' or encoded == []:
+            encoded = [None]
+        elif not isinstance(encoded, list):
+            encoded = [encoded]
+        for expansion, word in enumerate(encoded):
+            if word is not None:
+                word = machine_word(word)
+            instructions.append(Instruction(pc, text, parts, word, statement, expansion, len(encoded)))
+            pc += 4
+    return Program(instructions, labels, memory)
+
+def program_from_words(words, memory=None, labels=None):
+    # A Program for machine code without its source (image_loader.py): each
+    # word is its own statement, with its disassembly standing in for the text
+    labels = dict(labels or {})
+    symbols = {address: name for name, address in labels.items()}
+    instructions = []
+    for index, word in enumerate(words):
+        text = disassemble(word, 4 * index, symbols)
+        instructions.append(Instruction(4 * index, text, split_operands(text), word & MASK, index))
+    return Program(instructions, labels, dict(memory or {}))
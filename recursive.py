@@ -1,4 +1,8 @@
 import re
+from heap import create_heap, sbrk, display_heap_stats, DEFAULT_HEAP_LIMIT
+from limits import create_limits, start_limits, next_limit_check, check_limits, make_termination, display_termination
+from counters import counted_fetch, finish_counters
+from program import Program, assemble_program
 
 # Register mapping from names to numbers
 reg_map = {
@@ -275,47 +279,55 @@ def display_memory(memory):
         print(f"Address {addr:08x}: {display_value}")
     print()
 
-def run_simulation(parsed_instructions, labels, memory):
+def assemble(parsed_instructions, labels, memory):
+    return assemble_program(parsed_instructions, labels, memory, convert_to_binary)
+
+def run_simulation(parsed_instructions, labels, memory, heap_limit=DEFAULT_HEAP_LIMIT, limits=None, sim_mode=None,
+                   counters=None):
     reg = {name: 0 for name in reg_map}
     reg['zero'] = 0  # Ensure $zero is always 0
     reg['sp'] = 0x7FFFFFFC  # Initialize $sp (Stack Pointer)
+    heap = create_heap(heap_limit)
+    if limits is None:
+        limits = create_limits()
     pc = 0
-    sim_mode = input("Enter 'n' for single instruction mode, 'a' for automatic mode: ")
+    if sim_mode is None:
+        sim_mode = input("Enter 'n' for single instruction mode, 'a' for automatic mode: ")
     single_step = (sim_mode == 'n')
 
-    # Prepare the instructions in order including expanded instructions for 'li' and 'la'
-    instructions_list = []
-    pc_counter = 0
-    for inst in parsed_instructions:
-        bin_inst = convert_to_binary(inst, labels, pc_counter)
-        if bin_inst:
-            if isinstance(bin_inst, list):
-                # For 'li' and 'la' that expand into multiple instructions
-                for bi in bin_inst:
-                    instructions_list.append((inst, bi, pc_counter))
-                    pc_counter += 4
-            else:
-                instructions_list.append((inst, bin_inst, pc_counter))
-                pc_counter += 4
-        else:
-            instructions_list.append((inst, None, pc_counter))
-            pc_counter += 4
-
-    # Convert the instructions_list to a dictionary for easy PC lookup
-    inD = {pc: (inst, mc) for inst, mc, pc in instructions_list}
+    # Assemble once, li/la expanded; a caller may pass an already assembled Program
+    if isinstance(parsed_instructions, Program):
+        program = parsed_instructions
+    else:
+        program = assemble(parsed_instructions, labels, memory)
+    executed = 0
+    reason = 'end_of_program'
+    detail = None
+    next_check = start_limits(limits)
+    # Counting or not is settled here, not tested per instruction
+    fetch = program.at
+    if counters is not None:
+        fetch = counted_fetch(fetch, counters, lambda instruction: instruction.parts[0])
 
-    while pc in inD:
-        current_instruction, mc = inD[pc]
-        parts = re.split(r'[,\s()]+', current_instruction)
-        parts = [p for p in parts if p]  # Remove empty strings
+    while pc in program:
+        if executed >= next_check:
+            limit_hit = check_limits(limits, executed, memory)
+            if limit_hit:
+                reason = limit_hit
+                break
+            next_check = next_limit_check(limits, executed)
+        executed += 1
+        instruction = fetch(pc)
+        current_instruction = instruction.text
+        parts = instruction.parts  # Split once, at assembly
         op_code = parts[0]
 
         if single_step:
             print("\n" + "=" * 80)
             print("Executing Instruction:")
             print("Assembly Code:", current_instruction)
-            if mc:
-                print("Machine Code:", mc)
+            if instruction.word is not None:
+                print("Machine Code:", f"{instruction.word:032b}")
             else:
                 print("Machine Code: N/A")
             print("PC before execution:", pc)
@@ -454,13 +466,16 @@ def run_simulation(parsed_instructions, labels, memory):
                 shamt = int(parts[3])
                 reg[rd_name] = reg[rt_name] >> shamt
             elif op_code == 'syscall':
-                if not syscall(reg, memory):
+                if not syscall(reg, memory, heap):
+                    reason = 'exit'
                     break  # Exit the simulation
             else:
                 print(f"Unknown operation {op_code}")
+                reason, detail = 'error', f"Unknown operation {op_code}"
                 break
         except Exception as e:
             print(f"Error executing instruction: {current_instruction} -> {e}")
+            reason, detail = 'error', str(e)
             break
 
         if single_step:
@@ -476,7 +491,16 @@ def run_simulation(parsed_instructions, labels, memory):
         # Optionally, comment out display_memory if the memory is large
         # display_memory(memory)
 
-def syscall(reg, memory):
+    if heap['allocations'] or heap['failures']:
+        display_heap_stats(heap)
+
+    if counters is not None:
+        finish_counters(counters, pc)
+    termination = make_termination(reason, limits, executed, pc, memory, detail)
+    display_termination(termination)
+    return termination
+
+def syscall(reg, memory, heap):
     syscall_num = reg['v0']
     if syscall_num == 1:
         # Print integer in $a0
@@ -489,6 +513,13 @@ def syscall(reg, memory):
             print(chr(memory[string_address]), end="")
             string_address += 1
         print()
+    elif syscall_num == 9:
+        # sbrk: allocate $a0 bytes on the heap, address returned in $v0
+        address = sbrk(heap, reg['a0'])
+        if address is None:
+            print(f"Error: sbrk of {reg['a0']} bytes exceeds heap limit of {heap['limit']} bytes")
+            return False
+        reg['v0'] = address
     elif syscall_num == 10:
         # Exit program
         print("Exiting program.")
@@ -504,22 +535,14 @@ def main():
     parsed_instructions, labels, memory = parse_labels_and_instructions(instructions)
 
     print("Assembly to Machine Code Conversion:")
-    pc_counter = 0
-    for inst in parsed_instructions:
-        bin_inst = convert_to_binary(inst, labels, pc_counter)
-        if bin_inst:
-            if isinstance(bin_inst, list):
-                for bi in bin_inst:
-                    print(f"{inst} -> {bi}")
-                    pc_counter += 4
-            else:
-                print(f"{inst} -> {bin_inst}")
-                pc_counter += 4
+    program = assemble(parsed_instructions, labels, memory)
+    for instruction in program.instructions:
+        if instruction.word is None:
+            print(f"{instruction.text} -> Invalid instruction")
         else:
-            print(f"{inst} -> Invalid instruction")
-            pc_counter += 4
+            print(f"{instruction.text} -> {instruction.word:032b}")
 
-    run_simulation(parsed_instructions, labels, memory)
+    run_simulation(program, labels, memory)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,271 @@
+import bisect
+import json
+import struct
+import sys
+import zlib
+
+from decoder import decode
+from limits import create_limits, start_limits, check_limits, make_termination
+
+# Seekable recordings of Machine runs. Recording writes a full state keyframe
+# every interval instructions and, between keyframes, a delta log of what each
+# instruction changed. Seeking loads the nearest keyframe at or before the
+# target and applies deltas up to it; nothing is simulated again.
+#
+# File layout: MAGIC, then chunks of (tag byte, u32 length, payload), then a
+# u64 footer holding the offset of the index chunk, and MAGIC again.
+#   K  keyframe, zlib-compressed JSON: instructions, pc, reg, heap, memory, output
+#   D  delta log following the keyframe before it
+#   I  index, JSON: [[instructions, offset of K chunk], ...] and the final count
+# Delta records, one STEP closing each retired instruction:
+#   STEP     pc after the instruction
+#   REG      register number, new value
+#   MEM      address, new value
+#   OUTPUT   one line of program output (UTF-8)
+#   HEAP     the heap state after an sbrk (JSON)
+#   SYSCALL  number, $a0, $v0 after the call: the syscall input log
+MAGIC = b'MIPSREC1'
+DEFAULT_INTERVAL = 10000
+STEP, REG, MEM, OUTPUT, HEAP, SYSCALL = range(6)
+REG_WRITERS = ('addi', 'andi', 'ori', 'lui', 'lw', 'll', 'sc')  # Write rt
+MEMORY_WRITERS = ('sw', 'sc')
+CONTROL_OPS = ('beq', 'bne', 'j', 'jal', 'jr')
+
+class Recorder:
+    # Pass as Machine(trace=...), then call attach(machine) and run()
+    def __init__(self, file_path, interval=DEFAULT_INTERVAL):
+        self.file_path = file_path
+        self.interval = interval
+        self.deltas = bytearray()
+        self.index = []
+        self.syscall_pc = None  # PC after the syscall being executed
+        self.machine = None
+
+    def instrument(self, handlers, words, text_base):
+        instrumented = []
+        for index, (handler, word) in enumerate(zip(handlers, words)):
+            pc = text_base + 4 * index
+            f = decode(word)
+            if f['op'] == 'syscall':
+                handler = self._syscall_recorder(handler, pc + 4)
+            else:
+                register = None
+                if f['op'] in REG_WRITERS:
+                    register = f['rt']
+                elif f['op'] == 'jal':
+                    register = 31
+                elif f['op'] not in CONTROL_OPS + ('sw', 'unknown'):
+                    register = f['rd']
+                store = (f['rs'], f['simm']) if f['op'] in MEMORY_WRITERS else None
+                handler = self._recorder(handler, pc + 4, register or None, store, f['op'] in CONTROL_OPS)
+            instrumented.append(handler)
+        return instrumented
+
+    def _recorder(self, handler, nxt, register, store, control):
+        deltas = self.deltas
+        step = struct.pack('<BI', STEP, nxt)
+        def recorder(reg, mem):
+            if store is not None:
+                address = (reg[store[0]] + store[1]) & 0xFFFFFFFF
+            next_pc = handler(reg, mem)
+            if store is not None:
+                deltas.extend(struct.pack('<BII', MEM, address, mem.get(address, 0)))
+            if register is not None:
+                deltas.extend(struct.pack('<BBI', REG, register, reg[register]))
+            deltas.extend(struct.pack('<BI', STEP, next_pc) if control else step)
+            return next_pc
+        return recorder
+
+    def _syscall_recorder(self, handler, nxt):
+        # The step is closed by the wrapped Machine._syscall, after its effects
+        def recorder(reg, mem):
+            self.syscall_pc = nxt
+            return handler(reg, mem)
+        return recorder
+
+    def attach(self, machine):
+        if machine.devices:
+            raise ValueError("Cannot record a machine with memory-mapped devices")
+        self.machine = machine
+        syscall, write = machine._syscall, machine._write
+        deltas = self.deltas
+        def recorded_syscall():
+            reg = machine.reg
+            number, argument, before, heap = reg[2], reg[4], reg[2], dict(machine.heap)
+            result = syscall()
+            if reg[2] != before:
+                deltas.extend(struct.pack('<BBI', REG, 2, reg[2]))
+            if machine.heap != heap:
+                record_bytes(deltas, HEAP, json.dumps(machine.heap).encode())
+            deltas.extend(struct.pack('<BIII', SYSCALL, number, argument, reg[2]))
+            deltas.extend(struct.pack('<BI', STEP, self.syscall_pc))
+            return result
+        def recorded_write(text):
+            record_bytes(deltas, OUTPUT, text.encode())
+            write(text)
+        machine._syscall = recorded_syscall
+        machine._write = recorded_write
+
+    def run(self, limits=None):
+        # Run the attached machine to the end, recording; returns the termination
+        machine = self.machine
+        if limits is None:
+            limits = create_limits()
+        start_limits(limits)
+        with open(self.file_path, 'wb') as file:
+            file.write(MAGIC)
+            self._keyframe(file)
+            while machine.reason is None:
+                limit_hit = check_limits(limits, machine.instructions, machine.memory)
+                if limit_hit:
+                    machine.reason = limit_hit
+                    break
+                block = self.interval - machine.instructions % self.interval
+                if limits['max_instructions'] is not None:
+                    block = min(block, limits['max_instructions'] - machine.instructions)
+                machine.step(block)
+                if machine.instructions % self.interval == 0 and machine.reason is None:
+                    self._deltas(file)
+                    self._keyframe(file)
+            self._deltas(file)
+            if self.index[-1][0] != machine.instructions:
+                self._keyframe(file)
+            index_offset = file.tell()
+            write_chunk(file, b'I', json.dumps({'keyframes': self.index, 'instructions': machine.instructions,
+                                               'interval': self.interval}).encode())
+            file.write(struct.pack('<Q', index_offset) + MAGIC)
+        return make_termination(machine.reason, limits, machine.instructions, machine.pc, machine.memory, machine.detail)
+
+    def _keyframe(self, file):
+        machine = self.machine
+        state = {
+            'instructions': machine.instructions,
+            'pc': machine.pc,
+            'reg': machine.reg,
+            'heap': machine.heap,
+            'memory': list(machine.memory.items()),
+            'output': machine.output,
+        }
+        self.index.append([machine.instructions, file.tell()])
+        write_chunk(file, b'K', zlib.compress(json.dumps(state).encode()))
+
+    def _deltas(self, file):
+        if self.deltas:
+            write_chunk(file, b'D', bytes(self.deltas))
+            del self.deltas[:]
+
+def record_bytes(deltas, tag, payload):
+    deltas.extend(struct.pack('<BI', tag, len(payload)))
+    deltas.extend(payload)
+
+def write_chunk(file, tag, payload):
+    file.write(tag + struct.pack('<I', len(payload)))
+    file.write(payload)
+
+def read_chunk(file, offset):
+    file.seek(offset)
+    tag, length = struct.unpack('<cI', file.read(5))
+    return tag, file.read(length)
+
+class Recording:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{file_path} is not a recording")
+            file.seek(-(8 + len(MAGIC)), 2)
+            index_offset, magic = struct.unpack(f'<Q{len(MAGIC)}s', file.read(8 + len(MAGIC)))
+            if magic != MAGIC:
+                raise ValueError(f"{file_path} is truncated (no index)")
+            tag, payload = read_chunk(file, index_offset)
+        index = json.loads(payload)
+        self.keyframes = [instructions for instructions, offset in index['keyframes']]
+        self.offsets = [offset for instructions, offset in index['keyframes']]
+        self.instructions = index['instructions']
+        self.interval = index['interval']
+
+    def seek(self, target):
+        # State after `target` instructions: a dict like the keyframes, with
+        # memory as an {address: value} dict and the syscalls seen since the keyframe
+        if not 0 <= target <= self.instructions:
+            raise ValueError(f"Instruction {target} is outside the recording (0..{self.instructions})")
+        position = bisect.bisect_right(self.keyframes, target) - 1
+        with open(self.file_path, 'rb') as file:
+            tag, payload = read_chunk(file, self.offsets[position])
+            state = json.loads(zlib.decompress(payload))
+            state['memory'] = dict(state['memory'])
+            state['syscalls'] = []
+            if state['instructions'] < target:
+                tag, payload = read_chunk(file, self.offsets[position] + 5 + len(payload))
+                apply_deltas(state, payload, target)
+        return state
+
+def apply_deltas(state, deltas, target):
+    reg, memory, output = state['reg'], state['memory'], state['output']
+    instructions = state['instructions']
+    offset = 0
+    unpack_from = struct.unpack_from
+    while instructions < target:
+        tag = deltas[offset]
+        if tag == STEP:
+            state['pc'], = unpack_from('<I', deltas, offset + 1)
+            instructions += 1
+            offset += 5
+        elif tag == REG:
+            register, value = unpack_from('<BI', deltas, offset + 1)
+            reg[register] = value
+            offset += 6
+        elif tag == MEM:
+            address, value = unpack_from('<II', deltas, offset + 1)
+            memory[address] = value
+            offset += 9
+        elif tag == SYSCALL:
+            state['syscalls'].append((instructions + 1,) + unpack_from('<III', deltas, offset + 1))
+            offset += 13
+        else:
+            length, = unpack_from('<I', deltas, offset + 1)
+            payload = deltas[offset + 5:offset + 5 + length]
+            if tag == OUTPUT:
+                output.append(payload.decode())
+            else:
+                state['heap'] = json.loads(payload)
+            offset += 5 + length
+    state['instructions'] = instructions
+    return state
+
+def display_state(state, addresses=()):
+    from main import get_register_name
+    print(f"Instruction {state['instructions']}, PC {state['pc']:08x}")
+    for num in range(0, 32, 4):
+        print("  ".join(f"${get_register_name(n):<4} {state['reg'][n]:08x}" for n in range(num, num + 4)))
+    for address in addresses:
+        print(f"[{address:08x}] = {state['memory'].get(address, 0):08x}")
+    if state['output']:
+        print(f"Last output: {state['output'][-1]}")
+
+def main():
+    # replay.py record program out.rec [interval]: .asm source, ELF or machine code image
+    # replay.py seek out.rec instruction [address...]
+    # replay.py info out.rec
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'record' and len(sys.argv) > 3:
+        from machine import Machine
+        recorder = Recorder(sys.argv[3], int(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_INTERVAL)
+        machine = Machine.load(sys.argv[2], trace=recorder, echo=False)
+        recorder.attach(machine)
+        termination = recorder.run()
+        print(f"Recorded {termination['instructions']} instructions ({termination['reason']}) "
+              f"with {len(recorder.index)} keyframes to {sys.argv[3]}")
+    elif command == 'seek' and len(sys.argv) > 3:
+        state = Recording(sys.argv[2]).seek(int(sys.argv[3], 0))
+        display_state(state, [int(address, 0) for address in sys.argv[4:]])
+    elif command == 'info' and len(sys.argv) > 2:
+        recording = Recording(sys.argv[2])
+        print(f"{recording.instructions} instructions, {len(recording.keyframes)} keyframes "
+              f"every {recording.interval} instructions")
+    else:
+        print("Usage: replay.py record program out.rec [interval] | seek out.rec instruction [address...] | info out.rec")
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
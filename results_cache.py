@@ -0,0 +1,174 @@
+import ast
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+# On-disk memo of complete run results for deterministic jobs. A result is
+# keyed by everything that decides it:
+#   image    the assembled program (instructions and labels), so edits to
+#            comments or layout of the source do not miss
+#   state    the initial data image plus job options that change the result
+#   engine   a hash of the engine's source and of every module of this
+#            directory it imports, directly or through other modules
+#   limits   the instruction/memory budget the job ran under
+# Entries are one JSON file each; a hit touches the file, and when the store
+# grows past max_bytes the least recently used files are removed first.
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'mips_results_cache')
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+UNCACHEABLE_REASONS = ('time_limit',)  # Depends on the host, not the program
+
+_engine_versions = {}
+
+def digest(value):
+    return hashlib.sha256(value.encode() if isinstance(value, str) else value).hexdigest()
+
+def local_modules(name, directory):
+    # name and every module in directory it imports, followed recursively,
+    # sorted; imports inside functions count too
+    found = set()
+    pending = [name]
+    while pending:
+        module = pending.pop()
+        if module in found:
+            continue
+        found.add(module)
+        with open(os.path.join(directory, module + '.py'), 'rb') as file:
+            tree = ast.parse(file.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+                names = [node.module]
+            else:
+                continue
+            for imported in names:
+                imported = imported.split('.')[0]
+                if os.path.isfile(os.path.join(directory, imported + '.py')):
+                    pending.append(imported)
+    return sorted(found)
+
+def engine_version(engine):
+    # Changes to an engine (or what it imports) must not be served old results
+    if engine not in _engine_versions:
+        here = os.path.dirname(os.path.abspath(__file__))
+        sources = hashlib.sha256()
+        for name in local_modules(engine, here):
+            sources.update(name.encode())
+            with open(os.path.join(here, name + '.py'), 'rb') as file:
+                sources.update(file.read())
+        _engine_versions[engine] = sources.hexdigest()
+    return _engine_versions[engine]
+
+def image_hash(parsed_instructions, labels):
+    return digest(repr((list(parsed_instructions), sorted(labels.items()))))
+
+def state_hash(memory, options=None):
+    return digest(repr((sorted(memory.items()), sorted((options or {}).items()))))
+
+def cache_key(image, state, engine, limits):
+    # limits: the create_limits() arguments; max_seconds only matters through
+    # UNCACHEABLE_REASONS, so it is left out
+    budget = {key: value for key, value in sorted(limits.items()) if key != 'max_seconds'}
+    return digest(json.dumps([image, state, engine_version(engine), engine, budget]))
+
+def cacheable(result):
+    return 'error' not in result and result.get('termination', {}).get('reason') not in UNCACHEABLE_REASONS
+
+class ResultCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+        # Key -> [last use, size], rebuilt from the files so the store survives restarts
+        self.entries = {}
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.json'):
+                info = entry.stat()
+                self.entries[entry.name[:-5]] = [info.st_mtime, info.st_size]
+        self.size = sum(size for used, size in self.entries.values())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        # Returns the stored result, or None
+        if key not in self.entries:
+            self.stats['misses'] += 1
+            return None
+        try:
+            with open(self._path(key), 'r') as file:
+                result = json.load(file)
+        except (OSError, ValueError):
+            # Removed or half-written by another process
+            self._forget(key)
+            self.stats['misses'] += 1
+            return None
+        now = time.time()
+        self.entries[key][0] = now
+        try:
+            os.utime(self._path(key), (now, now))
+        except OSError:
+            pass
+        self.stats['hits'] += 1
+        return result
+
+    def put(self, key, result):
+        data = json.dumps(result).encode()
+        if len(data) > self.max_bytes:
+            return
+        # Write then rename, so readers never see a partial entry
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, self._path(key))
+        if key in self.entries:
+            self.size -= self.entries[key][1]
+        self.entries[key] = [time.time(), len(data)]
+        self.size += len(data)
+        self.stats['stores'] += 1
+        self.evict()
+
+    def evict(self):
+        if self.size <= self.max_bytes:
+            return
+        for key in sorted(self.entries, key=lambda key: self.entries[key][0]):
+            if self.size <= self.max_bytes:
+                break
+            self._forget(key)
+            self.stats['evictions'] += 1
+
+    def _forget(self, key):
+        used, size = self.entries.pop(key, (0, 0))
+        self.size -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for key in list(self.entries):
+            self._forget(key)
+
+    def summary(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return dict(self.stats, entries=len(self.entries), bytes=self.size, max_bytes=self.max_bytes,
+                    hit_rate=self.stats['hits'] / lookups if lookups else 0.0)
+
+def main():
+    # results_cache.py [stats|clear] [directory]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    cache = ResultCache(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_CACHE_DIR)
+    if command == 'clear':
+        count = len(cache.entries)
+        cache.clear()
+        print(f"Removed {count} cached results from {cache.directory}")
+    else:
+        print(f"{cache.directory}: {len(cache.entries)} results, {cache.size / 1024:.1f} KB "
+              f"of {cache.max_bytes / 1024 / 1024:.0f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import argparse
+import asyncio
+import contextlib
+import importlib
+import io
+import json
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from counters import create_counters, merge_counters, counters_openmetrics
+from limits import create_limits, DEFAULT_CHECK_INTERVAL
+from results_cache import ResultCache, DEFAULT_CACHE_DIR, cache_key, cacheable, image_hash, state_hash
+from workers import warm_worker
+
+# Local simulation service. Clients send one JSON object per line and get one
+# JSON object per line back:
+#   {"id": 1, "source": "<assembly text>", "engine": "main", "limits": {...}, "counters": true}
+#   {"type": "stats"}
+#   {"type": "metrics", "format": "json" | "openmetrics"}
+# Jobs are answered with a "queued" event, then a "result" (or "rejected" when
+# the queue is full) as soon as a warm worker process finishes them. Jobs that
+# ask for counters return them and add them to the service-wide totals that
+# "metrics" reports. With a results cache, a job whose program, initial state,
+# engine and limits match an earlier run is answered from the cache without
+# being queued. A job's limits can only tighten DEFAULT_JOB_LIMITS: larger
+# values are clamped to them and a null limit is rejected.
+ENGINES = ['main', 'recursive', 'iterative', 'control_signal']
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'mips_simulator.sock')
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_JOB_LIMITS = {'max_instructions': 10_000_000, 'max_seconds': 10}
+JOB_LIMIT_KEYS = ('max_instructions', 'max_seconds', 'max_memory', 'check_interval')
+
+_assembled = {}  # Per-worker cache of (engine, source) -> assembled program
+MAX_ASSEMBLED = 256
+_image_hashes = {}  # (engine, source) -> (image hash, data image), for cache keys
+MAX_IMAGE_HASHES = 1024
+
+def source_lines(source):
+    # Same cleanup as read_asm_file, for source text received over the wire
+    lines = []
+    for line in source.splitlines():
+        line = re.sub(r'#.*', '', line).strip()
+        if line:
+            lines.append(line)
+    return lines
+
+def job_limits(job):
+    # The job's limits clamped to the service's: a job may only tighten a
+    # limit, never lift or remove it. Raises ValueError for a bad limit
+    limits = dict(DEFAULT_JOB_LIMITS, check_interval=DEFAULT_CHECK_INTERVAL)
+    requested = job.get('limits') or {}
+    if not isinstance(requested, dict):
+        raise ValueError("'limits' must be an object")
+    for key, value in requested.items():
+        if key not in JOB_LIMIT_KEYS:
+            raise ValueError(f"Unknown limit {key}")
+        if value is None and limits.get(key) is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"Limit {key} must be a positive number")
+        limits[key] = value if limits.get(key) is None else min(value, limits[key])
+    return limits
+
+def run_job(job):
+    engine = job.get('engine', 'main')
+    if engine not in ENGINES:
+        return {'error': f"Unknown engine {engine}"}
+    module = importlib.import_module(engine)
+    key = (engine, job['source'])
+    if key not in _assembled:
+        parsed_instructions, labels, memory = module.parse_labels_and_instructions(source_lines(job['source']))
+        if len(_assembled) >= MAX_ASSEMBLED:
+            _assembled.clear()
+        _assembled[key] = module.assemble(parsed_instructions, labels, memory)
+    program = _assembled[key]
+
+    limits = job_limits(job)
+    run = getattr(module, 'Run_simulation', None) or module.run_simulation
+    counters = create_counters() if job.get('counters') else None
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        termination = run(program, program.labels, dict(program.memory),
+                          limits=create_limits(**limits), sim_mode='a', counters=counters)
+    result = {'output': output.getvalue().splitlines(), 'termination': termination}
+    if counters is not None:
+        counters.pop('pending')
+        result['counters'] = counters
+    return result
+
+def job_cache_key(job):
+    # Results cache key of a job, or None when it cannot be cached
+    engine = job.get('engine', 'main')
+    if engine not in ENGINES:
+        return None
+    source_key = (engine, job['source'])
+    if source_key not in _image_hashes:
+        module = importlib.import_module(engine)
+        try:
+            parsed_instructions, labels, memory = module.parse_labels_and_instructions(source_lines(job['source']))
+        except Exception:
+            return None
+        if len(_image_hashes) >= MAX_IMAGE_HASHES:
+            _image_hashes.clear()
+        _image_hashes[source_key] = (image_hash(parsed_instructions, labels), memory)
+    image, memory = _image_hashes[source_key]
+    limits = job_limits(job)
+    return cache_key(image, state_hash(memory, {'counters': bool(job.get('counters'))}), engine, limits)
+
+class SimulationService:
+    def __init__(self, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, cache=None):
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=warm_worker,
+                                        initargs=(ENGINES,))
+        self.stats = {'accepted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'cached': 0}
+        self.counters = create_counters()  # Totals over every job run with counters
+        self.cache = cache  # results_cache.ResultCache, or None
+        # Parsing for cache keys and cache file I/O stay off the event loop; one
+        # thread, so the cache and the image hash memo are never used concurrently
+        self.cache_pool = ThreadPoolExecutor(max_workers=1) if cache is not None else None
+        self.dispatchers = []
+
+    async def start(self):
+        # Start the workers now so the first job does not pay for process startup
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, os.getpid) for _ in range(self.workers)])
+        self.dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.dispatchers:
+            task.cancel()
+        self.pool.shutdown(cancel_futures=True)
+        if self.cache_pool is not None:
+            self.cache_pool.shutdown(cancel_futures=True)
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, writer, done, key = await self.queue.get()
+            try:
+                result = await loop.run_in_executor(self.pool, run_job, job)
+                self.stats['completed'] += 1
+                if key is not None and cacheable(result):
+                    await loop.run_in_executor(self.cache_pool, self.cache.put, key, result)
+                if 'counters' in result:
+                    merge_counters(self.counters, result['counters'])
+            except Exception as e:
+                result = {'error': str(e)}
+                self.stats['failed'] += 1
+            finally:
+                self.queue.task_done()
+            result.update({'id': job.get('id'), 'event': 'result'})
+            try:
+                await self._send(writer, result)
+            finally:
+                done.set_result(None)
+
+    async def _send(self, writer, message):
+        # A client that has gone away must not take a dispatcher down with it
+        if writer.is_closing():
+            return
+        try:
+            writer.write((json.dumps(message) + '\n').encode())
+            await writer.drain()
+        except (ConnectionError, OSError) as e:
+            print(f"Dropped a reply to a disconnected client: {e}")
+
+    async def handle_client(self, reader, writer):
+        pending = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    await self._send(writer, {'event': 'rejected', 'error': f"Bad request: {e}"})
+                    continue
+                done = await self.handle_request(request, writer)
+                if done is not None:
+                    pending.append(done)
+                    pending = [job for job in pending if not job.done()]
+            # Let this client's queued jobs finish before closing
+            await asyncio.gather(*pending)
+        finally:
+            writer.close()
+
+    def cached_result(self, request):
+        # (cache key or None, cached result or None); runs on the cache thread
+        key = job_cache_key(request)
+        return key, self.cache.get(key) if key is not None else None
+
+    async def handle_request(self, request, writer):
+        # Returns a future that completes once a queued job has been answered
+        if request.get('type') == 'stats':
+            stats = dict(self.stats, queued=self.queue.qsize(), workers=self.workers)
+            if self.cache is not None:
+                stats['cache'] = self.cache.summary()
+            await self._send(writer, {'event': 'stats', 'stats': stats})
+            return None
+        if request.get('type') == 'metrics':
+            if request.get('format') == 'openmetrics':
+                await self._send(writer, {'event': 'metrics', 'text': counters_openmetrics(self.counters)})
+            else:
+                counters = {key: value for key, value in self.counters.items() if key != 'pending'}
+                await self._send(writer, {'event': 'metrics', 'counters': counters})
+            return None
+        if 'source' not in request:
+            await self._send(writer, {'id': request.get('id'), 'event': 'rejected', 'error': "Missing 'source'"})
+            return None
+        try:
+            job_limits(request)
+        except ValueError as e:
+            await self._send(writer, {'id': request.get('id'), 'event': 'rejected', 'error': str(e)})
+            return None
+        key = None
+        if self.cache is not None:
+            key, result = await asyncio.get_running_loop().run_in_executor(self.cache_pool, self.cached_result, request)
+            if result is not None:
+                self.stats['cached'] += 1
+                if 'counters' in result:
+                    merge_counters(self.counters, result['counters'])
+                result.update({'id': request.get('id'), 'event': 'result', 'cached': True})
+                await self._send(writer, result)
+                return None
+        done = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((request, writer, done, key))
+        except asyncio.QueueFull:
+            # Backpressure: tell the client to retry instead of buffering without bound
+            self.stats['rejected'] += 1
+            await self._send(writer, {'id': request.get('id'), 'event': 'rejected', 'error': 'busy'})
+            return None
+        self.stats['accepted'] += 1
+        await self._send(writer, {'id': request.get('id'), 'event': 'queued'})
+        return done
+
+async def serve(socket_path=DEFAULT_SOCKET, port=None, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                cache=None):
+    service = SimulationService(workers, queue_size, cache)
+    await service.start()
+    if port is not None:
+        server = await asyncio.start_server(service.handle_client, '127.0.0.1', port)
+        where = f"127.0.0.1:{port}"
+    else:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(service.handle_client, socket_path)
+        where = socket_path
+    print(f"Simulation service listening on {where} with {workers} workers")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+async def submit(file_paths, socket_path=DEFAULT_SOCKET, port=None, engine='main', counters=False):
+    # Minimal client: send every file as a job and print results as they arrive
+    if port is not None:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    else:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+    for job_id, file_path in enumerate(file_paths):
+        with open(file_path, 'r') as file:
+            job = {'id': job_id, 'source': file.read(), 'engine': engine, 'counters': counters}
+        writer.write((json.dumps(job) + '\n').encode())
+    await writer.drain()
+    pending = len(file_paths)
+    while pending:
+        line = await reader.readline()
+        if not line:
+            break
+        message = json.loads(line)
+        if message['event'] == 'queued':
+            continue
+        pending -= 1
+        cached = ", cached" if message.get('cached') else ""
+        print(f"== {file_paths[message['id']]} ({message['event']}{cached})")
+        for output_line in message.get('output', []):
+            print(output_line)
+        if 'error' in message:
+            print(f"Error: {message['error']}")
+        if 'counters' in message:
+            print(f"Counters: {message['counters']['instructions']} instructions, "
+                  f"{message['counters']['loads']} loads, {message['counters']['stores']} stores")
+    writer.close()
+
+async def fetch_metrics(socket_path=DEFAULT_SOCKET, port=None):
+    # Print the service-wide counters in OpenMetrics text form
+    if port is not None:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    else:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+    writer.write((json.dumps({'type': 'metrics', 'format': 'openmetrics'}) + '\n').encode())
+    await writer.drain()
+    message = json.loads(await reader.readline())
+    print(message['text'], end='')
+    writer.close()
+
+async def fetch_stats(socket_path=DEFAULT_SOCKET, port=None):
+    # Print the job statistics, including results cache hits and misses
+    if port is not None:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    else:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+    writer.write((json.dumps({'type': 'stats'}) + '\n').encode())
+    await writer.drain()
+    message = json.loads(await reader.readline())
+    print(json.dumps(message['stats'], indent=2))
+    writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident MIPS simulation service")
+    parser.add_argument('command', choices=['serve', 'submit', 'metrics', 'stats'])
+    parser.add_argument('files', nargs='*', help="Assembly files to submit")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--port', type=int, help="Listen on localhost TCP instead of a Unix socket")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument('--engine', default='main', choices=ENGINES)
+    parser.add_argument('--counters', action='store_true', help="Collect event counters for submitted jobs")
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_DIR, metavar='DIR',
+                        help=f"Serve repeated jobs from a results cache (default {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--cache-size', type=float, default=64, help="Results cache size in MB")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        cache = ResultCache(args.cache, int(args.cache_size * 1024 * 1024)) if args.cache else None
+        try:
+            asyncio.run(serve(args.socket, args.port, args.workers, args.queue_size, cache))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'metrics':
+        asyncio.run(fetch_metrics(args.socket, args.port))
+    elif args.command == 'stats':
+        asyncio.run(fetch_stats(args.socket, args.port))
+    else:
+        if not args.files:
+            parser.error("submit needs at least one assembly file")
+        asyncio.run(submit(args.files, args.socket, args.port, args.engine, args.counters))
+
+if __name__ == "__main__":
+    main()
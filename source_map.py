@@ -0,0 +1,158 @@
+import base64
+import bisect
+import json
+import linecache
+import sys
+from array import array
+
+from decoder import disassemble
+
+# PC -> source map. Consecutive words assembled from the same source line
+# (e.g. la -> lui + ori) share one range, so the map holds two parallel
+# arrays with one entry per source instruction: the first PC of the range and
+# its line number. Lookups are a binary search over the range starts; the
+# source text and column are read back from the file only when asked for.
+class SourceMap:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.starts = array('I')  # First PC of each range, ascending
+        self.lines = array('I')   # Source line of each range
+        self.end = 0              # PC just past the last mapped word
+
+    def add(self, pc, line_number):
+        # Called for every emitted word, in PC order
+        if not (self.lines and self.lines[-1] == line_number and self.end == pc):
+            self.starts.append(pc)
+            self.lines.append(line_number)
+        self.end = pc + 4
+
+    def __len__(self):
+        return len(self.starts)
+
+    def line(self, pc):
+        # Source line number of pc, or None if it is outside the map
+        if pc < 0 or pc >= self.end:
+            return None
+        index = bisect.bisect_right(self.starts, pc) - 1
+        if index < 0:
+            return None
+        return self.lines[index]
+
+    def range(self, pc):
+        # (first PC, PC past the end) of the source instruction containing pc
+        index = bisect.bisect_right(self.starts, pc) - 1
+        if index < 0 or pc >= self.end:
+            return None
+        end = self.starts[index + 1] if index + 1 < len(self.starts) else self.end
+        return self.starts[index], end
+
+    def lookup(self, pc):
+        # (file, line, column, text) of pc, or None; column is 1-based
+        line_number = self.line(pc)
+        if line_number is None:
+            return None
+        raw = linecache.getline(self.file_path, line_number).split('#', 1)[0].rstrip()
+        text = raw.split(':', 1)[1] if ':' in raw else raw
+        text = text.strip()
+        column = raw.find(text) + 1 if text else 1
+        return self.file_path, line_number, column, text
+
+    def describe(self, pc):
+        # "file:line:column: text" for messages, falling back to the raw PC
+        found = self.lookup(pc)
+        if found is None:
+            return f"PC {pc:08x}"
+        file_path, line_number, column, text = found
+        return f"{file_path}:{line_number}:{column}: {text} (PC {pc:08x})"
+
+class DisassemblyMap:
+    # Stand-in for a SourceMap when there is no source (ELF and word images):
+    # each word is its own range and is described by its disassembly
+    def __init__(self, words, text_base=0, symbols=None):
+        self.words = words
+        self.text_base = text_base
+        self.end = text_base + 4 * len(words)
+        self.symbols = {address: name for name, address in (symbols or {}).items()}
+
+    def __len__(self):
+        return len(self.words)
+
+    def line(self, pc):
+        return None
+
+    def range(self, pc):
+        if not self.text_base <= pc < self.end:
+            return None
+        start = pc & ~3
+        return start, start + 4
+
+    def lookup(self, pc):
+        return None
+
+    def describe(self, pc):
+        if not self.text_base <= pc < self.end:
+            return f"PC {pc:08x}"
+        word = self.words[(pc - self.text_base) >> 2]
+        text = disassemble(word, pc & ~3, self.symbols)
+        label = f"{self.symbols[pc]}: " if pc in self.symbols else ""
+        return f"{label}{text} (PC {pc:08x})"
+
+def describe_pc(source_map, pc):
+    # For callers that may not have a map
+    if source_map is None:
+        return f"PC {pc:08x}"
+    return source_map.describe(pc)
+
+def _pack(values):
+    # Little-endian bytes of an array('I'), base64 encoded
+    data = array('I', values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return base64.b64encode(data.tobytes()).decode('ascii')
+
+def _unpack(text):
+    data = array('I')
+    data.frombytes(base64.b64decode(text))
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data
+
+def save_source_map(source_map, path):
+    with open(path, 'w') as file:
+        json.dump({'file': source_map.file_path, 'end': source_map.end,
+                   'starts': _pack(source_map.starts), 'lines': _pack(source_map.lines)}, file)
+
+def load_source_map(path):
+    with open(path, 'r') as file:
+        data = json.load(file)
+    source_map = SourceMap(data['file'])
+    source_map.starts = _unpack(data['starts'])
+    source_map.lines = _unpack(data['lines'])
+    source_map.end = data['end']
+    return source_map
+
+def build_source_map(file_path):
+    # Map of a source file on its own, without keeping the assembled words
+    from stream_asm import tokens, layout, emit
+    source_map = SourceMap(file_path)
+    labels, memory = layout(tokens(file_path))
+    for pc, word, line_number, text in emit(tokens(file_path), labels):
+        source_map.add(pc, line_number)
+    return source_map
+
+def main():
+    # source_map.py program.asm [out.map] [pc...]
+    file_path = sys.argv[1]
+    source_map = build_source_map(file_path)
+    print(f"{len(source_map)} ranges covering {source_map.end // 4} words")
+    pcs = []
+    for arg in sys.argv[2:]:
+        if arg.endswith('.map'):
+            save_source_map(source_map, arg)
+        else:
+            pcs.append(int(arg, 0))
+    for pc in pcs:
+        print(source_map.describe(pc))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import re
+import resource
+import sys
+import tempfile
+import time
+from array import array
+
+from main import convert_to_binary
+
+# Streaming assembler front end. Every stage is a generator over the source
+# file (read -> strip comments -> tokenize), and the file is simply read twice:
+# once to lay out labels and data, once to emit words. Nothing proportional to
+# the number of source lines is kept; memory is bounded by the symbol table,
+# the data image and the emitted words.
+DATA_BASE = 0x10010000
+
+def read_lines(file_path):
+    with open(file_path, 'r') as file:
+        for line_number, line in enumerate(file, 1):
+            yield line_number, line
+
+def strip_comments(lines):
+    for line_number, line in lines:
+        line = re.sub(r'#.*', '', line).strip()
+        if line:
+            yield line_number, line
+
+def tokenize(lines):
+    # Yields (line_number, kind, value): kind is 'section', 'label', 'data' or 'inst'
+    for line_number, line in lines:
+        if line.startswith(".data") or line.startswith(".text"):
+            yield line_number, 'section', line[1:5]
+            continue
+        if ':' in line:
+            label, line = line.split(':', 1)
+            yield line_number, 'label', label.strip()
+            line = line.strip()
+        if not line:
+            continue
+        if line.startswith('.'):
+            yield line_number, 'data', line
+        else:
+            yield line_number, 'inst', line
+
+def tokens(file_path):
+    return tokenize(strip_comments(read_lines(file_path)))
+
+def instruction_size(line):
+    # Words an instruction expands into, matching convert_to_binary
+    parts = [p for p in re.split(r'[,\s()]+', line) if p]
+    if parts[0] == 'la':
+        return 8
+    if parts[0] == 'li':
+        try:
+            value = int(parts[2], 0)
+        except (IndexError, ValueError):
+            return 4
+        return 4 if -32768 <= value <= 65535 else 8
+    return 4
+
+def data_cells(directive):
+    # Yields (offset, value) cells of a .word or .asciiz directive
+    if directive.startswith('.word'):
+        values = directive.replace('.word', '', 1).strip().split(',')
+        for index, value in enumerate(values):
+            yield 4 * index, int(value, 0)
+    elif directive.startswith('.asciiz'):
+        text = directive.replace('.asciiz', '', 1).strip().strip('"')
+        for index, char in enumerate(text):
+            yield index, ord(char)
+        yield len(text), 0
+
+def layout(token_stream):
+    # Pass 1: label addresses and the initial data image
+    labels = {}
+    memory = {}
+    pc = 0
+    address = DATA_BASE
+    data_mode = False
+    for line_number, kind, value in token_stream:
+        if kind == 'section':
+            data_mode = value == 'data'
+        elif kind == 'label':
+            labels[value] = address if data_mode else pc
+        elif kind == 'data':
+            if data_mode:
+                size = 0
+                for offset, cell in data_cells(value):
+                    memory[address + offset] = cell
+                    size = offset + (4 if value.startswith('.word') else 1)
+                address += size
+        elif not data_mode:
+            pc += instruction_size(value)
+    return labels, memory
+
+def emit(token_stream, labels):
+    # Pass 2: yields (pc, word, line_number, source text) for every text word
+    pc = 0
+    data_mode = False
+    for line_number, kind, value in token_stream:
+        if kind == 'section':
+            data_mode = value == 'data'
+        elif kind == 'inst' and not data_mode:
+            bin_inst = convert_to_binary(value, labels, pc)
+            if bin_inst is None:
+                print(f"Invalid instruction at line {line_number}: {value}")
+                bin_inst = [0] * (instruction_size(value) // 4)
+            elif not isinstance(bin_inst, list):
+                bin_inst = [bin_inst]
+            for word in bin_inst:
+                yield pc, word, line_number, value
+                pc += 4
+
+def assemble_file(file_path, source_map=None):
+    # Returns (words as array('I'), labels, memory); fills a source_map.SourceMap if given
+    labels, memory = layout(tokens(file_path))
+    words = array('I')
+    for pc, word, line_number, text in emit(tokens(file_path), labels):
+        words.append(word & 0xFFFFFFFF)
+        if source_map is not None:
+            source_map.add(pc, line_number)
+    return words, labels, memory
+
+def write_synthetic_source(file_path, line_count):
+    # Machine-generated style source: a big .word table plus straight-line code
+    table_lines = line_count // 5
+    with open(file_path, 'w') as file:
+        file.write(".data\n")
+        for index in range(table_lines):
+            file.write(f"t{index}: .word {index}, {index * 3}, {-index}  # table row\n")
+        file.write(".text\nmain:\n")
+        body = [
+            "    la $t0, t{n}",
+            "    lw $t1, 0($t0)",
+            "    addi $t1, $t1, {n}",
+            "    bne $t1, $zero, l{n}",
+            "l{n}: add $t2, $t2, $t1",
+        ]
+        written = table_lines
+        n = 0
+        while written < line_count:
+            for template in body:
+                file.write(template.format(n=n % max(table_lines, 1)) + "\n")
+            written += len(body)
+            n += 1
+
+def benchmark(line_count):
+    with tempfile.NamedTemporaryFile(suffix='.asm') as source:
+        write_synthetic_source(source.name, line_count)
+        start = time.perf_counter()
+        words, labels, memory = assemble_file(source.name)
+        elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Assembled {line_count} lines in {elapsed:.2f}s ({line_count / elapsed:.0f} lines/s)")
+    print(f"Words: {len(words)}  Labels: {len(labels)}  Data cells: {len(memory)}")
+    print(f"Peak RSS: {peak / 1024:.1f} MB")
+
+def main():
+    # stream_asm.py file.asm out.bin | stream_asm.py --bench [lines]
+    if sys.argv[1] == '--bench':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 5_000_000)
+        return
+    words, labels, memory = assemble_file(sys.argv[1])
+    if len(sys.argv) > 2:
+        # Raw big-endian image of the text segment
+        image = array('I', words)
+        if sys.byteorder == 'little':
+            image.byteswap()
+        with open(sys.argv[2], 'wb') as file:
+            image.tofile(file)
+    print(f"Assembled {len(words)} words, {len(labels)} labels, {len(memory)} data cells")
+
+if __name__ == "__main__":
+    main()
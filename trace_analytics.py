@@ -0,0 +1,247 @@
+import sys
+
+import numpy as np
+
+from decoder import decode
+from mem_trace import FETCH, LOAD, TraceWriter, trace_chunks, strides_by_pc, working_set_curve
+
+# Vectorized analyses over the chunked .npz traces written by mem_trace. Every
+# pass works a chunk at a time on whole columns; per-instruction facts (opcode,
+# registers read and written, whether it ends a basic block) are worked out
+# once per distinct instruction word and spread over a chunk with the inverse
+# index of np.unique. Opcode mix, basic blocks and register dependencies need
+# a trace recorded with fetches (mem_trace.py ... --fetch).
+CONTROL_OPS = ('beq', 'bne', 'j', 'jal', 'jr')
+RT_WRITERS = ('addi', 'andi', 'ori', 'lui', 'lw', 'll', 'sc')
+NO_DESTINATION = ('beq', 'bne', 'j', 'jr', 'sw', 'syscall', 'unknown')
+
+def word_facts(word):
+    # (op, destination register or -1, first source or -1, second source or -1, ends a block)
+    f = decode(word)
+    op = f['op']
+    if op in RT_WRITERS:
+        destination = f['rt']
+    elif op == 'jal':
+        destination = 31
+    elif op in NO_DESTINATION:
+        destination = -1
+    else:
+        destination = f['rd']
+    if op in ('j', 'jal', 'lui', 'syscall', 'unknown'):
+        sources = (2, -1) if op == 'syscall' else (-1, -1)  # syscall reads $v0
+    elif op in ('sll', 'srl'):
+        sources = (f['rt'], -1)
+    elif op in ('addi', 'andi', 'ori', 'lw', 'll', 'jr'):
+        sources = (f['rs'], -1)
+    else:
+        sources = (f['rs'], f['rt'])
+    return op, destination, sources[0], sources[1], op in CONTROL_OPS
+
+def fetch_columns(chunk, facts):
+    # (pc, per-fetch fact arrays) of a chunk; facts caches word -> word_facts
+    fetched = chunk['kind'] == FETCH
+    pc = chunk['pc'][fetched]
+    words, inverse = np.unique(chunk['value'][fetched], return_inverse=True)
+    table = []
+    for word in words.tolist():
+        if word not in facts:
+            facts[word] = word_facts(word)
+        table.append(facts[word])
+    columns = {
+        'destination': np.array([entry[1] for entry in table], dtype=np.int64)[inverse],
+        'source1': np.array([entry[2] for entry in table], dtype=np.int64)[inverse],
+        'source2': np.array([entry[3] for entry in table], dtype=np.int64)[inverse],
+        'control': np.array([entry[4] for entry in table], dtype=bool)[inverse],
+    }
+    return pc, columns
+
+def opcode_mix(prefix):
+    # {mnemonic: executions}
+    mix = {}
+    for chunk in trace_chunks(prefix):
+        fetched = chunk['kind'] == FETCH
+        words, counts = np.unique(chunk['value'][fetched], return_counts=True)
+        for word, count in zip(words.tolist(), counts.tolist()):
+            op = decode(word)['op']
+            mix[op] = mix.get(op, 0) + count
+    return mix
+
+def basic_blocks(prefix):
+    # {block start PC: [executions, instructions]}; a dynamic block starts
+    # wherever the PC does not follow on from the previous fetch, or the
+    # previous instruction was a branch or jump
+    blocks = {}
+    facts = {}
+    last_pc, last_control, last_start = None, True, None
+    for chunk in trace_chunks(prefix):
+        pc, columns = fetch_columns(chunk, facts)
+        if not len(pc):
+            continue
+        previous_pc = np.concatenate(([-1 if last_pc is None else last_pc], pc[:-1].astype(np.int64)))
+        previous_control = np.concatenate(([last_control], columns['control'][:-1]))
+        starts = np.flatnonzero((pc != previous_pc + 4) | previous_control)
+        # Fetches before the first leader finish the block left open by the previous chunk
+        head = starts[0] if len(starts) else len(pc)
+        if head:
+            blocks[last_start][1] += int(head)
+        lengths = np.diff(np.append(starts, len(pc)))
+        for start, length in zip(pc[starts].tolist(), lengths.tolist()):
+            entry = blocks.setdefault(start, [0, 0])
+            entry[0] += 1
+            entry[1] += length
+        if len(starts):
+            last_start = int(pc[starts[-1]])
+        last_pc, last_control = int(pc[-1]), bool(columns['control'][-1])
+    return blocks
+
+def data_line_chunks(prefix, line_shift=2):
+    # Load/store addresses at 2**line_shift granularity, in trace order, one array per chunk
+    for chunk in trace_chunks(prefix):
+        yield (chunk['address'][chunk['kind'] != FETCH] >> line_shift).astype(np.int64)
+
+def previous_access(lines):
+    # Index of the previous access to the same line, -1 for a first touch
+    order = np.argsort(lines, kind='stable')
+    ordered = lines[order]
+    same = ordered[1:] == ordered[:-1]
+    previous = np.full(len(lines), -1, dtype=np.int64)
+    previous[order[1:][same]] = order[:-1][same]
+    return previous
+
+def earlier_greater(values):
+    # counts[i] = number of j < i with values[j] > values[i], for values[i] >= 0.
+    # Bottom-up merge levels: at each level every right half block is counted
+    # against its left half in one searchsorted over keys offset by block
+    n = len(values)
+    counts = np.zeros(n, dtype=np.int64)
+    index = np.arange(n, dtype=np.int64)
+    shifted = values + 1  # -1 becomes 0 so offsets stay within a block
+    span = n + 2
+    query = values >= 0
+    size = 1
+    while size < n:
+        block = index // (2 * size)
+        right = (index // size) & 1 == 1
+        keys = np.sort(block[~right] * span + shifted[~right])
+        asking = right & query
+        base = block[asking] * span
+        counts[asking] += np.searchsorted(keys, base + span, 'left') - np.searchsorted(keys, base + shifted[asking], 'right')
+        size *= 2
+    return counts
+
+def reuse_distances(prefix, line_shift=2):
+    # LRU stack distance of every data access (distinct lines touched since the
+    # previous access to the same line), -1 for first touches; one array per
+    # chunk. Distinct lines in (p, i) are the accesses there whose own previous
+    # access is before p. Each chunk is worked out after the LRU stack carried
+    # over from the chunks before it: every line seen so far, once, in order of
+    # its last access, which gives the same distances as the whole trace would.
+    # Memory grows with the lines touched, not with the length of the trace
+    stack = np.zeros(0, dtype=np.int64)
+    for lines in data_line_chunks(prefix, line_shift):
+        if not len(lines):
+            continue
+        combined = np.concatenate((stack, lines))
+        previous = previous_access(combined)
+        index = np.arange(len(combined), dtype=np.int64)
+        distances = index - previous - 1 - earlier_greater(previous)
+        distances[previous < 0] = -1
+        yield distances[len(stack):]
+        # The last access of each line, in order, is the stack for the next chunk
+        _, last = np.unique(combined[::-1], return_index=True)
+        stack = combined[np.sort(len(combined) - 1 - last)]
+
+def reuse_histogram(distance_chunks):
+    # (labels, counts) with power-of-two buckets: cold, 0, 1, 2-3, 4-7, ...
+    cold = 0
+    buckets = np.zeros(0, dtype=np.int64)
+    for distances in distance_chunks:
+        cold += int(np.count_nonzero(distances < 0))
+        warm = distances[distances >= 0]
+        if len(warm):
+            # Bucket 0 holds distance 0, bucket k holds [2**(k-1), 2**k)
+            counts = np.bincount(np.where(warm > 0, np.floor(np.log2(np.maximum(warm, 1))).astype(np.int64) + 1, 0))
+            if len(counts) > len(buckets):
+                buckets = np.concatenate((buckets, np.zeros(len(counts) - len(buckets), dtype=np.int64)))
+            buckets[:len(counts)] += counts
+    labels = ['cold']
+    for bucket in range(len(buckets)):
+        low, high = (0, 0) if bucket == 0 else (1 << (bucket - 1), (1 << bucket) - 1)
+        labels.append(str(low) if low == high else f"{low}-{high}")
+    return labels, [cold] + buckets.tolist()
+
+def dependency_distances(prefix, max_distance=64):
+    # Histogram of instructions between a register's producer and each reader:
+    # counts[d] for d in 1..max_distance, counts[max_distance + 1] beyond that
+    counts = np.zeros(max_distance + 2, dtype=np.int64)
+    last_write = {}  # Register -> fetch index of its last producer
+    facts = {}
+    offset = 0
+    for chunk in trace_chunks(prefix):
+        pc, columns = fetch_columns(chunk, facts)
+        position = np.arange(offset, offset + len(pc), dtype=np.int64)
+        destination = columns['destination']
+        for register in range(1, 32):
+            writes = position[destination == register]
+            if register in last_write:
+                writes = np.concatenate(([last_write[register]], writes))
+            reads = position[(columns['source1'] == register) | (columns['source2'] == register)]
+            if len(writes) and len(reads):
+                producer = np.searchsorted(writes, reads, 'left') - 1
+                found = producer >= 0
+                distance = reads[found] - writes[producer[found]]
+                counts += np.bincount(np.minimum(distance, max_distance + 1), minlength=max_distance + 2)
+            if len(writes):
+                last_write[register] = int(writes[-1])
+        offset += len(pc)
+    return counts
+
+def load_strides(prefix):
+    return strides_by_pc(prefix, kinds=(LOAD,))
+
+def display_report(prefix, describe=None):
+    describe = describe or (lambda pc: f"PC {pc:08x}")
+    mix = opcode_mix(prefix)
+    total = sum(mix.values()) or 1
+    print("Opcode mix:")
+    for op, count in sorted(mix.items(), key=lambda item: -item[1]):
+        print(f"  {op:<8} {count:>10} {100.0 * count / total:6.1f}%")
+    print("Hottest basic blocks:")
+    blocks = basic_blocks(prefix)
+    for start, (executions, instructions) in sorted(blocks.items(), key=lambda item: -item[1][1])[:10]:
+        print(f"  {describe(start)}: {executions} executions, {instructions / executions:.1f} instructions each")
+    print("Reuse distance (4-byte lines):")
+    labels, counts = reuse_histogram(reuse_distances(prefix))
+    for label, count in zip(labels, counts):
+        print(f"  {label:>13} {count:>10}")
+    curve = working_set_curve(prefix)
+    if len(curve):
+        print(f"Working set per 10000 accesses: min {curve.min()}, mean {curve.mean():.1f}, max {curve.max()} words")
+    print("Load strides:")
+    for pc, (stride, share) in sorted(load_strides(prefix).items()):
+        print(f"  {describe(pc)}: stride {stride} ({100.0 * share:.1f}%)")
+    counts = dependency_distances(prefix)
+    reads = counts.sum() or 1
+    print("Register dependency distance:")
+    for distance in (1, 2, 3, 4):
+        print(f"  {distance:>3} {counts[distance]:>10} {100.0 * counts[distance] / reads:6.1f}%")
+    print(f"  5-{len(counts) - 2} {counts[5:-1].sum():>8} {100.0 * counts[5:-1].sum() / reads:6.1f}%")
+    print(f"  >{len(counts) - 2}  {counts[-1]:>8} {100.0 * counts[-1] / reads:6.1f}%")
+
+def main():
+    # trace_analytics.py <prefix> [program]: analyse a trace, recording it first if a program
+    # (.asm source, ELF or machine code image) is given
+    prefix = sys.argv[1]
+    describe = None
+    if len(sys.argv) > 2:
+        from machine import Machine
+        writer = TraceWriter(prefix, record_fetch=True)
+        machine = Machine.load(sys.argv[2], trace=writer, echo=False)
+        machine.run()
+        writer.close()
+        describe = machine.source_map.describe
+        print(f"Trace: {writer.records} records in {len(writer.chunks)} chunks")
+    display_report(prefix, describe)
+
+if __name__ == "__main__":
+    main()
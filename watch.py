@@ -0,0 +1,176 @@
+import difflib
+import os
+import re
+import sys
+import time
+
+from limits import create_limits
+from machine import Machine
+from main import convert_to_binary
+from memory import PagedMemory
+from stream_asm import DATA_BASE, tokenize, strip_comments, instruction_size, data_cells
+
+# Watch mode: re-run program.asm whenever it changes. Source lines keep their
+# tokens and encoded words between edits; after an edit only the changed lines
+# are re-tokenized, and only instructions that are new, moved (branches are PC
+# relative) or refer to a label whose address changed are re-encoded. The
+# machine's text is patched in place when the program size is unchanged.
+POLL_INTERVAL = 0.2
+WATCH_LIMITS = {'max_instructions': 50_000_000, 'max_seconds': 30}
+
+def label_reference(text):
+    # Name of the label an instruction refers to, if any
+    parts = [p for p in re.split(r'[,\s()]+', text) if p]
+    op = parts[0]
+    if op in ('beq', 'bne') and len(parts) > 3:
+        return parts[3]
+    if op in ('j', 'jal') and len(parts) > 1:
+        return parts[1]
+    if op in ('la', 'lw', 'sw') and len(parts) == 3:
+        return parts[2]
+    return None
+
+def tokenize_line(line_number, line):
+    records = []
+    for number, kind, value in tokenize(strip_comments([(line_number, line)])):
+        record = {'kind': kind, 'value': value}
+        if kind == 'inst':
+            relative = value.split()[0] in ('beq', 'bne')  # Encoding depends on its own PC
+            record.update(size=instruction_size(value), ref=label_reference(value), relative=relative,
+                          pc=None, encoded_pc=None, words=None)
+        records.append(record)
+    return records
+
+class IncrementalAssembler:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lines = []
+        self.records = []  # Per source line: list of token records
+        self.labels = {}
+        self.memory = {}
+        self.words = []
+
+    def update(self):
+        # Returns stats about the work done, plus {index: word} when the text
+        # kept its size (else None, meaning the whole image changed)
+        with open(self.file_path, 'r') as file:
+            new_lines = file.read().splitlines()
+        records = []
+        retokenized = 0
+        matcher = difflib.SequenceMatcher(None, self.lines, new_lines, autojunk=False)
+        for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+            if tag == 'equal':
+                records.extend(self.records[old_start:old_end])
+            else:
+                for line_number in range(new_start, new_end):
+                    records.append(tokenize_line(line_number + 1, new_lines[line_number]))
+                    retokenized += 1
+        old_labels, old_words, old_memory = self.labels, self.words, self.memory
+        self.lines, self.records = new_lines, records
+        self._layout()
+
+        moved_labels = {name for name in set(old_labels) | set(self.labels)
+                        if old_labels.get(name) != self.labels.get(name)}
+        words = []
+        encoded = 0
+        for line_records in self.records:
+            for record in line_records:
+                if record['kind'] != 'inst' or record['pc'] is None:
+                    continue
+                moved = record['relative'] and record['encoded_pc'] != record['pc']
+                if record['words'] is None or moved or record['ref'] in moved_labels:
+                    record['words'] = self._encode(record)
+                    record['encoded_pc'] = record['pc']
+                    encoded += 1
+                words.extend(record['words'])
+
+        changes = None
+        if len(words) == len(old_words):
+            changes = {index: word for index, (word, old) in enumerate(zip(words, old_words)) if word != old}
+        self.words = words
+        return {'retokenized': retokenized, 'encoded': encoded, 'moved_labels': len(moved_labels),
+                'changes': changes, 'data_changed': self.memory != old_memory}
+
+    def _layout(self):
+        # Same rules as stream_asm.layout, over the cached token records
+        labels = {}
+        memory = {}
+        pc = 0
+        address = DATA_BASE
+        data_mode = False
+        for line_records in self.records:
+            for record in line_records:
+                kind, value = record['kind'], record['value']
+                if kind == 'section':
+                    data_mode = value == 'data'
+                elif kind == 'label':
+                    labels[value] = address if data_mode else pc
+                elif kind == 'data':
+                    if data_mode:
+                        size = 0
+                        for offset, cell in data_cells(value):
+                            memory[address + offset] = cell
+                            size = offset + (4 if value.startswith('.word') else 1)
+                        address += size
+                elif not data_mode:
+                    record['pc'] = pc
+                    pc += record['size']
+                else:
+                    record['pc'] = None
+        self.labels, self.memory = labels, memory
+
+    def _encode(self, record):
+        bin_inst = convert_to_binary(record['value'], self.labels, record['pc'])
+        if bin_inst is None:
+            return [0] * (record['size'] // 4)
+        if not isinstance(bin_inst, list):
+            bin_inst = [bin_inst]
+        return [word & 0xFFFFFFFF for word in bin_inst]
+
+def watch(file_path, limits=WATCH_LIMITS, poll_interval=POLL_INTERVAL, runs=None):
+    assembler = IncrementalAssembler(file_path)
+    machine = None
+    last_mtime = None
+    completed = 0
+    while runs is None or completed < runs:
+        try:
+            mtime = os.stat(file_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime is None or mtime == last_mtime:
+            time.sleep(poll_interval)
+            continue
+        last_mtime = mtime
+
+        start = time.perf_counter()
+        stats = assembler.update()
+        if machine is None or stats['changes'] is None:
+            machine = Machine(assembler.words, assembler.memory, assembler.labels)
+        else:
+            machine.patch_words(stats['changes'])
+            # Labels the edit moved or added must resolve to their new addresses
+            machine.labels = dict(assembler.labels)
+            machine.symbols = dict(assembler.labels)
+            if stats['data_changed']:
+                machine.pristine = PagedMemory(assembler.memory)
+        machine.reset()
+        assemble_time = time.perf_counter() - start
+        print("=" * 80)
+        print(f"Reassembled {file_path} in {assemble_time * 1000:.1f} ms: "
+              f"{stats['retokenized']} lines re-tokenized, {stats['encoded']} words re-encoded, "
+              f"{stats['moved_labels']} labels moved")
+        termination = machine.run(create_limits(**limits))
+        print(f"Run: {termination['reason']} after {termination['instructions']} instructions "
+              f"in {termination['elapsed'] * 1000:.1f} ms")
+        completed += 1
+
+def main():
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "program.asm"
+    print(f"Watching {file_path} (Ctrl-C to stop)")
+    try:
+        watch(file_path)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import importlib
+import os
+import tempfile
+
+# Set-up shared by the process pools that run the engines (service.py,
+# fuzz.py): pass warm_worker as the pool initializer, with the engine modules
+# the pool will run as its initargs.
+
+def warm_worker(engines):
+    # Import every engine up front and give each worker its own directory for
+    # the binary_code.txt files the engines write
+    for engine in engines:
+        importlib.import_module(engine)
+    os.chdir(tempfile.mkdtemp(prefix='mips-worker-'))